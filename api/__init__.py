@@ -2,7 +2,8 @@ import os
 
 import dotenv
 import openai
-from langchain.chat_models import AzureChatOpenAI
+
+from src.azure_llm import ScheduledAzureChatOpenAI
 
 config = dotenv.dotenv_values('.env')
 openai.api_type = config["API_TYPE"]
@@ -12,7 +13,7 @@ os.environ['OPENAI_API_VERSION'] = config["OPENAI_API_VERSION"]
 os.environ['OPENAI_API_KEY'] = config["AZURE_OPENAI_API_KEY"]
 
 
-azure_llm = AzureChatOpenAI(
+azure_llm = ScheduledAzureChatOpenAI(
     deployment_name="gpt-35-turbo",
     temperature=0,
     max_tokens=2048
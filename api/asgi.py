@@ -0,0 +1,147 @@
+"""
+Memect Fin LLM OpenAI 抽取服务的异步模式（ASGI）。
+路由与 api/server.py 一致，LLM 调用在事件循环上并发执行，带并发上限、排队上限(超出返回 503)、请求超时(504)与优雅停机。
+
+    python -m api.asgi
+"""
+import asyncio
+import logging
+import os
+import traceback
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse
+
+from api import azure_llm
+from model import schema
+from src.chain_cache import chain_cache, load_schemas
+from src.utils.admission import AdmissionController, Overloaded
+from src.utils.http_client import async_http_client
+from src.utils.jobs import JobStore, QUEUED, job_view, make_payload, save_upload
+from src.utils.rate_limit import rate_limiter
+
+logging.basicConfig(level=logging.INFO)
+
+asgi_max_concurrency = int(os.getenv('ASGI_MAX_CONCURRENCY', 256))
+asgi_max_queue = int(os.getenv('ASGI_MAX_QUEUE', 512))
+asgi_request_timeout = float(os.getenv('ASGI_REQUEST_TIMEOUT', 120))
+asgi_shutdown_timeout = float(os.getenv('ASGI_SHUTDOWN_TIMEOUT', 30))
+
+admission = AdmissionController(asgi_max_concurrency, asgi_max_queue, asgi_request_timeout)
+job_store = JobStore()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    chain_cache.prewarm(azure_llm, load_schemas(schema).values())  # 启动时预先渲染各 schema 的提示词
+    yield
+    # uvicorn 在处理中的请求完成（或超过 ASGI_SHUTDOWN_TIMEOUT 被取消）后才执行到这里
+    await async_http_client.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+class Server(uvicorn.Server):
+    """收到停机信号时先标记准入控制为停机中，已建立的 keep-alive 连接上的新请求直接返回 503"""
+
+    def handle_exit(self, sig, frame):
+        admission.draining = True
+        super().handle_exit(sig, frame)
+
+
+def error_response(status, msg, headers=None):
+    return JSONResponse({"code": 0, "msg": msg, "success": 'false'}, status_code=status, headers=headers)
+
+
+@app.get("/api/v1/llm", response_class=HTMLResponse)
+async def index():
+    return "<p>Memect Fin LLM openai.</p>"
+
+
+@app.get("/api/v1/llm/model_list")
+async def model():
+    return {"data": list(load_schemas(schema)), "code": 1, "msg": "success", "success": 'true'}
+
+
+@app.get("/api/v1/llm/metrics")
+async def metrics():
+    """LLM 调用限流调度与服务准入的指标"""
+    return {"data": {"rate_limit": rate_limiter.metrics(), "admission": admission.metrics(),
+                     "jobs": job_store.counts()},
+            "code": 1, "msg": "success", "success": 'true'}
+
+
+@app.post("/api/v1/llm/extraction")
+async def extract(request: Request):
+    """
+    基于大模型抽取文本字段。
+    text
+    model_name
+    """
+    try:
+        args = await request.json()
+        txt, model_name = args['text'], args['model_name']
+        extract_schema = load_schemas(schema)[model_name]
+    except Exception as e:
+        return error_response(400, f"invalid request: {e!r}")
+
+    extraction_chain = chain_cache.get(azure_llm, extract_schema)
+    try:
+        result = (await admission.run(lambda: extraction_chain.apredict_and_parse(text=txt)))['data']
+    except Overloaded as e:
+        return error_response(503, str(e), headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+        return error_response(504, f"extraction timed out after {admission.timeout}s")
+    except Exception as e:
+        logging.error(traceback.format_exc())
+        return error_response(500, str(e))
+    logging.info(f"提取结果为：{result}")
+    result = dict(result or {})
+    result['success'] = 'true'
+    # 0 未开始，1 提取成功
+    result['code'] = 1
+    result['msg'] = "extract success."
+    return result
+
+
+@app.post("/api/v1/llm/jobs", status_code=202)
+async def submit_job(request: Request):
+    """
+    提交抽取任务，立即返回任务 id，由 worker 进程(python -m src.job_worker)异步执行。
+    multipart 表单上传文档 file，或以 JSON 提交文本 text
+    model_name: schema 名称
+    llm_type: azure(默认) 或 memect
+    """
+    try:
+        if request.headers.get('content-type', '').startswith('multipart/form-data'):
+            args = await request.form()
+            upload = args.get('file')
+            file = save_upload(upload.filename, await upload.read()) if upload else None
+        else:
+            args, file = await request.json(), None
+        payload = make_payload(args.get('model_name'), load_schemas(schema), args.get('llm_type', 'azure'),
+                               text=args.get('text'), file=file)
+    except Exception as e:
+        return error_response(400, f"invalid request: {e!r}")
+    job_id = job_store.submit(payload)
+    logging.info(f"submit job {job_id}, model_name:{payload['model_name']}")
+    return {"data": {"job_id": job_id, "status": QUEUED}, "code": 1, "msg": "success", "success": 'true'}
+
+
+@app.get("/api/v1/llm/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询抽取任务的状态、进度(done_chunks/total_chunks)与结果"""
+    job = job_store.get(job_id)
+    if job is None:
+        return error_response(404, f"job {job_id} not found")
+    return {"data": job_view(job), "code": 1, "msg": "success", "success": 'true'}
+
+
+if __name__ == '__main__':
+    logging.info('Prepare to start asgi server, ')
+    # 收到 SIGTERM/SIGINT 后 uvicorn 停止接收新连接，最多等待 ASGI_SHUTDOWN_TIMEOUT 秒让处理中的请求完成，再执行 lifespan 的停机逻辑
+    Server(uvicorn.Config(app, host=os.getenv('API_HOST', '127.0.0.1'), port=int(os.getenv('API_PORT', 9910)),
+                          timeout_graceful_shutdown=asgi_shutdown_timeout)).run()
@@ -3,15 +3,25 @@ Memect Fin LLM OpenAI
 """
 import json
 import logging
+import os
 import traceback
 
-from flask import Flask, request
-from kor import create_extraction_chain
+from flask import Flask, Response, request, stream_with_context
 
 from api import azure_llm
 from model import schema
+from src.chain_cache import chain_cache, load_schemas
+from src.utils.fanout import imap_unordered
+from src.utils.jobs import JobStore, QUEUED, job_view, make_payload, save_upload
+from src.utils.rate_limit import rate_limiter
 app = Flask(__name__)
 
+# 批量抽取：每个批次的并发数、单批最大条数
+extraction_batch_workers = int(os.getenv('EXTRACTION_BATCH_WORKERS', 8))
+extraction_batch_max_items = int(os.getenv('EXTRACTION_BATCH_MAX_ITEMS', 10000))
+
+job_store = JobStore()
+
 logging.basicConfig(level=logging.INFO)
 
 
@@ -22,10 +32,16 @@ def index():
 
 @app.route("/api/v1/llm/model_list")
 def model():
-    schema_name = [item for item in dir(schema) if item.endswith('schema')]
+    schema_name = list(load_schemas(schema))
     return {"data": schema_name, "code": 1, "msg": "success", "success": 'true'}
 
 
+@app.route("/api/v1/llm/metrics")
+def metrics():
+    """LLM 调用限流调度的排队数、等待时长与被限流次数"""
+    return {"data": rate_limiter.metrics(), "code": 1, "msg": "success", "success": 'true'}
+
+
 @app.route("/api/v1/llm/extraction", methods=['POST'])
 def extract():
     """
@@ -38,9 +54,9 @@ def extract():
     try:
         args = request.get_json()
         txt, model_name = args['text'], args['model_name']
-        extract_schema = getattr(schema, model_name)
+        extract_schema = load_schemas(schema)[model_name]
         # logging.info(f"schema: {extract_schema}")
-        extraction_chain = create_extraction_chain(azure_llm, extract_schema, encoder_or_encoder_class='json')
+        extraction_chain = chain_cache.get(azure_llm, extract_schema)
         # extract from text
         result = extraction_chain.predict_and_parse(text=txt)['data']
         logging.info(f"提取结果为：{result}")
@@ -58,6 +74,78 @@ def extract():
         logging.error(traceback.format_exc())
 
 
+@app.route("/api/v1/llm/extraction/batch", methods=['POST'])
+def extract_batch():
+    """
+    批量抽取文本字段，按完成顺序以 NDJSON 流式返回每条结果。
+    texts: 文本列表，元素为字符串或 {"id": 业务标识, "text": 文本}
+    model_name: schema 名称
+    每行结果为 {"index": 下标, "id": 业务标识, "success": "true", "data": 抽取结果}，
+    失败时为 {"index", "id", "success": "false", "msg": 错误信息}，不影响其余文本。
+    """
+    args = request.get_json(silent=True) or {}
+    texts, model_name = args.get('texts'), args.get('model_name')
+    schemas = load_schemas(schema)
+    if not isinstance(texts, list) or not texts or len(texts) > extraction_batch_max_items \
+            or model_name not in schemas:
+        msg = f"texts must be a non-empty list of at most {extraction_batch_max_items} items " \
+              f"and model_name one of the schema names."
+        return {"code": 0, "msg": msg, "success": 'false'}, 400
+    items = [item if isinstance(item, dict) else {"text": item} for item in texts]
+    extraction_chain = chain_cache.get(azure_llm, schemas[model_name])
+
+    def extract_item(item):
+        return extraction_chain.predict_and_parse(text=item['text'])['data']
+
+    def generate():
+        failed = 0
+        for result in imap_unordered(extract_item, items, workers=extraction_batch_workers):
+            line = {"index": result.name, "id": items[result.name].get('id')}
+            if result.error is None:
+                line.update(success='true', code=1, data=result.value)
+            else:
+                failed += 1
+                logging.error(f"extract item {result.name} failed: {result.error!r}")
+                line.update(success='false', code=0, msg=str(result.error))
+            yield json.dumps(line, ensure_ascii=False) + '\n'
+        logging.info(f"batch extraction finished, total:{len(items)}, failed:{failed}")
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route("/api/v1/llm/jobs", methods=['POST'])
+def submit_job():
+    """
+    提交抽取任务，立即返回任务 id，由 worker 进程(python -m src.job_worker)异步执行。
+    multipart 表单上传文档 file，或以 JSON 提交文本 text
+    model_name: schema 名称
+    llm_type: azure(默认) 或 memect
+    """
+    upload = request.files.get('file')
+    args = request.form if upload else (request.get_json(silent=True) or {})
+    try:
+        file = save_upload(upload.filename, upload.read()) if upload else None
+        payload = make_payload(args.get('model_name'), load_schemas(schema), args.get('llm_type', 'azure'),
+                               text=args.get('text'), file=file)
+    except ValueError as e:
+        return {"code": 0, "msg": str(e), "success": 'false'}, 400
+    job_id = job_store.submit(payload)
+    logging.info(f"submit job {job_id}, model_name:{payload['model_name']}")
+    return {"data": {"job_id": job_id, "status": QUEUED}, "code": 1, "msg": "success", "success": 'true'}, 202
+
+
+@app.route("/api/v1/llm/jobs/<job_id>")
+def get_job(job_id):
+    """查询抽取任务的状态、进度(done_chunks/total_chunks)与结果"""
+    job = job_store.get(job_id)
+    if job is None:
+        return {"code": 0, "msg": f"job {job_id} not found", "success": 'false'}, 404
+    return {"data": job_view(job), "code": 1, "msg": "success", "success": 'true'}
+
+
+chain_cache.prewarm(azure_llm, load_schemas(schema).values())  # 启动时预先渲染各 schema 的提示词
+
+
 if __name__ == '__main__':
     logging.info('Prepare to start server, ')
     app.run(host='127.0.0.1', port=9910, debug=True)
@@ -0,0 +1,3 @@
+"""
+离线压测工具：stubs 提供模拟 OpenAI/Azure、Memect 与文档解析接口的桩服务，driver 负责并发施压与统计。
+"""
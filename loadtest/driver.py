@@ -0,0 +1,255 @@
+"""
+压测驱动：并发回放请求记录或按比例生成的对话/抽取/上传请求，分阶段统计吞吐量与 p50/p95/p99 延迟。
+Gradio 服务(web/v2/chat_server.py)通过队列 websocket 协议调用，抽取服务(api/server.py)通过 HTTP 调用。
+
+    python -m loadtest.driver --web http://127.0.0.1:9999 --api http://127.0.0.1:9910 \\
+        --mix chat=6,doc_chat=2,upload=1,extraction=1 --requests 200 --concurrency 16 \\
+        --stub-stats http://127.0.0.1:7001,http://127.0.0.1:7002,http://127.0.0.1:7003
+
+回放文件每行一个 JSON 请求，kind 为 chat|doc_chat|upload|extraction，其余字段见 SCENARIOS 中对应函数的参数。
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+Sample = namedtuple('Sample', ['stage', 'latency', 'ttft', 'ok', 'error'])
+
+QUERIES = ['公司的主营业务是什么?', '营业收入同比增长多少?', '净利润是多少?', '公司面临哪些主要风险?',
+           '帮我总结一下这份文档', '文因互联是做什么的?']
+EXTRACTION_TEXT = '张三，男，1975年出生，现任文因互联董事长，2023年3月因肺炎入院治疗。'
+
+
+class GradioQueueClient:
+    """
+    Gradio 3.x 队列接口的最小客户端，按事件的 api_name 调用
+    Args:
+        url: Gradio 服务地址
+        timeout: 单次调用超时(秒)
+    """
+
+    def __init__(self, url, timeout=300):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        config = requests.get(f'{self.url}/config', timeout=10).json()
+        self.fn_index = {dep['api_name']: i for i, dep in enumerate(config['dependencies']) if dep.get('api_name')}
+
+    def predict(self, api_name, data, session_hash=None):
+        """
+        调用事件并等待完成
+        Args:
+            api_name: 事件的 api_name
+            data: 各输入组件的值，gr.State 输入由服务端按会话填充，传 None 占位
+            session_hash: 会话标识，为空时使用新会话；同一会话的事件共享 gr.State
+
+        Returns: (输出数据, 首个流式输出的耗时，非流式为 None)
+        """
+        from websockets.sync.client import connect
+
+        fn_index = self.fn_index[api_name]
+        session_hash = session_hash or uuid.uuid4().hex[:10]
+        start = time.perf_counter()
+        ttft = None
+        with connect(self.url.replace('http', 'ws', 1) + '/queue/join', max_size=None,
+                     open_timeout=self.timeout) as ws:
+            while True:
+                message = json.loads(ws.recv(timeout=self.timeout))
+                msg = message['msg']
+                if msg == 'send_hash':
+                    ws.send(json.dumps({'fn_index': fn_index, 'session_hash': session_hash}))
+                elif msg == 'send_data':
+                    ws.send(json.dumps({'data': data, 'fn_index': fn_index, 'session_hash': session_hash,
+                                        'event_data': None}))
+                elif msg == 'queue_full':
+                    raise RuntimeError('queue full')
+                elif msg == 'process_generating' and ttft is None:
+                    ttft = time.perf_counter() - start
+                elif msg == 'process_completed':
+                    if not message.get('success'):
+                        raise RuntimeError((message.get('output') or {}).get('error'))
+                    return message['output']['data'], ttft
+
+
+class Target:
+    """被压测的服务"""
+
+    def __init__(self, web_url=None, api_url=None, timeout=300):
+        self.web = GradioQueueClient(web_url, timeout) if web_url else None
+        self.api_url = api_url.rstrip('/') if api_url else None
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.tmp_dir = tempfile.mkdtemp(prefix='loadtest-')
+        self.session_hash = uuid.uuid4().hex[:10]  # 上传与文档问答共用的会话，文档 hash 保存在会话状态中
+
+
+def chat(target, text=None, task='问答', model_type='azure'):
+    """场景问答 task_with_chat"""
+    _, ttft = target.web.predict('task_with_chat', [text or random.choice(QUERIES), task, model_type])
+    return ttft
+
+
+def doc_chat(target, query=None, model_type='azure'):
+    """文档问答，基于本会话最近一次上传的文档"""
+    _, ttft = target.web.predict('doc_chat', [[[query or random.choice(QUERIES), None]], model_type, None],
+                                 target.session_hash)
+    return ttft
+
+
+def upload(target, path=None, unique=True):
+    """上传并预处理文档；未指定文件时生成模拟 pdf，unique 为假时重复上传同一文档以命中已入库分支"""
+    if path is None:
+        path = os.path.join(target.tmp_dir, f'{uuid.uuid4().hex if unique else "doc"}.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4 loadtest ' + os.path.basename(path).encode())
+    with open(path, 'rb') as f:
+        data = base64.b64encode(f.read()).decode()
+    file_data = {'name': os.path.basename(path), 'data': f'data:application/octet-stream;base64,{data}',
+                 'is_file': False, 'orig_name': os.path.basename(path)}
+    target.web.predict('upload', [[], file_data], target.session_hash)
+    return None
+
+
+def extraction(target, text=EXTRACTION_TEXT, model_name='person_schema'):
+    """文本抽取 /api/v1/llm/extraction"""
+    response = target.session.post(f'{target.api_url}/api/v1/llm/extraction',
+                                   json={'text': text, 'model_name': model_name}, timeout=target.timeout)
+    response.raise_for_status()
+    return None
+
+
+SCENARIOS = {'chat': chat, 'doc_chat': doc_chat, 'upload': upload, 'extraction': extraction}
+
+
+def parse_mix(spec):
+    """解析 "chat=6,upload=1" 形式的请求比例"""
+    mix = {}
+    for item in spec.split(','):
+        name, weight = item.split('=')
+        if name not in SCENARIOS:
+            raise ValueError(f'unknown scenario {name}, expected one of {list(SCENARIOS)}')
+        mix[name] = float(weight)
+    return mix
+
+
+def synthetic_requests(mix, n, seed=0):
+    """按比例随机生成 n 个请求"""
+    rng = random.Random(seed)
+    names, weights = zip(*mix.items())
+    return [{'kind': rng.choices(names, weights)[0]} for _ in range(n)]
+
+
+def load_requests(path):
+    """读取回放文件，跳过 kind 不是已知场景的行"""
+    with open(path, encoding='utf-8') as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return [item for item in items if item.get('kind') in SCENARIOS]
+
+
+def run(target, items, concurrency=8, scenarios=SCENARIOS):
+    """
+    并发执行请求
+    Args:
+        target: Target
+        items: List[dict]，kind 为场景名，其余字段为场景参数
+        concurrency: 并发数
+        scenarios: {场景名: f(target, **params) -> 首 token 耗时或 None}
+
+    Returns: (List[Sample], 总耗时)
+    """
+    samples, lock = [], threading.Lock()
+
+    def execute(item):
+        params = {k: v for k, v in item.items() if k != 'kind'}
+        start = time.perf_counter()
+        try:
+            ttft, ok, error = scenarios[item['kind']](target, **params), True, None
+        except Exception as e:
+            ttft, ok, error = None, False, repr(e)
+        sample = Sample(item['kind'], time.perf_counter() - start, ttft, ok, error)
+        with lock:
+            samples.append(sample)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(execute, items))
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed):
+    """按阶段统计请求数、错误数、吞吐量(成功请求/秒)及延迟分位数(秒)"""
+    report = {}
+    for stage in sorted({s.stage for s in samples}):
+        group = [s for s in samples if s.stage == stage]
+        latencies = [s.latency for s in group if s.ok]
+        ttfts = [s.ttft for s in group if s.ok and s.ttft is not None]
+        row = {'count': len(group), 'errors': len(group) - len(latencies),
+               'throughput': len(latencies) / elapsed if elapsed else 0.0}
+        for q in (50, 95, 99):
+            row[f'p{q}'] = float(np.percentile(latencies, q)) if latencies else None
+        if ttfts:
+            row['ttft_p50'], row['ttft_p95'] = float(np.percentile(ttfts, 50)), float(np.percentile(ttfts, 95))
+        report[stage] = row
+    return report
+
+
+def format_report(report):
+    def fmt(value):
+        return '-' if value is None else f'{value:.3f}'
+
+    lines = [f"{'stage':<12}{'count':>7}{'errors':>7}{'rps':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'ttft50':>8}{'ttft95':>8}"]
+    for stage, row in report.items():
+        lines.append(f"{stage:<12}{row['count']:>7}{row['errors']:>7}{row['throughput']:>8.2f}"
+                     f"{fmt(row['p50']):>8}{fmt(row['p95']):>8}{fmt(row['p99']):>8}"
+                     f"{fmt(row.get('ttft_p50')):>8}{fmt(row.get('ttft_p95')):>8}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay or synthesize load against the chat and extraction servers.')
+    parser.add_argument('--web', help='Gradio chat server url, e.g. http://127.0.0.1:9999')
+    parser.add_argument('--api', help='extraction api server url, e.g. http://127.0.0.1:9910')
+    parser.add_argument('--replay', help='JSONL file of requests to replay')
+    parser.add_argument('--mix', default='chat=6,doc_chat=2,upload=1,extraction=1')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--stub-stats', default='', help='comma separated stub urls to report server side stages')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    items = load_requests(args.replay) if args.replay else synthetic_requests(parse_mix(args.mix), args.requests,
+                                                                               args.seed)
+    if not args.web:
+        items = [item for item in items if item['kind'] == 'extraction']
+    if not args.api:
+        items = [item for item in items if item['kind'] != 'extraction']
+    # 文档问答依赖已上传的文档，先上传一份
+    target = Target(args.web, args.api, args.timeout)
+    if args.web and any(item['kind'] == 'doc_chat' for item in items):
+        upload(target, unique=False)
+
+    samples, elapsed = run(target, items, args.concurrency)
+    print(f'{len(samples)} requests in {elapsed:.1f}s, concurrency {args.concurrency}')
+    print(format_report(summarize(samples, elapsed)))
+    errors = [s.error for s in samples if not s.ok]
+    if errors:
+        print(f'first errors: {errors[:3]}')
+    for url in filter(None, args.stub_stats.split(',')):
+        print(f'\n{url}')
+        for route, row in requests.get(f'{url.rstrip("/")}/stats', timeout=10).json().items():
+            print(f"  {route:<16}count={row['count']} errors={row['errors']} "
+                  f"p50={row['p50']:.3f} p95={row['p95']:.3f} p99={row['p99']:.3f}")
+
+
+if __name__ == '__main__':
+    main()
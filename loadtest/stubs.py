@@ -0,0 +1,313 @@
+"""
+离线压测用的桩服务，模拟 OpenAI/Azure（对话、embedding）、Memect 大模型与 pdf2doc 文档解析接口。
+每个接口的耗时服从可配置的对数正态分布，并按错误率随机返回 429/500；GET /stats 返回各接口的调用次数与耗时分位数。
+
+    python -m loadtest.stubs --openai-port 7001 --memect-port 7002 --parser-port 7003 --env-file .env.loadtest
+"""
+import argparse
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+import zipfile
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+
+EMBEDDING_DIM = 1536
+
+
+class LatencyProfile:
+    """
+    接口耗时与错误率
+    Args:
+        median: 耗时中位数(秒)
+        p95: 耗时 p95(秒)，不小于 median，相等时耗时固定
+        error_rate: 随机失败的比例
+        error_status: 失败时返回的状态码
+    """
+
+    def __init__(self, median=0.0, p95=None, error_rate=0.0, error_status=429):
+        self.median = median
+        p95 = median if p95 is None else max(p95, median)
+        self.sigma = math.log(p95 / median) / 1.645 if median > 0 and p95 > median else 0.0
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(random.gauss(0, self.sigma)) if self.sigma else self.median
+
+    def failed(self):
+        return random.random() < self.error_rate
+
+    @classmethod
+    def parse(cls, spec):
+        """从 "median,p95,error_rate" 形式的字符串解析，如 "0.8,3,0.01" """
+        values = [float(v) for v in spec.split(',')] if spec else []
+        return cls(*values)
+
+
+class StubServer:
+    """
+    桩服务基类，子类实现 handle(path, body, headers) -> (status, content_type, data | 可迭代的分块)
+    Args:
+        host: 监听地址
+        port: 端口，0 表示随机端口
+        profile: LatencyProfile
+    """
+
+    name = 'stub'
+
+    def __init__(self, host='127.0.0.1', port=0, profile=None):
+        self.profile = profile or LatencyProfile()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _reply(self, status, content_type, data):
+                if isinstance(data, (bytes, str)):
+                    data = data.encode('utf-8') if isinstance(data, str) else data
+                    self.send_response(status)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for chunk in data:
+                    chunk = chunk.encode('utf-8')
+                    self.wfile.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n')
+                    self.wfile.flush()
+                self.wfile.write(b'0\r\n\r\n')
+
+            def do_GET(self):
+                if urlsplit(self.path).path == '/stats':
+                    self._reply(200, 'application/json', json.dumps(stub.stats()))
+                else:
+                    self._reply(404, 'application/json', '{}')
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                path = urlsplit(self.path).path
+                route = stub.route(path)
+                start = time.perf_counter()
+                time.sleep(stub.profile.sample())
+                if stub.profile.failed():
+                    with stub._lock:
+                        stub.errors[route] += 1
+                    self.send_response(stub.profile.error_status)
+                    self.send_header('Retry-After', '1')
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', '2')
+                    self.end_headers()
+                    self.wfile.write(b'{}')
+                    return
+                status, content_type, data = stub.handle(path, body, self.headers)
+                self._reply(status, content_type, data)
+                with stub._lock:
+                    stub.latencies[route].append(time.perf_counter() - start)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def route(self, path):
+        """统计用的接口名称"""
+        return path
+
+    def handle(self, path, body, headers):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._lock:
+            return {route: {"count": len(values), "errors": self.errors[route],
+                            "p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+                            "p99": float(np.percentile(values, 99))}
+                    for route, values in self.latencies.items() if values}
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fake_embedding(text, dim=EMBEDDING_DIM):
+    """由文本 hash 生成的确定性单位向量，相同文本得到相同向量"""
+    seed = int.from_bytes(hashlib.md5(text.encode('utf-8')).digest()[:4], 'little')
+    vec = np.random.default_rng(seed).standard_normal(dim).astype('float32')
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+def fake_reply(prompt, words=40):
+    """回显提示词末尾的模拟回答"""
+    return f'模拟回答：{prompt.strip()[-words:]}'
+
+
+class OpenAIStub(StubServer):
+    """
+    OpenAI 与 Azure OpenAI 接口：
+    /v1/chat/completions、/v1/embeddings 及 /openai/deployments/{deployment}/chat/completions|embeddings，支持 stream
+    """
+
+    name = 'openai'
+
+    def route(self, path):
+        return 'embeddings' if path.endswith('/embeddings') else 'chat'
+
+    def handle(self, path, body, headers):
+        request = json.loads(body or b'{}')
+        if path.endswith('/embeddings'):
+            inputs = request.get('input', [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            data = [{"object": "embedding", "index": i, "embedding": fake_embedding(str(text))}
+                    for i, text in enumerate(inputs)]
+            tokens = sum(len(str(text)) for text in inputs)
+            return 200, 'application/json', json.dumps(
+                {"object": "list", "data": data, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+        prompt = ''.join(m.get('content', '') for m in request.get('messages', []))
+        reply = fake_reply(prompt)
+        if request.get('stream'):
+            def chunks():
+                for i in range(0, len(reply), 4):
+                    time.sleep(self.profile.median / 20)  # 模拟逐 token 生成
+                    delta = {"choices": [{"index": 0, "delta": {"content": reply[i:i + 4]}, "finish_reason": None}]}
+                    yield f'data: {json.dumps(delta, ensure_ascii=False)}\n\n'
+                yield 'data: [DONE]\n\n'
+            return 200, 'text/event-stream', chunks()
+        tokens = len(prompt) + len(reply)
+        return 200, 'application/json', json.dumps(
+            {"id": "stub", "object": "chat.completion", "model": request.get('model') or 'stub',
+             "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+             "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(reply), "total_tokens": tokens}},
+            ensure_ascii=False)
+
+
+class MemectStub(StubServer):
+    """
+    Memect 大模型接口：单条 {"prompt"} -> {"response"}，批量 {"prompts"} -> {"responses"}，
+    stream 为真时以换行分隔的 JSON 返回累计文本。批量请求与单条请求耗时相同，模拟一次前向计算。
+    """
+
+    name = 'memect'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_sizes = []
+
+    def route(self, path):
+        return 'generate'
+
+    def handle(self, path, body, headers):
+        request = json.loads(body or b'{}')
+        if 'prompts' in request:
+            self.batch_sizes.append(len(request['prompts']))
+            return 200, 'application/json', json.dumps(
+                {"responses": [fake_reply(p) for p in request['prompts']]}, ensure_ascii=False)
+        self.batch_sizes.append(1)
+        reply = fake_reply(request.get('prompt', ''))
+        if request.get('stream'):
+            return 200, 'application/x-ndjson', (
+                json.dumps({"response": reply[:i]}, ensure_ascii=False) + '\n' for i in range(4, len(reply) + 4, 4))
+        return 200, 'application/json', json.dumps({"response": reply}, ensure_ascii=False)
+
+
+class ParserStub(StubServer):
+    """
+    文档解析接口：docx2pdf 原样返回文件内容，pdf2doc 返回含 table.txt 的 zip，文本由上传内容生成
+    """
+
+    name = 'parser'
+
+    def __init__(self, *args, paragraphs=200, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.paragraphs = paragraphs
+
+    def route(self, path):
+        return path.rstrip('/').split('/')[-1]
+
+    def handle(self, path, body, headers):
+        if path.rstrip('/').endswith('docx2pdf'):
+            return 200, 'application/pdf', body
+        seed = hashlib.md5(body).hexdigest()
+        lines = [f'第{i + 1}段 文档{seed[:8]}的模拟内容，营业收入同比增长{i % 30}%，净利润为{i * 3}万元。'
+                 for i in range(self.paragraphs)]
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zf.writestr('table.txt', '\n'.join(lines))
+        return 200, 'application/zip', buffer.getvalue()
+
+
+def env_lines(openai_url, memect_url, parser_url):
+    """指向桩服务的 .env 配置"""
+    return [
+        'API_TYPE=azure',
+        'AZURE_OPENAI_API_KEY=stub',
+        f'OPENAI_API_BASE={openai_url}',
+        'OPENAI_API_VERSION=2023-03-15-preview',
+        'AZURE_MODEL_NAME=gpt-35-turbo',
+        'OFFICE_OPENAI_API_KEY=stub',
+        'OFFICE_MODEL_NAME=gpt-3.5-turbo',
+        'EMBEDDING_MODEL_NAME=text-embedding-ada-002',
+        f'MEM_FIN_OPENAI_API={memect_url}/generate',
+        f'API_SERVER={parser_url}/',
+        'HOST=127.0.0.1',
+        'PORT=9999',
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Start stub LLM, embedding and parser servers for load testing.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--openai-port', type=int, default=7001)
+    parser.add_argument('--memect-port', type=int, default=7002)
+    parser.add_argument('--parser-port', type=int, default=7003)
+    parser.add_argument('--openai-latency', default='0.8,3,0.01', help='median,p95,error_rate')
+    parser.add_argument('--memect-latency', default='0.5,2,0')
+    parser.add_argument('--parser-latency', default='1,4,0')
+    parser.add_argument('--env-file', help='write a .env pointing the app at the stubs')
+    args = parser.parse_args()
+
+    stubs = [OpenAIStub(args.host, args.openai_port, LatencyProfile.parse(args.openai_latency)),
+             MemectStub(args.host, args.memect_port, LatencyProfile.parse(args.memect_latency)),
+             ParserStub(args.host, args.parser_port, LatencyProfile.parse(args.parser_latency))]
+    for stub in stubs:
+        stub.start()
+        print(f'{stub.name} stub listening on {stub.url}')
+    if args.env_file:
+        with open(args.env_file, 'w') as f:
+            f.write('\n'.join(env_lines(*(stub.url for stub in stubs))) + '\n')
+        print(f'wrote {args.env_file}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for stub in stubs:
+            stub.stop()
+
+
+if __name__ == '__main__':
+    main()
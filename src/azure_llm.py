@@ -0,0 +1,29 @@
+"""
+经过全局限流调度的 Azure OpenAI 聊天模型，供 langchain/kor 链使用
+"""
+from langchain.chat_models import AzureChatOpenAI
+
+from src.utils.rate_limit import rate_limiter, BATCH
+from src.utils.tokens import count_tokens
+
+
+class ScheduledAzureChatOpenAI(AzureChatOpenAI):
+    """AzureChatOpenAI whose requests go through the shared rate limiter.
+    The limiter retries 429s and the transient errors langchain would retry, so langchain's own retry is disabled by default.
+    """
+
+    priority: int = BATCH
+    max_retries: int = 1
+
+    def _estimate_tokens(self, messages):
+        return sum(count_tokens(m.content, self.deployment_name) for m in messages) + (self.max_tokens or 0)
+
+    def _generate(self, messages, stop=None, run_manager=None):
+        generate = super()._generate
+        return rate_limiter.call(lambda: generate(messages, stop, run_manager),
+                                 tokens=self._estimate_tokens(messages), priority=self.priority)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None):
+        agenerate = super()._agenerate
+        return await rate_limiter.acall(lambda: agenerate(messages, stop, run_manager),
+                                        tokens=self._estimate_tokens(messages), priority=self.priority)
@@ -0,0 +1,131 @@
+"""
+kor 抽取链缓存。
+按 (schema id, schema 内容 hash, 模型) 缓存已创建的抽取链，提示词中与输入无关的部分（类型描述、格式说明、示例）只渲染一次；
+schema 内容变化后 hash 随之变化，旧的链自动失效。
+"""
+import hashlib
+import importlib
+import json
+import logging
+import os
+import threading
+
+from kor import create_extraction_chain
+from kor.prompts import ExtractionPromptTemplate
+from pydantic import PrivateAttr
+
+
+class CachedExtractionPromptTemplate(ExtractionPromptTemplate):
+    """ExtractionPromptTemplate that renders the instruction segment and examples once."""
+
+    _instruction: str = PrivateAttr(default=None)
+    _examples: list = PrivateAttr(default=None)
+
+    def format_instruction_segment(self, node):
+        if node is not self.node:
+            return super().format_instruction_segment(node)
+        if self._instruction is None:
+            self._instruction = super().format_instruction_segment(node)
+        return self._instruction
+
+    def generate_encoded_examples(self, node):
+        if node is not self.node:
+            return super().generate_encoded_examples(node)
+        if self._examples is None:
+            self._examples = super().generate_encoded_examples(node)
+        return self._examples
+
+    def prerender(self):
+        """渲染并缓存提示词的静态部分"""
+        self.format_instruction_segment(self.node)
+        self.generate_encoded_examples(self.node)
+        return self
+
+
+def schema_hash(schema):
+    """schema 内容 hash，repr 包含各节点的类型、描述与示例"""
+    return hashlib.sha256(repr(schema).encode('utf-8')).hexdigest()[:16]
+
+
+def model_key(llm):
+    """模型标识：类名及 langchain 的模型参数（部署名/模型名/接口地址、temperature、max_tokens 等），参数不同的同名模型不共用抽取链"""
+    params = getattr(llm, '_identifying_params', None)
+    if params is None:
+        params = {'name': getattr(llm, 'deployment_name', None) or getattr(llm, 'endpoint_url', None) or
+                  getattr(llm, 'model_name', None) or ''}
+    return f'{type(llm).__name__}:{json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)}'
+
+
+class ChainCache:
+    """抽取链缓存，线程安全"""
+
+    def __init__(self):
+        self._chains = {}  # (schema id, schema hash, model) -> LLMChain
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, llm, schema):
+        """
+        获取 schema 与模型对应的抽取链，不存在时创建
+        Args:
+            llm: langchain 模型
+            schema: kor Object
+
+        Returns: LLMChain
+        """
+        key = (schema.id, schema_hash(schema), model_key(llm))
+        with self._lock:
+            chain = self._chains.get(key)
+            if chain is not None:
+                self.hits += 1
+                return chain
+            self.misses += 1
+            # 同一 schema id 与模型的旧版本链已过期
+            for stale in [k for k in self._chains if k[0] == key[0] and k[2] == key[2]]:
+                logging.info(f"schema {key[0]} changed, drop compiled chain {stale[1]}")
+                del self._chains[stale]
+            chain = create_extraction_chain(llm, schema, encoder_or_encoder_class='json')
+            prompt = chain.prompt
+            chain.prompt = CachedExtractionPromptTemplate(
+                input_variables=prompt.input_variables, output_parser=prompt.output_parser, encoder=prompt.encoder,
+                node=prompt.node, type_descriptor=prompt.type_descriptor, input_formatter=prompt.input_formatter,
+                instruction_template=prompt.instruction_template).prerender()
+            self._chains[key] = chain
+            return chain
+
+    def prewarm(self, llm, schemas):
+        """预先创建各 schema 的抽取链"""
+        for schema in schemas:
+            self.get(llm, schema)
+        logging.info(f"prewarmed {len(self._chains)} extraction chains")
+
+    def invalidate(self, schema_id=None):
+        """清除指定 schema（为空时清除全部）的抽取链"""
+        with self._lock:
+            for key in [k for k in self._chains if schema_id is None or k[0] == schema_id]:
+                del self._chains[key]
+
+    def __len__(self):
+        return len(self._chains)
+
+
+chain_cache = ChainCache()
+_schema_mtimes = {}
+
+
+def load_schemas(module):
+    """
+    获取模块中所有以 schema 结尾的对象，模块文件修改后重新加载
+    Args:
+        module: schema 定义模块，如 model.schema
+
+    Returns: {name: kor Object}
+    """
+    path = module.__file__
+    mtime = os.path.getmtime(path)
+    if _schema_mtimes.setdefault(path, mtime) != mtime:
+        logging.info(f"{path} changed, reload schemas")
+        module = importlib.reload(module)
+        _schema_mtimes[path] = mtime
+    return {name: getattr(module, name) for name in dir(module) if name.endswith('schema')}
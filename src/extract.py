@@ -7,19 +7,24 @@ import asyncio
 import json
 import logging
 
-import requests
-from kor import create_extraction_chain, extract_from_documents
+from kor import extract_from_documents
 from langchain import PromptTemplate, LLMChain, Modal
 from langchain.llms import openai
 from langchain.schema import Document
 from typing import List
 
 from data import prompt_text
-from src.utils.doc import parser_doc, read_file, hashcode_with_file
+from src.azure_llm import ScheduledAzureChatOpenAI
+from src.chain_cache import chain_cache
+from src.memect_llm import call_memect, stream_memect
+from src.utils.doc import parser_doc, hashcode_with_file, iter_doc_contents
+from src.utils.extraction import merge_extractions, split_documents
+from src.utils.http_client import async_http_client
+from src.utils.response_cache import response_cache
+from src.utils.tokens import count_tokens
 import os
 import dotenv
 
-from langchain.chat_models import AzureChatOpenAI
 
 logger = logging.getLogger()
 logging.basicConfig(level=logging.INFO, format='[%(pastime)s] {%(pathname)s:%(lineno)d} %(levelness)s - %(message)s',
@@ -34,9 +39,12 @@ openai.api_version = config["OPENAI_API_VERSION"]
 # fix 尽量用这种方式设置azure的可以，测试了下openai_api_key不起作用。
 os.environ['OPENAI_API_KEY'] = config["AZURE_OPENAI_API_KEY"]
 endpoint_url = os.getenv('MEM_FIN_OPENAI_API')
+MEMECT_MAX_LENGTH = 2048
+MEMECT_TEMPERATURE = 0.2
+extract_concurrency = int(os.getenv('EXTRACT_CONCURRENCY', 8))
 
 
-azure_llm = AzureChatOpenAI(
+azure_llm = ScheduledAzureChatOpenAI(
         deployment_name="gpt-35-turbo",
         temperature=0,
         max_tokens=2000,
@@ -49,56 +57,108 @@ azure_llm = AzureChatOpenAI(
 class MyModal(Modal):
 
     def _call(self, prompt: str, stop=None) -> str:
-        body = {"prompt": prompt, "max_length": 2048, "temperature": 0.2}
-        response = requests.post(self.endpoint_url, json=body)
-        return response.json()['response']
+        return call_memect(self.endpoint_url, prompt, MEMECT_MAX_LENGTH, MEMECT_TEMPERATURE)
+
+    async def _acall(self, prompt: str, stop=None) -> str:
+        body = {"prompt": prompt, "max_length": MEMECT_MAX_LENGTH, "temperature": MEMECT_TEMPERATURE}
+        return (await async_http_client.post_json(self.endpoint_url, json=body))['response']
+
+    def _stream(self, prompt: str):
+        """流式生成，逐步返回累计文本"""
+        return stream_memect(self.endpoint_url, prompt)
 
 
 def parser_pdf(file_path) -> List[Document]:
+    """
+    解析文档并按模型上下文切分为抽取窗口
+    """
     logging.info("加载并解析文件……")
     file_name = file_path.name
     hashcode = hashcode_with_file(file_name)
     parser_file = parser_doc(file_name, f'data/store/{hashcode}')
-    contents: list = read_file(parser_file)
-    txt = ''.join(contents)
-    docs = [Document(page_content=txt)]
+    docs = split_documents(iter_doc_contents(parser_file))
+    logging.info(f"文档切分为{len(docs)}个抽取窗口")
     return docs
 
 
 def extract_doc(schema, llm_type, docs=[]):
     """
-    基于大模型进行文档信息抽取
+    基于大模型进行文档信息抽取，各窗口并发抽取后按 schema 合并去重
     """
     mem_llm = MyModal(endpoint_url=endpoint_url)
     llm_obj = mem_llm if llm_type == 'memect' else azure_llm            # azure_llm
-    logging.info("Create extract chain")
-    extraction_chain = create_extraction_chain(llm_obj, schema, encoder_or_encoder_class='json')
+    logging.info("Get extract chain")
+    extraction_chain = chain_cache.get(llm_obj, schema)
     logging.info("Start extract from doc……")
-    extraction_results = asyncio.run(
-        extract_from_documents(
-            chain=extraction_chain,
-            documents=docs,
-            use_uid=False,
-            max_concurrency=2
-        )
-    )
-    ret = json.dumps(extraction_results[0]['data'], ensure_ascii=False, indent=4)
+
+    async def run():
+        try:
+            return await extract_from_documents(
+                chain=extraction_chain,
+                documents=docs,
+                use_uid=False,
+                max_concurrency=extract_concurrency,
+                return_exceptions=True
+            )
+        finally:
+            await async_http_client.close()  # 连接池与本次事件循环绑定，结束前关闭
+
+    extraction_results = asyncio.run(run())
+    failed = [r for r in extraction_results if isinstance(r, Exception)]
+    for e in failed:
+        logging.error(f"extract chunk failed: {e!r}")
+    if failed and len(failed) == len(extraction_results):
+        raise failed[0]
+    merged = merge_extractions(schema, [r['data'] for r in extraction_results if not isinstance(r, Exception)])
+    ret = json.dumps(merged, ensure_ascii=False, indent=4)
     logging.info(ret)
     return ret
 
 
+def memect_cache_key(endpoint_url, query):
+    """memect 请求的回复缓存键，temperature > 0 且未开启采样缓存时返回 None"""
+    if not response_cache.cacheable(MEMECT_TEMPERATURE):
+        return None
+    return response_cache.make_key('memect', endpoint_url, [query], MEMECT_TEMPERATURE, MEMECT_MAX_LENGTH)
+
+
 def chat_mem_fin_llm(endpoint_url, input_text, task_type):
     """
     基于langchain调用memect LLM openapi
     """
-    mem_llm = MyModal(endpoint_url=endpoint_url)
     query = f"{prompt_text[task_type]} {input_text.strip()}"
+    key = memect_cache_key(endpoint_url, query)
+    response = response_cache.get(key) if key else None
+    if response is not None:
+        return response
+    mem_llm = MyModal(endpoint_url=endpoint_url)
     prompt_template = PromptTemplate(input_variables=["query"],
                                      template=f'{{query}}')
     llm_chain = LLMChain(llm=mem_llm, prompt=prompt_template)
     response = llm_chain.run(query)
+    if key:
+        response_cache.set(key, response)
     return response
 
 
+def stream_mem_fin_llm(endpoint_url, input_text, task_type):
+    """
+    流式调用memect LLM openapi，逐步返回累计生成的文本
+    """
+    query = f"{prompt_text[task_type]} {input_text.strip()}"
+    key = memect_cache_key(endpoint_url, query)
+    response = response_cache.get(key) if key else None
+    if response is not None:
+        yield response
+        return
+    mem_llm = MyModal(endpoint_url=endpoint_url)
+    response = ''
+    for response in mem_llm._stream(query):
+        yield response
+    logging.info(f"memect tokens:{count_tokens(query) + count_tokens(response)}")
+    if key and response:
+        response_cache.set(key, response)
+
+
 if __name__ == '__main__':
     pass
@@ -1,16 +1,35 @@
 """Creates the Example and GPT classes for a user to interface with the OpenAI
 API."""
 
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
 import openai
 import uuid
 
 from openai.api_requestor import APIRequestor
 
 from data import prompt_text
+from src.utils.rate_limit import rate_limiter, INTERACTIVE
+from src.utils.response_cache import response_cache
+from src.utils.tokens import count_tokens
+
+# 每次请求最多带入的示例数及示例部分的 token 上限
+few_shot_k = int(os.getenv('FEW_SHOT_K', 4))
+few_shot_token_budget = int(os.getenv('FEW_SHOT_TOKEN_BUDGET', 1000))
+
+
+# Immutable credentials of one OpenAI/Azure deployment, passed with every request instead of the openai globals.
+ModelClient = namedtuple('ModelClient', ['api_key', 'api_type', 'api_base', 'api_version'],
+                         defaults=['open_ai', 'https://api.openai.com/v1', None])
 
 
 def set_openai_key(key, api_version=None, api_base='https://api.openai.com/v1', api_type='open_ai'):
-    """Sets OpenAI key."""
+    """Sets OpenAI key globally. Not safe with concurrent requests; prefer passing a ModelClient to GPT."""
     openai.api_key = key
     openai.api_version = api_version
     openai.api_type = api_type
@@ -48,6 +67,95 @@ class Example:
         return f'Q:{self.input}\nA:{self.output}'
 
 
+def embed_texts(texts):
+    """Embeds texts with the configured embedding model."""
+    from src.utils.embedding import get_embedding
+    return np.array([vec for _, vec in get_embedding(texts)[0]], dtype='float32')
+
+
+class ExampleSelector:
+    """Selects the examples most relevant to a query within a token budget.
+    Example inputs are embedded once; the formatted prime text is cached per selected example set.
+    Safe to share between threads as long as callers pass a snapshot of the examples.
+    """
+
+    def __init__(self, format_example, k=few_shot_k, token_budget=few_shot_token_budget, model='gpt-3.5-turbo',
+                 embed=embed_texts, max_cached=256):
+        self.format_example = format_example
+        self.k = k
+        self.token_budget = token_budget
+        self.model = model
+        self.embed = embed
+        self.max_cached = max_cached
+        self._formatted = {}  # id -> (text, tokens)
+        self._vectors = {}  # id -> normalized input embedding
+        self._prime_cache = {}  # tuple of ids -> prime text
+        self._lock = threading.Lock()
+
+    def _format(self, ex):
+        formatted = self._formatted.get(ex.get_id())
+        if formatted is None:
+            text = self.format_example(ex)
+            formatted = self._formatted[ex.get_id()] = (text, count_tokens(text, self.model))
+        return formatted
+
+    def _embed(self, examples):
+        """Returns {id: normalized input embedding}, embedding only the examples not seen before."""
+        vectors = {ex.get_id(): self._vectors.get(ex.get_id()) for ex in examples}
+        missing = [ex for ex in examples if vectors[ex.get_id()] is None]
+        if missing:
+            embedded = self.embed([ex.get_input() for ex in missing])
+            embedded = embedded / np.maximum(np.linalg.norm(embedded, axis=1, keepdims=True), 1e-12)
+            for ex, vec in zip(missing, embedded):
+                vectors[ex.get_id()] = self._vectors[ex.get_id()] = vec
+        return vectors
+
+    def select(self, examples, query):
+        """Returns the ids of the selected examples, in the order they were added.
+        If the embedding service fails, the most recently added examples are used instead of failing the request.
+        """
+        tokens = {i: self._format(ex)[1] for i, ex in examples.items()}
+        if len(examples) <= self.k and sum(tokens.values()) <= self.token_budget:
+            return list(examples)
+        try:
+            vectors = self._embed(examples.values())
+            query_vec = self.embed([query])[0]
+        except Exception as e:
+            logging.warning(f"example embedding failed, use the latest examples: {e!r}")
+            ranked = list(reversed(examples))
+        else:
+            query_vec = query_vec / max(np.linalg.norm(query_vec), 1e-12)
+            ranked = sorted(examples, key=lambda i: -float(vectors[i] @ query_vec))
+        chosen, used = set(), 0
+        for i in ranked:
+            if len(chosen) == self.k:
+                break
+            if used + tokens[i] <= self.token_budget:
+                chosen.add(i)
+                used += tokens[i]
+        return [i for i in examples if i in chosen]
+
+    def prime_text(self, examples, query=None):
+        """Formats the examples selected for the query, or all examples if no query is given."""
+        ids = tuple(self.select(examples, query) if query else examples)
+        with self._lock:
+            text = self._prime_cache.get(ids)
+        if text is None:
+            text = "".join(self._format(examples[i])[0] for i in ids)
+            with self._lock:
+                if len(self._prime_cache) >= self.max_cached:
+                    self._prime_cache.clear()
+                self._prime_cache[ids] = text
+        return text
+
+    def forget(self, id):
+        """Drops the cached data of a deleted example."""
+        with self._lock:
+            self._formatted.pop(id, None)
+            self._vectors.pop(id, None)
+            self._prime_cache = {ids: text for ids, text in self._prime_cache.items() if id not in ids}
+
+
 class GPT:
     """The main class for a user to interface with the OpenAI API.
     A user can add examples and set parameters of the API request.
@@ -61,7 +169,11 @@ class GPT:
                  input_suffix="\n",
                  output_prefix="",
                  output_suffix="\n\n",
-                 append_output_prefix_to_query=False):
+                 append_output_prefix_to_query=False,
+                 cache=None,
+                 selector=None,
+                 priority=INTERACTIVE,
+                 client=None):
         self.examples = {}
         self.engine = engine
         self.temperature = temperature
@@ -73,19 +185,27 @@ class GPT:
         self.append_output_prefix_to_query = append_output_prefix_to_query
         self.stop = (output_suffix + input_prefix).strip()
         self.role = 'user'
+        self.cache = cache if cache is not None else response_cache
+        self.selector = selector or ExampleSelector(self.format_example, model=engine)
+        self.priority = priority
+        self.client = client
+        self._examples_lock = threading.Lock()  # examples are added and deleted while other requests read them
 
     def add_example(self, ex):
         """Adds an example to the object.
         Example must be an instance of the Example class.
         """
         assert isinstance(ex, Example), "Please create an Example object."
-        self.examples[ex.get_id()] = ex
+        with self._examples_lock:
+            self.examples[ex.get_id()] = ex
         return ex
 
     def delete_example(self, id):
         """Delete example with the specific id."""
-        if id in self.examples:
-            del self.examples[id]
+        with self._examples_lock:
+            deleted = self.examples.pop(id, None)
+        if deleted is not None:
+            self.selector.forget(id)
 
     def get_example(self, id):
         """Get a single example."""
@@ -93,12 +213,19 @@ class GPT:
 
     def get_all_examples(self):
         """Returns all examples as a list of dicts."""
-        return {k: v.as_dict() for k, v in self.examples.items()}
+        with self._examples_lock:
+            examples = dict(self.examples)
+        return {k: v.as_dict() for k, v in examples.items()}
 
-    def get_prime_text(self):
-        """Formats all examples to prime the model."""
-        return "".join(
-            [self.format_example(ex) for ex in self.examples.values()])
+    def get_prime_text(self, query=None):
+        """Formats the examples to prime the model.
+        With a query, only the most relevant examples within the few-shot token budget are used.
+        """
+        with self._examples_lock:
+            examples = dict(self.examples)  # selection runs on a snapshot so concurrent edits cannot break it
+        if not examples:
+            return ''
+        return self.selector.prime_text(examples, query)
 
     def get_engine(self):
         """Returns the engine specified for the API."""
@@ -114,7 +241,7 @@ class GPT:
 
     def craft_query(self, prompt):
         """Creates the query for the API request."""
-        q = self.get_prime_text() + self.input_prefix + prompt + self.input_suffix
+        q = self.get_prime_text(prompt) + self.input_prefix + prompt + self.input_suffix
         if self.append_output_prefix_to_query:
             q = q + self.output_prefix
         return q
@@ -136,28 +263,88 @@ class GPT:
         Generate prompt info
         """
         prompt = f"{prompt_text[task_type]} {text.strip()}"
-        if self.get_prime_text():
-            q = self.get_prime_text() + self.input_prefix + prompt + self.input_suffix
+        prime_text = self.get_prime_text(text)
+        if prime_text:
+            q = prime_text + self.input_prefix + prompt + self.input_suffix
         else:
             q = prompt + self.output_suffix
         return q
 
+    def get_request_params(self, text, task_type, context, model_type):
+        """Builds the keyword arguments of the ChatCompletion request."""
+        if self.client is not None:
+            model_type = self.client.api_type
+        return dict(engine=self.get_engine() if model_type == 'azure' else None,
+                    model=self.get_engine() if model_type == 'open_ai' else None,
+                    messages=self.get_query_message(self.generate_prompt(text, task_type), context=context),
+                    max_tokens=self.get_max_tokens(),
+                    temperature=self.get_temperature())
+
+    def create_completion(self, params, **kwargs):
+        """Calls the ChatCompletion API through the shared rate limiter.
+        The credentials of the client, if any, are passed per request so that concurrent requests never share state.
+        """
+        tokens = sum(count_tokens(m['content'], self.get_engine()) for m in params['messages']) + params['max_tokens']
+        if self.client is not None:
+            kwargs.update(self.client._asdict())
+        return rate_limiter.call(lambda: openai.ChatCompletion.create(**kwargs, **params),
+                                 tokens=tokens, priority=self.priority)
+
     def submit_request(self, text, task_type, context, model_type):
         """Calls the OpenAI API with the specified parameters.
         """
-        response = openai.ChatCompletion.create(engine=self.get_engine() if model_type == 'azure' else None,
-                                                model=self.get_engine() if model_type == 'open_ai' else None,
-                                                messages=self.get_query_message(self.generate_prompt(text, task_type),
-                                                                                context=context),
-                                                max_tokens=self.get_max_tokens(),
-                                                temperature=self.get_temperature()
-                                                )
+        response = self.create_completion(self.get_request_params(text, task_type, context, model_type))
         return response
 
+    def get_cache_key(self, params, model_type):
+        """Returns the response cache key of the request, or None if it must not be cached."""
+        if not self.cache.cacheable(params['temperature']):
+            return None
+        return self.cache.make_key(model_type, self.get_engine(), params['messages'],
+                                   params['temperature'], params['max_tokens'])
+
     def get_top_reply(self, text, task_type, context='', model_type=''):
-        """Obtains the best result as returned by the API."""
-        response = self.submit_request(text, task_type, context, model_type)
-        return response.choices[0]['message']['content'], response['usage']['total_tokens']
+        """Obtains the best result as returned by the API.
+        Cached replies are returned with 0 tokens consumed.
+        """
+        params = self.get_request_params(text, task_type, context, model_type)
+        key = self.get_cache_key(params, model_type)
+        reply = self.cache.get(key) if key else None
+        if reply is not None:
+            return reply, 0
+        response = self.create_completion(params)
+        reply = response.choices[0]['message']['content']
+        if key:
+            self.cache.set(key, reply)
+        return reply, response['usage']['total_tokens']
+
+    def stream_top_reply(self, text, task_type, context='', model_type=''):
+        """Streams the best result as it is generated.
+        Yields (partial_reply, None) for every new token and finally (reply, total_tokens).
+        The streaming API does not report usage, so tokens are counted locally.
+        """
+        params = self.get_request_params(text, task_type, context, model_type)
+        key = self.get_cache_key(params, model_type)
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            yield cached, 0
+            return
+        start = time.perf_counter()
+        reply = ''
+        for chunk in self.create_completion(params, stream=True):
+            delta = chunk.choices[0].get('delta', {}).get('content') if chunk.choices else None
+            if not delta:
+                continue
+            if not reply:
+                logging.info(f"time to first token: {time.perf_counter() - start:.2f}s")
+            reply += delta
+            yield reply, None
+        prompt_tokens = sum(count_tokens(m['content'], self.get_engine()) for m in params['messages'])
+        total_tokens = prompt_tokens + count_tokens(reply, self.get_engine())
+        logging.info(f"stream finished in {time.perf_counter() - start:.2f}s, tokens={total_tokens}")
+        if key and reply:
+            self.cache.set(key, reply)
+        yield reply, total_tokens
 
     def format_example(self, ex):
         """Formats the input, output pair."""
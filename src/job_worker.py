@@ -0,0 +1,129 @@
+"""
+抽取任务 worker。
+从任务队列领取任务，解析文档并切分为抽取窗口，并发抽取尚未完成的窗口，每个窗口完成后立即保存结果，全部完成后按 schema 合并。
+worker 崩溃或被强制结束后，任务在租约过期后由其他 worker 接管并从已保存的进度继续。
+同一主机上的 worker、Web 与 API 进程通过 LLM_LIMITER_PATH 共享 LLM 限流配额，LLM_RPM/LLM_TPM 按整个部署配置。
+
+    python -m src.job_worker --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import traceback
+
+from model import schema
+from src.chain_cache import chain_cache, load_schemas
+from src.extract import MyModal, azure_llm, endpoint_url, extract_concurrency
+from src.utils.chunker import DocContent
+from src.utils.doc import parser_doc, hashcode_with_file, iter_doc_contents
+from src.utils.doc_enum import DocField
+from src.utils.extraction import merge_extractions, split_documents
+from src.utils.http_client import async_http_client
+from src.utils.jobs import JobStore, extract_chunks, job_store_path
+
+# worker 进程数、无任务时的轮询间隔(秒)
+job_workers = int(os.getenv('JOB_WORKERS', 2))
+job_poll_interval = float(os.getenv('JOB_POLL_INTERVAL', 1))
+
+
+def load_job_docs(payload):
+    """解析任务的文本或文档，切分为抽取窗口。切分结果只取决于输入与配置，任务恢复时窗口编号不变"""
+    if 'text' in payload:
+        contents = (DocContent(DocField.TEXT.value, None, line.strip())
+                    for line in payload['text'].splitlines() if line.strip())
+    else:
+        file_name = payload['file']
+        contents = iter_doc_contents(parser_doc(file_name, f'data/store/{hashcode_with_file(file_name)}'))
+    return split_documents(contents)
+
+
+def _keep_lease(store, job_id, worker, stop):
+    while not stop.wait(store.lease / 3):
+        if not store.renew(job_id, worker):
+            logging.warning(f"job {job_id} lease lost by {worker}")
+            return
+
+
+def run_job(store, job, worker):
+    """
+    执行一个任务，成功时保存合并后的结果，失败时记录错误并按剩余次数重新排队
+    """
+    job_id, payload = job['id'], job['payload']
+    stop = threading.Event()
+    threading.Thread(target=_keep_lease, args=(store, job_id, worker, stop), daemon=True).start()
+    try:
+        extract_schema = load_schemas(schema)[payload['model_name']]
+        llm = MyModal(endpoint_url=endpoint_url) if payload['llm_type'] == 'memect' else azure_llm
+        extraction_chain = chain_cache.get(llm, extract_schema)
+        docs = load_job_docs(payload)
+        store.set_total(job_id, len(docs))
+        logging.info(f"{worker} start job {job_id}, attempt {job['attempts']}, chunks {len(docs)}, "
+                     f"saved {job['done_chunks']}")
+
+        async def extract(text):
+            return (await extraction_chain.apredict_and_parse(text=text))['data']
+
+        async def run():
+            try:
+                return await extract_chunks(store, job_id, docs, extract, extract_concurrency)
+            finally:
+                await async_http_client.close()  # 连接池与本次事件循环绑定，结束前关闭
+
+        results = asyncio.run(run())
+        merged = merge_extractions(extract_schema, [results[i] for i in sorted(results)])
+        if store.complete(job_id, worker, merged):
+            logging.info(f"{worker} finished job {job_id}")
+    except Exception as e:
+        logging.error(traceback.format_exc())
+        status = store.fail(job_id, worker, repr(e))
+        logging.info(f"{worker} failed job {job_id}, status: {status}")
+    finally:
+        stop.set()
+
+
+def work(worker, stop, store_path=job_store_path, poll_interval=job_poll_interval):
+    """worker 主循环，stop 置位后执行完当前任务退出"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 由主进程统一处理中断
+    store = JobStore(store_path)
+    logging.info(f"{worker} started")
+    while not stop.is_set():
+        job = store.claim(worker)
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        run_job(store, job, worker)
+    store.close()
+    logging.info(f"{worker} stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run extraction job workers.')
+    parser.add_argument('--workers', type=int, default=job_workers)
+    parser.add_argument('--store', default=job_store_path)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    processes = [context.Process(target=work, args=(f'{socket.gethostname()}-{os.getpid()}-{i}', stop, args.store))
+                 for i in range(args.workers)]
+    for process in processes:
+        process.start()
+
+    def shutdown(*_):
+        logging.info('stopping workers after their current jobs')
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,11 +1,90 @@
 """
 Memect 语言模型
 """
-import requests as requests
+import json
+import logging
+import os
+import threading
+import time
+
 from langchain import Modal, LLMChain, PromptTemplate
 
 from data import prompt_text
 from src.gpt import Example
+from src.utils.http_client import http_client, async_http_client
+from src.utils.micro_batch import MicroBatcher
+
+# 接口支持批量请求 {"prompts": [...]} -> {"responses": [...]} 时开启客户端微批处理
+memect_batch = os.getenv('MEMECT_BATCH', 'false').lower() in ('true', '1', 't')
+memect_batch_size = int(os.getenv('MEMECT_BATCH_SIZE', 8))
+memect_batch_wait_ms = float(os.getenv('MEMECT_BATCH_WAIT_MS', 20))
+memect_batch_in_flight = int(os.getenv('MEMECT_BATCH_IN_FLIGHT', 4))  # 同时发送的批次数
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def stream_memect(endpoint_url, prompt, max_length=2048, temperature=0.2):
+    """
+    流式请求 Memect LLM，逐步返回累计生成的文本。
+    流式接口以换行分隔的 JSON（或 SSE data: 行）返回 {"response": 累计文本}；
+    不支持流式的接口返回单个 JSON，此时一次性返回完整结果。
+    """
+    body = {"prompt": prompt, "max_length": max_length, "temperature": temperature, "stream": True}
+    start = time.perf_counter()
+    with http_client.post(endpoint_url, json=body, stream=True) as response:
+        response.raise_for_status()
+        if 'application/json' in response.headers.get('Content-Type', ''):
+            logging.info(f"time to first token: {time.perf_counter() - start:.2f}s (non-streaming endpoint)")
+            yield response.json()['response']
+            return
+        first = True
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith('data:'):
+                line = line[len('data:'):].strip()
+            if not line:
+                continue
+            if line == '[DONE]':
+                break
+            if first:
+                logging.info(f"time to first token: {time.perf_counter() - start:.2f}s")
+                first = False
+            yield json.loads(line)['response']
+
+
+def batch_memect(endpoint_url, prompts, max_length=2048, temperature=0.2):
+    """
+    批量请求 Memect LLM
+    Args:
+        endpoint_url: 接口地址
+        prompts: List[str]
+
+    Returns: List[str] 与 prompts 一一对应
+    """
+    body = {"prompts": prompts, "max_length": max_length, "temperature": temperature}
+    response = http_client.post(endpoint_url, json=body)
+    response.raise_for_status()
+    return response.json()['responses']
+
+
+def get_memect_batcher(endpoint_url, max_length=2048, temperature=0.2):
+    """获取接口地址与生成参数对应的微批处理器，同一组参数的请求才能合并"""
+    key = (endpoint_url, max_length, temperature)
+    with _batchers_lock:
+        if key not in _batchers:
+            _batchers[key] = MicroBatcher(lambda prompts: batch_memect(endpoint_url, prompts, max_length, temperature),
+                                          max_batch_size=memect_batch_size, max_wait_ms=memect_batch_wait_ms,
+                                          max_in_flight=memect_batch_in_flight)
+        return _batchers[key]
+
+
+def call_memect(endpoint_url, prompt, max_length=2048, temperature=0.2):
+    """请求 Memect LLM，开启 MEMECT_BATCH 时与并发请求合并为批量请求"""
+    if memect_batch:
+        return get_memect_batcher(endpoint_url, max_length, temperature).submit(prompt).result()
+    body = {"prompt": prompt, "max_length": max_length, "temperature": temperature}
+    response = http_client.post(endpoint_url, json=body)
+    response.raise_for_status()
+    return response.json()['response']
 
 
 class MemectLLM(Modal):
@@ -14,9 +93,15 @@ class MemectLLM(Modal):
     endpoint_url: str
 
     def _call(self, prompt: str, stop=None) -> str:
+        return call_memect(self.endpoint_url, prompt)
+
+    async def _acall(self, prompt: str, stop=None) -> str:
         body = {"prompt": prompt, "max_length": 2048, "temperature": 0.2}
-        response = requests.post(self.endpoint_url, json=body)
-        return response.json()['response']
+        return (await async_http_client.post_json(self.endpoint_url, json=body))['response']
+
+    def _stream(self, prompt: str):
+        """流式生成，逐步返回累计文本"""
+        return stream_memect(self.endpoint_url, prompt)
 
     def add_example(self, ex):
         """Adds an example to the object.
@@ -0,0 +1,76 @@
+"""
+异步服务的准入控制。
+限制同时处理的请求数，排队请求超过上限时直接拒绝（返回 503 由调用方处理），单个请求（含排队时间）超时后取消；
+停机时拒绝新请求，已接收的请求由服务器在停机等待时长内处理完毕。
+"""
+import asyncio
+
+
+class Overloaded(Exception):
+    """排队已满或服务正在停机"""
+
+
+class AdmissionController:
+    """
+    Args:
+        max_concurrency: 同时处理的最大请求数
+        max_queue: 最大排队请求数，超出时拒绝
+        timeout: 单个请求的超时时间(秒)，包含排队时间
+    """
+
+    def __init__(self, max_concurrency=256, max_queue=512, timeout=120):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.waiting = 0
+        self.in_flight = 0
+        self.draining = False  # 收到停机信号后置位
+        self.rejected = 0
+        self.timed_out = 0
+        self.completed = 0
+        self._semaphore = None
+
+    def _ensure(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def _run(self, fn, queued):
+        await self._semaphore.acquire()
+        queued[0] = False
+        self.waiting -= 1
+        self.in_flight += 1
+        try:
+            return await fn()
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def run(self, fn):
+        """
+        在准入控制下执行 fn
+        Args:
+            fn: 返回 awaitable 的无参函数
+
+        Returns: fn 的结果。排队已满或停机中抛出 Overloaded，超时抛出 asyncio.TimeoutError
+        """
+        self._ensure()
+        if self.draining or self.waiting + self.in_flight >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            raise Overloaded('server is draining' if self.draining else 'too many requests queued')
+        # 排队数在进入事件循环调度前同步累加，保证同一轮到达的请求也能被正确拒绝
+        queued = [True]
+        self.waiting += 1
+        try:
+            result = await asyncio.wait_for(self._run(fn, queued), self.timeout)
+            self.completed += 1
+            return result
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        finally:
+            if queued[0]:  # 排队期间超时或被取消
+                self.waiting -= 1
+
+    def metrics(self):
+        return {"in_flight": self.in_flight, "waiting": self.waiting, "completed": self.completed,
+                "rejected": self.rejected, "timed_out": self.timed_out, "draining": self.draining}
@@ -0,0 +1,154 @@
+"""
+结构感知的流式文本分块。
+基于解析服务输出的 doc.json，按标题、章节和表格边界切分文本，生成按 token 数限制、相邻块有重叠并携带页码和文本类型的文本块。
+全程使用生成器，分块结果可直接分批送入 embedding，无需将整篇文档的文本块保存在内存列表中。
+"""
+import os
+import re
+
+import ijson
+
+from src.utils.doc_enum import DocField
+from src.utils.tokens import count_tokens
+
+chunk_max_tokens = int(os.getenv('CHUNK_MAX_TOKENS', 256))
+chunk_overlap_tokens = int(os.getenv('CHUNK_OVERLAP_TOKENS', 32))
+
+HEADING_TYPES = (DocField.TITLE.value, DocField.SECTION.value)
+SENTENCE_END = re.compile(r'(?<=[。！？；!?;])')
+
+
+class DocContent:
+    def __init__(self, text_type, page_number, text):
+        self.text_type = text_type
+        self.page = page_number
+        self.text = text
+        self.embedding = None
+
+    def payload(self):
+        """写入向量存储的附加信息"""
+        return {DocField.PAGE_NUMBER.value: self.page, DocField.TYPE.value: self.text_type}
+
+
+def iter_doc_items(doc_json_path):
+    """
+    逐条读取 doc.json 中的文档元素
+    Args:
+        doc_json_path: 解析服务输出的 doc.json 路径
+
+    Returns: Iterator[DocContent]
+    """
+    with open(doc_json_path, 'rb') as f:
+        for item in ijson.items(f, f'{DocField.ITEMS.value}.item'):  # 流式解析，不将整个 doc.json 读入内存
+            yield DocContent(item.get(DocField.TYPE.value, DocField.TEXT.value),
+                             item.get(DocField.PAGE_NUMBER.value),
+                             item.get(DocField.TEXT.value) or '')
+
+
+def iter_text_lines(file_path):
+    """逐行读取纯文本文件，无页码信息"""
+    with open(file_path, 'r') as fp:
+        for line in fp:
+            if line.strip():
+                yield DocContent(DocField.TEXT.value, None, line.strip())
+
+
+def split_text(text, max_tokens):
+    """将超长文本按句切分，单句仍超长时按字符硬切分"""
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    pieces = []
+    for sentence in SENTENCE_END.split(text):
+        while count_tokens(sentence) > max_tokens:
+            cut = max(1, len(sentence) * max_tokens // count_tokens(sentence))
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:]
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def split_table(content, max_tokens):
+    """按行切分表格，每一块都保留表头行"""
+    lines = [line for line in content.text.split('\n') if line.strip()]
+    header, rows = lines[0], lines[1:]
+    if not rows or count_tokens(content.text) <= max_tokens:
+        yield DocContent(content.text_type, content.page, content.text)
+        return
+    header_tokens = count_tokens(header) + 1
+    block, size = [header], header_tokens
+    for row in rows:
+        for piece in split_text(row, max(1, max_tokens - header_tokens - 1)):
+            tokens = count_tokens(piece) + 1  # 含换行符
+            if len(block) > 1 and size + tokens > max_tokens:
+                yield DocContent(content.text_type, content.page, '\n'.join(block))
+                block, size = [header], header_tokens
+            block.append(piece)
+            size += tokens
+    if len(block) > 1:
+        yield DocContent(content.text_type, content.page, '\n'.join(block))
+
+
+def _merge(units):
+    """合并块内元素，units 为 [(DocContent, tokens, 与前一元素的分隔符)]"""
+    body = [unit for unit, _, _ in units if unit.text_type not in HEADING_TYPES]
+    first = body[0] if body else units[0][0]
+    text = units[0][0].text + ''.join(sep + unit.text for unit, _, sep in units[1:])
+    return DocContent(first.text_type, units[0][0].page, text)
+
+
+def _has_body(units):
+    return any(unit.text_type not in HEADING_TYPES for unit, _, _ in units)
+
+
+def iter_chunks(contents, max_tokens=chunk_max_tokens, overlap_tokens=chunk_overlap_tokens):
+    """
+    结构感知分块
+    Args:
+        contents: Iterator[DocContent] 文档元素
+        max_tokens: 每块最大 token 数
+        overlap_tokens: 同一章节内相邻块重叠的 token 数
+
+    Returns: Iterator[DocContent]  text_type 为块内首个正文元素的类型，page 为块起始页码
+    """
+    units, size = [], 0  # 当前块的元素及 token 数（含分隔符）
+    for content in contents:
+        text = content.text.strip()
+        if not text:
+            continue
+        if content.text_type in HEADING_TYPES:
+            # 标题开启新块，并作为该块的上下文
+            if _has_body(units):
+                yield _merge(units)
+                units, size = [], 0
+            tokens = count_tokens(text) + 1
+            units.append((DocContent(content.text_type, content.page, text), tokens, '\n'))
+            size += tokens
+            continue
+        if content.text_type == DocField.TABLE.value:
+            # 表格单独成块
+            if _has_body(units):
+                yield _merge(units)
+                units, size = [], 0
+            yield from split_table(DocContent(content.text_type, content.page, text), max_tokens)
+            continue
+
+        for i, piece in enumerate(split_text(text, max_tokens - 1)):
+            sep = '\n' if i == 0 else ''  # 同一元素切分出的句子直接拼接
+            tokens = count_tokens(piece) + 1
+            if _has_body(units) and size + tokens > max_tokens:
+                yield _merge(units)
+                # 保留上一块末尾的正文作为重叠部分
+                overlap, overlap_size = [], 0
+                for unit in reversed(units):
+                    if unit[0].text_type in HEADING_TYPES or overlap_size + unit[1] > overlap_tokens:
+                        break
+                    overlap.insert(0, unit)
+                    overlap_size += unit[1]
+                if overlap_size + tokens > max_tokens:
+                    overlap, overlap_size = [], 0
+                units, size = overlap, overlap_size
+            units.append((DocContent(content.text_type, content.page, piece), tokens, sep))
+            size += tokens
+    if _has_body(units):
+        yield _merge(units)
@@ -0,0 +1,118 @@
+"""
+检索结果的上下文组装。
+将召回片段扩展为相邻窗口后合并重叠区间、去除重复文本，可选 MMR 多样化排序，最后按目标模型分词器计算的 token 预算装填。
+"""
+import os
+from collections import namedtuple
+
+from .embedding_cache import normalize_text
+from .tokens import count_tokens
+
+context_window = int(os.getenv('CONTEXT_WINDOW', 6))
+context_token_budget = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1500))
+# MMR 中相关性的权重，1 表示只按相关性排序
+context_mmr_lambda = float(os.getenv('CONTEXT_MMR_LAMBDA', 0.7))
+
+Span = namedtuple('Span', ['doc_hash', 'start', 'end', 'score'])
+
+
+def merge_spans(hits, window=context_window):
+    """
+    将每个召回片段扩展为 [chunk_id, chunk_id + window) 区间，合并同一文档内重叠或相邻的区间
+    Args:
+        hits: List[Hit]
+        window: 窗口大小
+
+    Returns: List[Span]  score 为区间内召回片段的最高分
+    """
+    spans = sorted(Span(hit.doc_hash, hit.chunk_id, hit.chunk_id + window, hit.score) for hit in hits)
+    merged = []
+    for span in spans:
+        last = merged[-1] if merged else None
+        if last and last.doc_hash == span.doc_hash and span.start <= last.end:
+            merged[-1] = Span(last.doc_hash, last.start, max(last.end, span.end), max(last.score, span.score))
+        else:
+            merged.append(span)
+    return merged
+
+
+def _shingles(text):
+    text = normalize_text(text)
+    return {text[i:i + 2] for i in range(max(1, len(text) - 1))}
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def mmr(candidates, relevance, similarity, mmr_lambda=context_mmr_lambda):
+    """
+    最大边际相关性排序
+    Args:
+        candidates: 候选项
+        relevance: 候选项相关性，与 candidates 一一对应
+        similarity: 候选项两两相似度函数 f(i, j)
+        mmr_lambda: 相关性权重
+
+    Returns: List[int] 排序后的候选项下标
+    """
+    selected, remaining = [], list(range(len(candidates)))
+    while remaining:
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * max(
+            (similarity(i, j) for j in selected), default=0.0))
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+def build_context(hits, load_window, model='gpt-3.5-turbo', token_budget=context_token_budget,
+                  window=context_window, mmr_lambda=context_mmr_lambda):
+    """
+    组装提示词上下文
+    Args:
+        hits: 检索结果 List[Hit]
+        load_window: 读取文本的函数 f(doc_hash, start, size) -> List[str]，如 VectorStore.window
+        model: 目标模型名称，用于计算 token
+        token_budget: 上下文 token 上限
+        window: 每个召回片段向后扩展的片段数
+        mmr_lambda: MMR 相关性权重，1 表示不做多样化
+
+    Returns: (text, tokens)
+    """
+    spans = merge_spans(hits, window)
+    passages = []  # [(span, [texts])]
+    seen = set()
+    for span in spans:
+        texts = []
+        for text in load_window(span.doc_hash, span.start, span.end - span.start):
+            key = normalize_text(text)
+            if key and key not in seen:  # 去除跨区间重复的文本
+                seen.add(key)
+                texts.append(text)
+        if texts:
+            passages.append((span, texts))
+    if not passages:
+        return '', 0
+
+    scores = [span.score for span, _ in passages]
+    low, high = min(scores), max(scores)
+    relevance = [(score - low) / (high - low) if high > low else 1.0 for score in scores]
+    order = list(range(len(passages)))
+    if mmr_lambda < 1:
+        shingles = [_shingles(''.join(texts)) for _, texts in passages]
+        order = mmr(passages, relevance, lambda i, j: _jaccard(shingles[i], shingles[j]), mmr_lambda)
+
+    # 按排序结果装填，超出预算的区间只保留能放下的前若干片段
+    chosen, used = {}, 0
+    for i in order:
+        for text in passages[i][1]:
+            tokens = count_tokens(text, model) + 1  # 含换行分隔符
+            if used + tokens > token_budget:
+                break
+            chosen.setdefault(i, []).append(text)
+            used += tokens
+        if used >= token_budget:
+            break
+    # 按文档顺序输出，保持阅读连贯
+    text = '\n'.join('\n'.join(chosen[i]) for i in sorted(chosen, key=lambda i: passages[i][0][:2]))
+    return text, used
@@ -0,0 +1,94 @@
+"""
+跨文档检索。
+将 data/store/<hash> 下的每个文档索引视为一个分片，在线程池中并行检索各分片，再用全局堆合并 top-k。
+新增文档只需写入新的分片目录，无需重建整体索引。
+已在文档问答缓存中的分片直接复用，其余分片加载到单独的缓存中，跨文档检索不会淘汰文档问答正在使用的索引。
+"""
+import heapq
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .data_store import INDEX_FILE, PICKLE_FILE, IndexCache, index_cache, search_index
+from .embedding import get_embedding
+
+# score 越大越相近：l2 距离取负数，cosine 为内积
+Hit = namedtuple('Hit', ['doc_hash', 'chunk_id', 'score', 'text'])
+
+corpus_search_workers = int(os.getenv('CORPUS_SEARCH_WORKERS', 8))
+_executor = ThreadPoolExecutor(max_workers=corpus_search_workers, thread_name_prefix='corpus-search')
+# 跨文档检索的分片缓存，上限应不小于分片数，否则每次检索都会重新加载被淘汰的分片
+corpus_index_cache = IndexCache(int(os.getenv('CORPUS_INDEX_CACHE_MAX_ITEMS', 256)),
+                                int(os.getenv('CORPUS_INDEX_CACHE_MAX_MB', 4096)) * 1024 * 1024)
+
+
+def list_shards(store_base_dir='data/store', doc_hashes=None):
+    """
+    列出可检索的文档分片目录
+    Args:
+        store_base_dir: 存储根目录
+        doc_hashes: 仅检索指定文档，默认全部
+
+    Returns: List[str]
+    """
+    if not os.path.isdir(store_base_dir):
+        return []
+    shards = []
+    for name in sorted(os.listdir(store_base_dir)):
+        store_dir = os.path.join(store_base_dir, name)
+        if doc_hashes is not None and name not in doc_hashes:
+            continue
+        if os.path.exists(os.path.join(store_dir, INDEX_FILE)) or os.path.exists(os.path.join(store_dir, PICKLE_FILE)):
+            shards.append(store_dir)
+    return shards
+
+
+def search_shard(store_dir, query_vector, k, nprobe=None, ef_search=None):
+    """检索单个文档分片，返回 List[Hit]"""
+    index, data, meta = index_cache.lookup(store_dir) or corpus_index_cache.get(store_dir)
+    distances, ids = search_index(index, meta, [query_vector], k, nprobe=nprobe, ef_search=ef_search)
+    doc_hash = os.path.basename(os.path.normpath(store_dir))
+    sign = 1 if meta.get('metric') == 'cosine' else -1
+    return [Hit(doc_hash, int(i), sign * float(d), data[int(i)])
+            for d, i in zip(distances[0], ids[0]) if i >= 0]
+
+
+def search_corpus(query_vector, k=10, store_base_dir='data/store', doc_hashes=None, nprobe=None, ef_search=None):
+    """
+    跨文档检索
+    Args:
+        query_vector: 查询向量
+        k: 全局返回数量
+        store_base_dir: 存储根目录
+        doc_hashes: 仅检索指定文档，默认全部
+        nprobe: IVF 索引探查聚类数
+        ef_search: HNSW 索引搜索宽度
+
+    Returns: List[Hit] 按 score 从高到低排序
+    """
+    shards = list_shards(store_base_dir, doc_hashes)
+    futures = [_executor.submit(search_shard, shard, query_vector, k, nprobe, ef_search) for shard in shards]
+    heap = []  # 大小为 k 的小顶堆
+    for shard, future in zip(shards, futures):
+        try:
+            hits = future.result()
+        except Exception as e:
+            logging.error(f"Search shard {shard} failed: {e}")
+            continue
+        for hit in hits:
+            item = (hit.score, hit.doc_hash, hit.chunk_id, hit)
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    return [item[-1] for item in sorted(heap, reverse=True)]
+
+
+def search_corpus_text(query, k=10, store_base_dir='data/store', doc_hashes=None):
+    """
+    以文本查询跨文档检索
+    Returns: List[Hit], query tokens
+    """
+    emb, tokens = get_embedding(query)
+    return search_corpus(emb[0][1], k, store_base_dir, doc_hashes), tokens
@@ -1,13 +1,212 @@
+import json
+import math
+import mmap
+import os
 import pickle
+import sys
+import threading
+from collections import OrderedDict
 
 import faiss
 import numpy as np
 from .doc import *
+from .doc_enum import DocField
+
+INDEX_FILE = 'index.faiss'  # faiss 原生索引文件
+VECTORS_FILE = 'index.vectors.npy'  # flat 索引的向量矩阵，float32 (n, d)，检索时 mmap 读取
+OFFSETS_FILE = 'texts.offsets.npy'  # 文本在 texts.bin 中的起止偏移，int64，长度 n+1
+TEXTS_FILE = 'texts.bin'  # 所有文本按顺序拼接的 UTF-8 字节
+PICKLE_FILE = 'embedding.pickle'  # 旧版存储格式
+META_FILE = 'index.json'  # 索引类型、度量方式及训练参数
+PAGES_FILE = 'texts.pages.npy'  # 文本块起始页码，int32，-1 表示未知
+TYPES_FILE = 'texts.types.npy'  # 文本块类型在 index.json text_types 中的序号，uint8
+
+# 索引类型 auto|flat|ivf_flat|ivf_pq|hnsw，auto 时按向量数量选择
+vector_index_type = os.getenv('VECTOR_INDEX_TYPE', 'auto')
+# 距离度量 l2|cosine，cosine 时对向量做 L2 归一化后使用内积
+vector_index_metric = os.getenv('VECTOR_INDEX_METRIC', 'l2')
+# 查询参数默认值：IVF 探查的聚类数、HNSW 搜索宽度，为空时使用建索引时给出的默认值
+vector_index_nprobe = os.getenv('VECTOR_INDEX_NPROBE')
+vector_index_ef_search = os.getenv('VECTOR_INDEX_EF_SEARCH')
+IVF_MIN_SIZE = 10000  # 小于该数量使用暴力检索
+IVF_PQ_MIN_SIZE = 200000  # 大于等于该数量使用 PQ 压缩
+
+
+class TextStore:
+    """
+    基于 mmap 的只读文本存储。
+    支持与 list 相同的下标与切片访问，每次只读取所需文本对应的页，多个进程打开同一文件时共享系统页缓存。
+    """
+
+    def __init__(self, store_dir):
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode='r')
+        self._file = open(os.path.join(store_dir, TEXTS_FILE), 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.pages, self.types, self.text_types = None, None, []
+        if os.path.exists(os.path.join(store_dir, PAGES_FILE)):
+            self.pages = np.load(os.path.join(store_dir, PAGES_FILE), mmap_mode='r')
+            self.types = np.load(os.path.join(store_dir, TYPES_FILE), mmap_mode='r')
+            with open(os.path.join(store_dir, META_FILE)) as f:
+                self.text_types = json.load(f).get('text_types', [])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('TextStore index out of range')
+        start, end = int(self.offsets[item]), int(self.offsets[item + 1])
+        return self._blob[start:end].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def payload(self, item):
+        """文本块的页码和类型，旧版存储无该信息时返回空字典"""
+        if self.pages is None:
+            return {}
+        page = int(self.pages[item])
+        return {DocField.PAGE_NUMBER.value: page if page >= 0 else None,
+                DocField.TYPE.value: self.text_types[int(self.types[item])]}
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+
+
+class MmapFlatIndex:
+    """
+    基于 mmap 向量文件的暴力检索索引，search 的参数与结果与 faiss IndexFlat 一致。
+    faiss 的 IO_FLAG_MMAP 对 IndexFlat 不生效，read_index 会把全部向量读入每个进程的内存；
+    这里直接 mmap 向量矩阵，检索时按需读页，多个进程打开同一文件时共享系统页缓存。
+    """
+
+    def __init__(self, vectors, metric_type=faiss.METRIC_L2):
+        self.vectors = vectors
+        self.metric_type = metric_type
+        self.ntotal, self.d = vectors.shape
+
+    def search(self, query, k, params=None):
+        return faiss.knn(np.ascontiguousarray(query, dtype='float32'), self.vectors, k, self.metric_type)
+
+
+def _write_flat_vectors(index, store_dir):
+    """将 flat 索引的向量写为临时文件 VECTORS_FILE.tmp，由调用方替换"""
+    with open(os.path.join(store_dir, VECTORS_FILE + '.tmp'), 'wb') as f:
+        np.save(f, index.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), 'float32'))
+
+
+def choose_index_type(n):
+    """根据向量数量选择索引类型"""
+    if n < IVF_MIN_SIZE:
+        return 'flat'
+    if n < IVF_PQ_MIN_SIZE:
+        return 'ivf_flat'
+    return 'ivf_pq'
+
+
+def build_index(emb, index_type=vector_index_type, metric=vector_index_metric):
+    """
+    构建向量索引
+    Args:
+        emb: 向量矩阵 (n, d)
+        index_type: auto|flat|ivf_flat|ivf_pq|hnsw
+        metric: l2|cosine
+
+    Returns: (faiss index, meta dict)
+    """
+    emb = np.ascontiguousarray(emb, dtype='float32')
+    n, d = emb.shape
+    if metric == 'cosine':
+        faiss.normalize_L2(emb)
+    metric_type = faiss.METRIC_INNER_PRODUCT if metric == 'cosine' else faiss.METRIC_L2
+    if index_type == 'auto':
+        index_type = choose_index_type(n)
+    if index_type == 'ivf_pq' and n < 256 * 39:  # 8bit PQ 码本至少需要 9984 个训练样本
+        logging.warning(f'{n} vectors are too few to train ivf_pq, use ivf_flat.')
+        index_type = 'ivf_flat'
+
+    meta = {"index_type": index_type, "metric": metric, "dim": d, "ntotal": n}
+    if index_type == 'flat':
+        factory = 'Flat'
+    elif index_type in ('ivf_flat', 'ivf_pq'):
+        nlist = max(1, min(int(4 * math.sqrt(n)), n // 39))  # 每个聚类至少 39 个训练样本
+        meta.update(nlist=nlist, nprobe=max(1, nlist // 16))
+        if index_type == 'ivf_flat':
+            factory = f'IVF{nlist},Flat'
+        else:
+            m = max(i for i in range(1, 65) if d % i == 0)  # 子向量个数需整除维度
+            meta.update(pq_m=m, pq_nbits=8)
+            factory = f'IVF{nlist},PQ{m}'
+    elif index_type == 'hnsw':
+        meta.update(hnsw_m=32, ef_construction=64, ef_search=64)
+        factory = 'HNSW32'
+    else:
+        raise ValueError(f'Unknown index type {index_type}')
+
+    index = faiss.index_factory(d, factory, metric_type)
+    if index_type == 'hnsw':
+        index.hnsw.efConstruction = meta['ef_construction']
+    if not index.is_trained:
+        index.train(emb)
+    index.add(emb)
+    logging.info(f'Build index {factory}, metric={metric}, n={n}')
+    return index, meta
+
+
+def search_index(index, meta, query, k, nprobe=None, ef_search=None):
+    """
+    检索向量索引
+    Args:
+        index: faiss index
+        meta: 索引参数，见 build_index
+        query: 查询向量 (m, d)
+        k: 返回数量
+        nprobe: IVF 探查聚类数，越大召回越高、耗时越长
+        ef_search: HNSW 搜索宽度，越大召回越高、耗时越长
+
+    Returns: (distances, ids)
+    """
+    query = np.array(query, dtype='float32', ndmin=2)
+    if meta.get('metric') == 'cosine':
+        faiss.normalize_L2(query)
+    params = None
+    index_type = meta.get('index_type', 'flat')
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        nprobe = nprobe or vector_index_nprobe or meta.get('nprobe', 1)
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe))
+    elif index_type == 'hnsw':
+        ef_search = ef_search or vector_index_ef_search or meta.get('ef_search', 64)
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search))
+    return index.search(query, k, params=params)
+
+
+def doc2vectors(parser_file_path):
+    """
+    文本转化为词向量
+    Args:
+        parser_file_path: 解析后的文件路径
+
+    Returns: (texts, vectors, payloads)  文本列表、对应的 float32 向量矩阵及页码类型信息
+    """
+    texts, vectors, payloads = [], [], []
+    for batch in iter_embedding(parser_file_path):
+        texts.extend(chunk.text for chunk in batch)
+        payloads.extend(chunk.payload() for chunk in batch)
+        vectors.append(np.array([chunk.embedding for chunk in batch], dtype='float32'))
+    return texts, np.vstack(vectors), payloads
 
 
 def doc2embedding(parser_file_path):
     """
-       文本转化为词向量
+       文本转化为词向量并构建索引
        Args:
            parser_file_path: 解析后的文件路径
 
@@ -15,28 +214,225 @@ def doc2embedding(parser_file_path):
 
        """
 
-    emb_data = create_embedding(parser_file_path)
-    emb = np.array([emm[1] for emm in emb_data])  # 获取向量值
-    data = [emm[0] for emm in emb_data]  # 获取向量对应的文本数据
-
+    data, emb, payloads = doc2vectors(parser_file_path)
     d = emb.shape[1]
     logging.info(f'd={d}')
-    index = faiss.IndexFlatL2(d)
-    index.add(emb)
-    return {"index": index, "embedding": data}
+    index, meta = build_index(emb)
+    return {"index": index, "embedding": data, "meta": meta, "payloads": payloads}
 
 
-def save_embedding(embedding_with_index: dict, save_path: str):
+def save_embedding(embedding_with_index: dict, store_dir: str):
     """
     存储词向量至本地文件夹
     Args:
-        embedding_with_index:
-        save_path: 存储文件路径
+        embedding_with_index: {"index": faiss index, "embedding": [text], "meta": 索引参数, "payloads": [页码类型]}
+        store_dir: 存储目录
+
+    Returns: None. 生成 index.faiss, index.json, texts.offsets.npy, texts.bin，flat 索引另存 index.vectors.npy，
+        及可选的 texts.pages.npy, texts.types.npy
+    """
+    index = embedding_with_index['index']
+    meta = dict(embedding_with_index.get('meta') or {"index_type": "flat", "metric": "l2", "dim": index.d})
+    meta['ntotal'] = index.ntotal
+    names = [TEXTS_FILE, OFFSETS_FILE, META_FILE, INDEX_FILE]
+    payloads = embedding_with_index.get('payloads')
+    if payloads:
+        text_types = sorted({payload.get(DocField.TYPE.value) or DocField.TEXT.value for payload in payloads})
+        meta['text_types'] = text_types
+        pages = np.array([-1 if payload.get(DocField.PAGE_NUMBER.value) is None
+                          else payload[DocField.PAGE_NUMBER.value] for payload in payloads], dtype=np.int32)
+        types = np.array([text_types.index(payload.get(DocField.TYPE.value) or DocField.TEXT.value)
+                          for payload in payloads], dtype=np.uint8)
+        for name, array in ((PAGES_FILE, pages), (TYPES_FILE, types)):
+            with open(os.path.join(store_dir, name + '.tmp'), 'wb') as f:
+                np.save(f, array)
+        names = [PAGES_FILE, TYPES_FILE] + names
+    if meta.get('index_type') == 'flat':
+        _write_flat_vectors(index, store_dir)
+        names = [VECTORS_FILE] + names
+    texts = [text.encode('utf-8') for text in embedding_with_index['embedding']]
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(text) for text in texts])
+
+    # 先写临时文件再替换，避免读取方看到写了一半的文件
+    faiss.write_index(index, os.path.join(store_dir, INDEX_FILE + '.tmp'))
+    with open(os.path.join(store_dir, META_FILE + '.tmp'), 'w') as f:
+        json.dump(meta, f)
+    with open(os.path.join(store_dir, TEXTS_FILE + '.tmp'), 'wb') as f:
+        for text in texts:
+            f.write(text)
+    with open(os.path.join(store_dir, OFFSETS_FILE + '.tmp'), 'wb') as f:
+        np.save(f, offsets)
+    for name in names:
+        os.replace(os.path.join(store_dir, name + '.tmp'), os.path.join(store_dir, name))
+    logging.info(f'Success save {store_dir}')
+
+
+def load_embedding(store_dir: str):
+    """
+    加载本地词向量索引，旧版 embedding.pickle 会先迁移为新格式
+    Args:
+        store_dir: 存储目录
+
+    Returns: (faiss index 或 MmapFlatIndex, TextStore, meta)
+    """
+    if not os.path.exists(os.path.join(store_dir, INDEX_FILE)):
+        migrate_pickle_store(store_dir)
+    meta_path = os.path.join(store_dir, META_FILE)
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+    vectors_path = os.path.join(store_dir, VECTORS_FILE)
+    if (meta is None or meta.get('index_type') == 'flat') and os.path.exists(vectors_path):
+        vectors = np.load(vectors_path, mmap_mode='r')
+        metric_type = faiss.METRIC_INNER_PRODUCT if meta and meta.get('metric') == 'cosine' else faiss.METRIC_L2
+        index = MmapFlatIndex(vectors, metric_type)
+    else:
+        # IVF 类索引的倒排表通过 mmap 按需读取，HNSW 等其余类型回退为常规读取
+        index = faiss.read_index(os.path.join(store_dir, INDEX_FILE), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        if isinstance(index, faiss.IndexFlat):  # 旧版存储没有向量文件，补写后下次加载改用 mmap
+            _write_flat_vectors(index, store_dir)
+            os.replace(os.path.join(store_dir, VECTORS_FILE + '.tmp'), vectors_path)
+    if meta is None:
+        meta = {"index_type": "flat", "metric": "l2", "dim": index.d, "ntotal": index.ntotal}
+    return index, TextStore(store_dir), meta
+
+
+def migrate_pickle_store(store_dir: str, remove_pickle=False):
+    """
+    将旧版 embedding.pickle 转换为新的存储格式
+    Args:
+        store_dir: data/store/<hash> 目录
+        remove_pickle: 迁移完成后是否删除旧文件
+
+    Returns: bool 是否进行了迁移
+    """
+    pickle_path = os.path.join(store_dir, PICKLE_FILE)
+    if not os.path.exists(pickle_path):
+        return False
+    with open(pickle_path, 'rb') as f:
+        save_embedding(pickle.load(f), store_dir)
+    if remove_pickle:
+        os.remove(pickle_path)
+    logging.info(f'Migrate {pickle_path}')
+    return True
+
+
+def migrate_all(store_base_dir='data/store', remove_pickle=False):
+    """迁移 data/store 下所有旧版存储"""
+    migrated = 0
+    for name in os.listdir(store_base_dir):
+        store_dir = os.path.join(store_base_dir, name)
+        if os.path.isdir(store_dir) and not os.path.exists(os.path.join(store_dir, INDEX_FILE)):
+            migrated += migrate_pickle_store(store_dir, remove_pickle)
+    logging.info(f'Migrate {migrated} store dirs under {store_base_dir}')
+    return migrated
 
-    Returns: .pickle file
+
+class IndexCache:
+    """
+    进程内已加载文档索引的 LRU 缓存，键为文档哈希（存储目录名）。
+    同时限制缓存个数和占用大小（按索引及文本文件大小估算），存储目录中的文件变化后自动失效重新加载。
     """
 
-    # 存储到本地
-    with open(save_path, 'wb') as f:
-        pickle.dump(embedding_with_index, f)
-    logging.info(f'Success save {save_path}')
+    def __init__(self, max_items=16, max_bytes=1024 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()  # doc hash -> (signature, size, (index, TextStore, meta))
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading = {}  # doc hash -> 加载锁
+
+    @staticmethod
+    def _signature(store_dir):
+        signature = []
+        for name in (INDEX_FILE, OFFSETS_FILE, TEXTS_FILE):
+            try:
+                stat = os.stat(os.path.join(store_dir, name))
+            except FileNotFoundError:
+                return None
+            signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _lookup(self, key, signature):
+        """调用方持有 self._lock，命中时返回缓存的索引"""
+        cached = self._items.get(key)
+        if cached and signature and cached[0] == signature:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return cached[2]
+        return None
+
+    def lookup(self, store_dir):
+        """仅查询缓存，未命中或已失效时返回 None，不加载也不淘汰其他文档"""
+        key = os.path.basename(os.path.normpath(store_dir))
+        signature = self._signature(store_dir)
+        with self._lock:
+            return self._lookup(key, signature)
+
+    def get(self, store_dir):
+        """
+        获取文档索引，未命中或已失效时从磁盘加载。
+        加载在全局锁外进行，只阻塞同一文档的并发请求，其他文档的缓存命中不受影响
+        Returns: (faiss index, TextStore, meta)
+        """
+        key = os.path.basename(os.path.normpath(store_dir))
+        signature = self._signature(store_dir)
+        with self._lock:
+            loaded = self._lookup(key, signature)
+            if loaded is not None:
+                return loaded
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            signature = self._signature(store_dir)
+            with self._lock:  # 等待期间可能已由其他线程加载
+                loaded = self._lookup(key, signature)
+                if loaded is not None:
+                    return loaded
+                self.misses += 1
+            loaded = load_embedding(store_dir)
+            signature = self._signature(store_dir)
+            size = sum(size for _, _, size in signature)
+            with self._lock:
+                if key in self._items:
+                    self._remove(key)
+                self._items[key] = (signature, size, loaded)
+                self._bytes += size
+                while len(self._items) > 1 and (len(self._items) > self.max_items or self._bytes > self.max_bytes):
+                    self._remove(next(iter(self._items)))
+                    self.evictions += 1
+            return loaded
+
+    def _remove(self, key):
+        _, size, _ = self._items.pop(key)
+        self._bytes -= size
+
+    def invalidate(self, store_dir=None):
+        """使指定文档（默认全部）的缓存失效"""
+        with self._lock:
+            if store_dir is None:
+                self._items.clear()
+                self._bytes = 0
+            elif os.path.basename(os.path.normpath(store_dir)) in self._items:
+                self._remove(os.path.basename(os.path.normpath(store_dir)))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"items": len(self._items), "bytes": self._bytes, "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0, "evictions": self.evictions,
+                    "max_items": self.max_items, "max_bytes": self.max_bytes}
+
+
+index_cache = IndexCache(int(os.getenv('INDEX_CACHE_MAX_ITEMS', 16)),
+                         int(os.getenv('INDEX_CACHE_MAX_MB', 1024)) * 1024 * 1024)
+
+
+if __name__ == '__main__':
+    # python -m src.utils.data_store data/store
+    migrate_all(sys.argv[1] if len(sys.argv) > 1 else 'data/store')
@@ -1,7 +1,5 @@
 import hashlib
-import json
 
-import requests
 import zipfile
 import io
 import time
@@ -11,9 +9,10 @@ import logging
 
 from tqdm import tqdm
 
+from src.utils.chunker import iter_chunks, iter_doc_items, iter_text_lines
 from src.utils.embedding import get_embedding
+from src.utils.http_client import http_client
 from web import api_server
-from src.utils.doc_enum import DocField
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -28,15 +27,14 @@ def request_api(base_url, endpoint, filename, output_dir, params=None, _async='f
     :return: The result of the API call.
     """
     headers = {'Content-Type': 'application/octet-stream'}
-    if params:
-        query = {}
-        query.update(params)
+    query = dict(params or {})
     with open(filename, 'rb') as f:
-        res = requests.post(url=base_url+endpoint,
-                            headers=headers,
-                            data=f,
-                            params=query
-                            )
+        res = http_client.post(base_url + endpoint,
+                               headers=headers,
+                               data=f,
+                               params=query,
+                               idempotent=True  # 重复解析同一文档结果相同，超时可重试
+                               )
         res.raise_for_status()
     if res.status_code == 200:
         return get_result(endpoint, res, output_dir, _async, output_format)
@@ -55,7 +53,7 @@ def get_result(endpoint, res, output_dir, _async, ouput_format):
     if _async == 'true':
         while True:
             task_id = res.json()['data']['task']['id']
-            parse_res = requests.get(url=endpoint + f'?task_id={task_id}')
+            parse_res = http_client.get(endpoint + f'?task_id={task_id}')
             parse_res.raise_for_status()  # Raise an exception if the response status code is not 200.
             error = parse_res.headers.get('x-api-status')
             if error and parse_res.json()['error']['code'] in ['running', 'waiting']:
@@ -153,54 +151,72 @@ def read_file(file_path):
         return contents
 
 
+def iter_doc_contents(file_name):
+    """
+    流式读取文档元素，解析目录下存在 doc.json 时保留页码和类型信息，否则按行读取文本文件
+    Args:
+        file_name: 解析后的 table.txt 或直接上传的文本文件
+
+    Returns: Iterator[DocContent]
+    """
+    doc_json = os.path.join(os.path.dirname(file_name), 'doc.json')
+    return iter_doc_items(doc_json) if os.path.exists(doc_json) else iter_text_lines(file_name)
+
+
+def iter_doc_chunks(file_name):
+    """
+    按文档结构流式分块
+    Args:
+        file_name: 解析后的 table.txt 或直接上传的文本文件
+
+    Returns: Iterator[DocContent]
+    """
+    return iter_chunks(iter_doc_contents(file_name))
+
+
+def iter_embedding(file_name, batch_size=int(os.getenv('EMBEDDING_STREAM_BATCH', 256))):
+    """
+    分批生成文本块及其向量
+    Args:
+        file_name: 解析后的文件路径
+        batch_size: 每批送入 embedding 的文本块数量
+
+    Returns: Iterator[List[DocContent]]  DocContent.embedding 为对应向量
+    """
+    tokens = 0
+    batch = []
+    for chunk in tqdm(iter_doc_chunks(file_name)):
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            tokens += _embed_chunks(batch)
+            yield batch
+            batch = []
+    if batch:
+        tokens += _embed_chunks(batch)
+        yield batch
+    logging.info(f"doc2vector. tokens={tokens}")
+
+
+def _embed_chunks(chunks):
+    ebd, tk = get_embedding([chunk.text for chunk in chunks])
+    for chunk, (_, vector) in zip(chunks, ebd):
+        chunk.embedding = vector
+    return tk
+
+
 def create_embedding(file_name):
     """
     Generate file embedding.
     Args:
-        file_name:
+        file_name: 解析后的文件路径
 
-    Returns:
+    Returns: List[Tuple]  [(text, embedding)]
 
     """
-    result = []
-    # TODO：解析doc.json 保留页码信息
-    contents = read_file(file_name)
-        
-    lens = [len(text) for text in contents]
-    query_len = 0
-    start_index = 0
-    tokens = 0
-    if sum(lens) <= 4096:
-        ebd, tk = get_embedding(contents[start_index:len(lens)-1])
-        result.extend(ebd)
-        return result
-    else:
-        for index, l in tqdm(enumerate(lens)):
-            query_len += l
-            if query_len > 4096:
-                ebd, tk = get_embedding(contents[start_index:index + 1])
-                query_len = 0
-                start_index = index + 1
-                tokens += tk
-                result.extend(ebd)
-        logging.info(f"doc2vector. tokens={tokens}")
-        return result
-
-
-class DocContent:
-    def __init__(self, text_type, page_number, text):
-        self.text_type = text_type
-        self.page = page_number
-        self.text = text
-        self.embedding = None
+    return [(chunk.text, chunk.embedding) for batch in iter_embedding(file_name) for chunk in batch]
 
 
 if __name__ == '__main__':
     doc_json = 'data/store/da9b6be2f0fd7eaa506e2266a9100918/doc.json'
-    with open(doc_json, 'r', encoding='utf-8') as f:
-        doc_obj = json.loads(f.read())
-
-    doc_result = []
-    for item in doc_obj[DocField.ITEMS.value]:
-        doc_result.append(DocContent(item[DocField.TYPE.value], item[DocField.PAGE_NUMBER.value], item[DocField.TEXT.value]))
-    print(doc_result[0].text)
+    for chunk in iter_chunks(iter_doc_items(doc_json)):
+        print(chunk.page, chunk.text_type, chunk.text)
@@ -3,13 +3,21 @@
 引入词向量模型包实现本地化部署。text2vec-large-chinese
 https://learn.microsoft.com/en-us/azure/cognitive-services/openai/reference
 """
+import gc
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import openai
 from langchain.embeddings import HuggingFaceEmbeddings
 from dotenv import load_dotenv
 
+from src.gpt import ModelClient
+from src.utils.embedding_cache import EmbeddingCache
+from src.utils.tokens import count_tokens
+
 load_dotenv()
 
 embedding_model_dict = {
@@ -19,7 +27,128 @@ embedding_model_dict = {
 }
 
 
-embedding_model_name = os.getenv("EMBEDDING_MODEL_NAME")
+embedding_model_name = os.getenv("EMBEDDING_MODEL_NAME", "text-embedding-ada-002")
+# 远程 embedding 使用 Azure 部署的凭据，随请求传递，不依赖 openai 全局配置
+embedding_client = ModelClient(os.getenv("AZURE_OPENAI_API_KEY"), os.getenv("API_TYPE", "azure"),
+                               os.getenv("OPENAI_API_BASE"), os.getenv("OPENAI_API_VERSION"))
+# 批量请求参数：每批最大条数（Azure ada-002 单次最多 16 条）、每批最大 token 数、并发批次数
+embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", 16))
+embedding_batch_tokens = int(os.getenv("EMBEDDING_BATCH_TOKENS", 8000))
+embedding_concurrency = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+# 本地模型：默认模型名称、可用内存低于该值(MB)时释放空闲模型、空闲判定时长(秒)
+local_embedding_model = os.getenv("EMBEDDING_LOCAL_MODEL", "text2vec")
+embedding_min_free_mb = int(os.getenv("EMBEDDING_MIN_FREE_MB", 1024))
+embedding_idle_seconds = int(os.getenv("EMBEDDING_IDLE_SECONDS", 600))
+
+
+def is_local_embedding():
+    """是否使用本地 embedding 模型"""
+    return os.getenv('is_local', 'false').lower() in ('true', '1', 't')
+
+
+def available_memory_mb():
+    """当前可用物理内存(MB)，无法获取时返回 None"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class EmbeddingRegistry:
+    """
+    进程内本地 embedding 模型注册表。
+    按 embedding_model_dict 中的名称缓存模型实例，每个模型只加载一次，可在多个 Gradio worker 线程间共享；
+    可用内存不足时释放空闲时间超过 idle_seconds 的模型。
+    """
+
+    def __init__(self, model_dict, min_free_mb=embedding_min_free_mb, idle_seconds=embedding_idle_seconds):
+        self.model_dict = model_dict
+        self.min_free_mb = min_free_mb
+        self.idle_seconds = idle_seconds
+        self._models = {}  # name -> model
+        self._last_used = {}  # name -> timestamp
+        self._lock = threading.Lock()
+        self._load_locks = {name: threading.Lock() for name in model_dict}
+
+    def get(self, name=local_embedding_model):
+        """获取已加载的模型，未加载时加载一次"""
+        if name not in self.model_dict:
+            raise KeyError(f"Unknown embedding model {name}, choose from {list(self.model_dict)}")
+        model = self._models.get(name)
+        if model is None:
+            with self._load_locks[name]:  # 同一模型只允许一个线程加载
+                model = self._models.get(name)
+                if model is None:
+                    self.release_if_low_memory(keep=name)
+                    logging.info(f"Load local embedding model {name}: {self.model_dict[name]}")
+                    start = time.perf_counter()
+                    model = HuggingFaceEmbeddings(model_name=self.model_dict[name])
+                    logging.info(f"Loaded {name} in {time.perf_counter() - start:.1f}s")
+                    with self._lock:
+                        self._models[name] = model
+        with self._lock:
+            self._last_used[name] = time.monotonic()
+        return model
+
+    def warm_up(self, names=None):
+        """预加载模型，默认加载 EMBEDDING_LOCAL_MODEL"""
+        for name in names or [local_embedding_model]:
+            self.get(name)
+
+    def loaded(self):
+        """已加载的模型名称"""
+        with self._lock:
+            return list(self._models)
+
+    def release(self, name):
+        """释放指定模型"""
+        with self._lock:
+            model = self._models.pop(name, None)
+            self._last_used.pop(name, None)
+        if model is not None:
+            del model
+            gc.collect()
+            logging.info(f"Release local embedding model {name}")
+
+    def release_idle(self, idle_seconds=None, keep=None):
+        """释放空闲时间超过 idle_seconds 的模型"""
+        idle_seconds = self.idle_seconds if idle_seconds is None else idle_seconds
+        now = time.monotonic()
+        with self._lock:
+            idle = [name for name, used in self._last_used.items()
+                    if name != keep and now - used >= idle_seconds]
+        for name in idle:
+            self.release(name)
+        return idle
+
+    def release_if_low_memory(self, keep=None):
+        """可用内存低于阈值时释放空闲模型"""
+        free_mb = available_memory_mb()
+        if free_mb is not None and free_mb < self.min_free_mb:
+            logging.warning(f"Available memory {free_mb:.0f}MB < {self.min_free_mb}MB, release idle models.")
+            return self.release_idle(keep=keep)
+        return []
+
+
+embedding_registry = EmbeddingRegistry(embedding_model_dict)
+
+# 持久化 embedding 缓存，EMBEDDING_CACHE_PATH 置空时关闭
+embedding_cache_path = os.getenv("EMBEDDING_CACHE_PATH", "data/cache/embedding.db")
+embedding_cache = EmbeddingCache(embedding_cache_path, int(os.getenv("EMBEDDING_CACHE_MAX_MB", 1024)) * 1024 * 1024) \
+    if embedding_cache_path else None
+
+
+def warm_up_embedding():
+    """服务启动时预加载本地 embedding 模型"""
+    if is_local_embedding():
+        embedding_registry.warm_up()
 
 
 def get_embedding(input_slice):
@@ -32,20 +161,99 @@ def get_embedding(input_slice):
     Returns: List[Tuple]  [(text, embedding)], tokens_usage
 
     """
-    local = os.getenv('is_local').lower() in ('true', '1', 't')
-    if not local:
-        # 先默认使用openai的embedding服务
-        # set_openai_key(os.getenv("OFFICE_OPENAI_API_KEY"))
+    if isinstance(input_slice, str):
+        input_slice = [input_slice]
+    if embedding_cache is None:
+        return compute_embedding(input_slice)
+
+    # 先查本地缓存，仅对未命中且去重后的文本请求 embedding
+    model = current_embedding_model()
+    vectors = embedding_cache.get_many(model, input_slice)
+    missing = list(dict.fromkeys(text for text, vector in zip(input_slice, vectors) if vector is None))
+    tokens = 0
+    if missing:
+        computed, tokens = compute_embedding(missing)
+        embedding_cache.put_many(model, computed)
+        computed = dict(computed)
+        vectors = [computed[text] if vector is None else vector for text, vector in zip(input_slice, vectors)]
+    logging.info(f"embedding cache hit {len(input_slice) - len(missing)}/{len(input_slice)}")
+    return list(zip(input_slice, vectors)), tokens
+
+
+def compute_embedding(input_slice):
+    """调用远程或本地 embedding 服务计算向量"""
+    if not is_local_embedding():
         logging.info("Load embedding server.")
-        embedding = [text_to_embedding(text) for text in input_slice]
-        # embedding = openai.Embedding.create(engine="text-embedding-ada-002", input=input_slice)
-        return [(text, data[0].embedding) for text, data in zip(input_slice, embedding)], len(input_slice)
+        return batch_embedding(input_slice)
     else:
         logging.info("Load local text2Vector.")
-        embedding_obj = HuggingFaceEmbeddings(model_name=embedding_model_dict['text2vec'],)
+        embedding_obj = embedding_registry.get()
+        embedding_registry.release_if_low_memory(keep=local_embedding_model)
         embedding = embedding_obj.embed_documents(input_slice)
         return [(text, data) for text, data in zip(input_slice, embedding)], len(input_slice)
 
 
-def text_to_embedding(text):
-    return openai.Embedding.create(engine=embedding_model_name, input=text)['data']
+def current_embedding_model():
+    """当前使用的 embedding 模型标识，作为缓存键的一部分"""
+    if is_local_embedding():
+        return embedding_model_dict[local_embedding_model]
+    return embedding_model_name
+
+
+def split_batches(input_slice, batch_size=embedding_batch_size, max_tokens=embedding_batch_tokens):
+    """
+    按条数和 token 上限将文本切分为多个批次，保持原有顺序
+    Args:
+        input_slice: 文本列表
+        batch_size: 每批最大条数
+        max_tokens: 每批最大 token 数，单条超限的文本单独成批
+
+    Returns: List[List[str]]
+
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for text in input_slice:
+        tokens = count_tokens(text, embedding_model_name)
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def batch_embedding(input_slice, concurrency=embedding_concurrency):
+    """
+    批量并发请求 embedding 服务
+    Args:
+        input_slice: 文本列表
+        concurrency: 同时进行的批次数
+
+    Returns: List[Tuple]  [(text, embedding)], tokens_usage
+
+    """
+    if not input_slice:
+        return [], 0
+    start = time.perf_counter()
+    batches = split_batches(input_slice)
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches)))) as executor:
+        responses = list(executor.map(texts_to_embedding, batches))  # map 保证返回顺序与输入一致
+
+    result, tokens = [], 0
+    for batch, (vectors, usage) in zip(batches, responses):
+        result.extend(zip(batch, vectors))
+        tokens += usage
+    elapsed = time.perf_counter() - start
+    logging.info(f"embedding {len(input_slice)} texts in {len(batches)} batches, "
+                 f"{len(input_slice) / max(elapsed, 1e-6):.1f} texts/s, tokens={tokens}")
+    return result, tokens
+
+
+def texts_to_embedding(texts, client=None):
+    """单次请求多条文本的 embedding，返回按输入顺序排列的向量及 token 用量。client 为空时使用 embedding_client"""
+    client = client or embedding_client
+    response = openai.Embedding.create(engine=embedding_model_name, input=texts, **client._asdict())
+    data = sorted(response['data'], key=lambda item: item['index'])
+    return [item['embedding'] for item in data], response['usage']['total_tokens']
@@ -0,0 +1,138 @@
+"""
+基于内容寻址的 embedding 持久化缓存。
+以 (embedding 模型, 归一化文本哈希) 为键，向量以 float32 二进制存储在本地 SQLite 中，超过容量上限时按最近使用时间淘汰。
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+
+
+def normalize_text(text):
+    """归一化文本：全半角统一、合并空白字符"""
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def encode_vector(vector):
+    return array('f', vector).tobytes()
+
+
+def decode_vector(blob):
+    vector = array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    """
+    本地 embedding 缓存
+    Args:
+        path: SQLite 文件路径
+        max_bytes: 向量数据总容量上限，超出后淘汰最久未使用的记录
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS embedding (
+                                model TEXT NOT NULL,
+                                hash TEXT NOT NULL,
+                                vector BLOB NOT NULL,
+                                size INTEGER NOT NULL,
+                                last_used REAL NOT NULL,
+                                PRIMARY KEY (model, hash))''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_embedding_last_used ON embedding (last_used)')
+        self._conn.commit()
+        self._total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM embedding').fetchone()[0]
+
+    def get_many(self, model, texts):
+        """
+        批量查询缓存
+        Returns: List[Optional[List[float]]] 与 texts 一一对应，未命中为 None
+        """
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            unique = list(set(hashes))
+            for start in range(0, len(unique), 500):  # SQLite 参数个数限制
+                part = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f'SELECT hash, vector FROM embedding WHERE model = ? AND hash IN ({",".join("?" * len(part))})',
+                    [model, *part]).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany('UPDATE embedding SET last_used = ? WHERE model = ? AND hash = ?',
+                                       [(now, model, h) for h in found])
+                self._conn.commit()
+            hit = sum(1 for h in hashes if h in found)
+            self.hits += hit
+            self.misses += len(hashes) - hit
+        return [decode_vector(found[h]) if h in found else None for h in hashes]
+
+    def put_many(self, model, pairs):
+        """
+        批量写入缓存
+        Args:
+            model: embedding 模型名称
+            pairs: [(text, embedding)]
+        """
+        now = time.time()
+        rows = {}
+        for text, vector in pairs:
+            h, blob = text_hash(text), encode_vector(vector)
+            rows[h] = (model, h, blob, len(blob), now)
+        if not rows:
+            return
+        with self._lock:
+            for _, h, _, _, _ in rows.values():
+                old = self._conn.execute('SELECT size FROM embedding WHERE model = ? AND hash = ?',
+                                         (model, h)).fetchone()
+                if old:
+                    self._total_bytes -= old[0]
+            self._conn.executemany('INSERT OR REPLACE INTO embedding VALUES (?, ?, ?, ?, ?)', list(rows.values()))
+            self._total_bytes += sum(row[3] for row in rows.values())
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """超出容量时按 last_used 淘汰至上限的 90%"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute('SELECT model, hash, size FROM embedding ORDER BY last_used').fetchall()
+        victims = []
+        for model, h, size in rows:
+            if self._total_bytes <= target:
+                break
+            victims.append((model, h))
+            self._total_bytes -= size
+        self._conn.executemany('DELETE FROM embedding WHERE model = ? AND hash = ?', victims)
+        logging.info(f"Embedding cache evicted {len(victims)} entries, size={self._total_bytes} bytes")
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM embedding').fetchone()[0]
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "entries": entries, "bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,91 @@
+"""
+长文档分块抽取的切分与合并。
+文档按结构切分为适合模型上下文的窗口并行抽取，再按 schema 的 many 语义合并各窗口的结果：
+many=True 的对象/属性合并去重为列表，many=False 的取文档中最先出现的非空值。
+"""
+import json
+import os
+
+from kor.nodes import Object
+from langchain.schema import Document
+
+from .chunker import iter_chunks
+
+extract_chunk_tokens = int(os.getenv('EXTRACT_CHUNK_TOKENS', 1200))
+extract_chunk_overlap = int(os.getenv('EXTRACT_CHUNK_OVERLAP', 64))
+
+
+def split_documents(contents, max_tokens=extract_chunk_tokens, overlap_tokens=extract_chunk_overlap):
+    """
+    将文档元素切分为抽取窗口
+    Args:
+        contents: Iterator[DocContent] 文档元素，如 iter_doc_items / iter_text_lines 的结果
+        max_tokens: 每个窗口的最大 token 数
+        overlap_tokens: 相邻窗口重叠的 token 数
+
+    Returns: List[Document]，metadata 含窗口序号与起始页码
+    """
+    return [Document(page_content=chunk.text, metadata={"chunk_id": i, "page": chunk.page})
+            for i, chunk in enumerate(iter_chunks(contents, max_tokens, overlap_tokens))]
+
+
+def _is_empty(value):
+    return value is None or value == '' or value == [] or value == {} or \
+        (isinstance(value, dict) and all(_is_empty(v) for v in value.values()))
+
+
+def _as_list(value):
+    if _is_empty(value):
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _dedupe(values):
+    seen, unique = set(), []
+    for value in values:
+        key = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        if key not in seen:
+            seen.add(key)
+            unique.append(value)
+    return unique
+
+
+def _merge_record(node, records):
+    """合并同一对象在各窗口中的单条记录"""
+    merged = {}
+    for attribute in node.attributes:
+        values = [record.get(attribute.id) for record in records if isinstance(record, dict)]
+        merged[attribute.id] = merge_values(attribute, values)
+    return merged
+
+
+def merge_values(node, values):
+    """
+    按 schema 节点合并各窗口抽取到的值
+    Args:
+        node: kor 节点（Object 或 Text/Number 等属性）
+        values: 各窗口的抽取结果，按文档顺序排列
+
+    Returns: many=True 时为去重后的列表，否则为单个值（无结果时为空字符串或空字典）
+    """
+    if node.many:
+        items = [item for value in values for item in _as_list(value)]
+        return _dedupe([item for item in items if not _is_empty(item)])
+    if isinstance(node, Object):
+        return _merge_record(node, [item for value in values for item in _as_list(value)])
+    for value in values:
+        for item in _as_list(value):
+            return item
+    return ''
+
+
+def merge_extractions(schema, results):
+    """
+    合并各窗口的抽取结果
+    Args:
+        schema: kor Object
+        results: 各窗口抽取结果的 data 字段，形如 {schema.id: 记录或记录列表}
+
+    Returns: {schema.id: 合并后的结果}
+    """
+    return {schema.id: merge_values(schema, [(data or {}).get(schema.id) for data in results])}
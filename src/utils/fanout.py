@@ -0,0 +1,162 @@
+"""
+多模型并发调用。
+fan_out 同时调用多个后端，各自有截止时间，超时的后端不阻塞其余结果；
+hedged_call 先调用主后端，超过其历史 p95 延迟仍未返回时再调用备用后端，取先返回的结果。
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError, wait
+
+import numpy as np
+
+fanout_workers = int(os.getenv('FANOUT_WORKERS', 16))
+fanout_deadline = float(os.getenv('FANOUT_DEADLINE', 60))
+# 无历史延迟时 hedged_call 的默认等待时长(秒)
+hedge_default_delay = float(os.getenv('HEDGE_DEFAULT_DELAY', 5))
+
+Result = namedtuple('Result', ['name', 'value', 'error', 'elapsed'])
+
+# 超时的调用无法中断，仍在线程中运行至结束，因此使用共享线程池并限制线程数
+_executor = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix='fanout')
+
+
+class LatencyTracker:
+    """
+    记录各后端最近成功调用的耗时，用于估计 hedged_call 的等待时长
+    Args:
+        window: 每个后端保留的样本数
+        min_samples: 样本数不足时使用默认值
+    """
+
+    def __init__(self, window=200, min_samples=10):
+        self.min_samples = min_samples
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    def percentile(self, name, q=95, default=hedge_default_delay):
+        with self._lock:
+            samples = list(self._samples.get(name, ()))
+        if len(samples) < self.min_samples:
+            return default
+        return float(np.percentile(samples, q))
+
+
+latency_tracker = LatencyTracker()
+
+
+def _timed(name, fn, tracker):
+    start = time.perf_counter()
+    value = fn()
+    elapsed = time.perf_counter() - start
+    tracker.record(name, elapsed)
+    return Result(name, value, None, elapsed)
+
+
+def _result(name, future, start):
+    try:
+        return future.result(timeout=0)
+    except Exception as e:
+        logging.warning(f"{name} failed: {e!r}")
+        return Result(name, None, e, time.perf_counter() - start)
+
+
+def fan_out(calls, deadlines=None, default_deadline=fanout_deadline, tracker=latency_tracker):
+    """
+    并发调用多个后端
+    Args:
+        calls: {name: 无参函数}
+        deadlines: {name: 截止时间(秒)}，未指定的后端使用 default_deadline
+        default_deadline: 默认截止时间(秒)
+        tracker: 延迟记录器
+
+    Returns: {name: Result}，按 calls 的顺序；超时的后端 error 为 TimeoutError
+    """
+    deadlines = deadlines or {}
+    start = time.perf_counter()
+    futures = {name: _executor.submit(_timed, name, fn, tracker) for name, fn in calls.items()}
+    results = {}
+    for name in sorted(futures, key=lambda n: deadlines.get(n, default_deadline)):
+        remaining = start + deadlines.get(name, default_deadline) - time.perf_counter()
+        try:
+            futures[name].result(timeout=max(0.0, remaining))
+        except TimeoutError:
+            logging.warning(f"{name} missed its deadline of {deadlines.get(name, default_deadline)}s")
+            results[name] = Result(name, None, TimeoutError(name), time.perf_counter() - start)
+            continue
+        except Exception:
+            pass
+        results[name] = _result(name, futures[name], start)
+    return {name: results[name] for name in calls}
+
+
+def hedged_call(primary, secondary, delay=None, timeout=fanout_deadline, tracker=latency_tracker):
+    """
+    对冲调用：主后端超过 delay 未返回或在此之前失败时再调用备用后端，返回先成功的结果
+    Args:
+        primary: (name, 无参函数)
+        secondary: (name, 无参函数)
+        delay: 发起备用调用前的等待时长(秒)，默认为主后端历史 p95 延迟
+        timeout: 总超时时间(秒)
+        tracker: 延迟记录器
+
+    Returns: Result，均失败或超时时 error 不为空
+    """
+    start = time.perf_counter()
+    delay = tracker.percentile(primary[0]) if delay is None else delay
+    futures = {_executor.submit(_timed, primary[0], primary[1], tracker): primary[0]}
+    done, _ = wait(futures, timeout=min(delay, timeout))
+    if not done or next(iter(done)).exception() is not None:
+        if done:
+            logging.info(f"{primary[0]} failed, fall back to {secondary[0]}")
+        else:
+            logging.info(f"{primary[0]} slower than {delay:.2f}s, hedge with {secondary[0]}")
+        futures[_executor.submit(_timed, secondary[0], secondary[1], tracker)] = secondary[0]
+    pending = set(futures)
+    last = None
+    while pending:
+        remaining = start + timeout - time.perf_counter()
+        done, pending = wait(pending, timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            last = _result(futures[future], future, start)
+            if last.error is None:
+                return last
+    return last or Result(primary[0], None, TimeoutError(primary[0]), time.perf_counter() - start)
+
+
+def imap_unordered(fn, items, workers=4):
+    """
+    以有限并发对每个元素调用 fn，按完成顺序逐个返回结果，单个元素失败不影响其余元素
+    Args:
+        fn: 单参数函数
+        items: 可迭代对象，按需取出，不会一次性提交全部元素
+        workers: 最大并发数
+
+    Returns: 生成器，产出 Result，name 为元素下标
+    """
+    items = iter(enumerate(items))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='imap') as executor:
+        def submit():
+            for index, item in items:
+                start = time.perf_counter()
+                return executor.submit(fn, item), (index, start)
+            return None
+
+        pending = dict(filter(None, (submit() for _ in range(workers))))
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, start = pending.pop(future)
+                error = future.exception()
+                yield Result(index, None if error else future.result(), error, time.perf_counter() - start)
+                submitted = submit()
+                if submitted:
+                    pending[submitted[0]] = submitted[1]
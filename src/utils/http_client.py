@@ -0,0 +1,193 @@
+"""
+共享 HTTP 客户端。
+按 host 复用连接池并保持长连接，统一连接/读取超时，对连接错误、429 和 5xx 响应进行带随机抖动的指数退避重试。
+POST 等非幂等请求默认只在服务端确定未处理请求时重试（连接失败、429、503），读取超时不重试，以免重复生成；调用方可通过 idempotent=True 放开。
+HttpClient 基于 requests，AsyncHttpClient 基于 aiohttp，供 asyncio 调用链使用。
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+http_pool_size = int(os.getenv('HTTP_POOL_SIZE', 16))  # 每个 host 的最大连接数
+http_connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+http_read_timeout = float(os.getenv('HTTP_READ_TIMEOUT', 120))
+http_max_retries = int(os.getenv('HTTP_MAX_RETRIES', 3))
+http_backoff = float(os.getenv('HTTP_BACKOFF', 0.5))  # 退避基数(秒)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+NON_IDEMPOTENT_RETRY_STATUS = {429, 503}  # 服务端未处理请求的状态码
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+def backoff_delay(attempt, base=http_backoff, retry_after=None):
+    """
+    计算第 attempt 次重试前的等待时间。
+    优先使用服务端返回的 Retry-After，否则使用 full jitter 指数退避：uniform(0, base * 2^attempt)
+    """
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return random.uniform(0, base * 2 ** attempt)
+
+
+def _connect_failed(e):
+    """requests 异常是否发生在建立连接阶段，此时服务端未收到请求"""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _host(url):
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+
+class HttpClient:
+    """
+    带连接池和重试的同步 HTTP 客户端，线程安全
+    Args:
+        pool_size: 每个 host 的连接池大小
+        connect_timeout: 建立连接超时(秒)
+        read_timeout: 读取响应超时(秒)
+        max_retries: 最大重试次数
+        backoff: 退避基数(秒)
+    """
+
+    def __init__(self, pool_size=http_pool_size, connect_timeout=http_connect_timeout,
+                 read_timeout=http_read_timeout, max_retries=http_max_retries, backoff=http_backoff):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url):
+        """获取 url 所在 host 的会话，同一 host 共享连接池"""
+        host = _host(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount(host, adapter)
+                self._sessions[host] = session
+            return session
+
+    def request(self, method, url, retries=None, timeout=None, idempotent=None, **kwargs):
+        """
+        发送请求，连接错误、超时及 429/5xx 响应按退避策略重试
+        Args:
+            idempotent: 请求是否可重复执行，默认按请求方法判断；非幂等请求只在连接失败及 429/503 响应时重试
+
+        Returns: requests.Response  重试耗尽后返回最后一次响应或抛出最后一次异常
+        """
+        retries = self.max_retries if retries is None else retries
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_status = RETRY_STATUS if idempotent else NON_IDEMPOTENT_RETRY_STATUS
+        session = self.session(url)
+        for attempt in range(retries + 1):
+            body = kwargs.get('data')
+            if attempt and hasattr(body, 'seek'):
+                body.seek(0)  # 文件类请求体重试前回到开头
+            try:
+                response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= retries or not (idempotent or _connect_failed(e)):
+                    raise
+                delay = backoff_delay(attempt, self.backoff)
+                logging.warning(f"{method} {url} failed: {e}, retry in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            if response.status_code in retry_status and attempt < retries:
+                delay = backoff_delay(attempt, self.backoff, response.headers.get('Retry-After'))
+                logging.warning(f"{method} {url} returned {response.status_code}, retry in {delay:.2f}s")
+                response.close()
+                time.sleep(delay)
+                continue
+            return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+class AsyncHttpClient:
+    """
+    带连接池和重试的异步 HTTP 客户端。
+    aiohttp 会话与事件循环绑定，每个事件循环各自维护一个会话。
+    """
+
+    def __init__(self, pool_size=http_pool_size, connect_timeout=http_connect_timeout,
+                 read_timeout=http_read_timeout, max_retries=http_max_retries, backoff=http_backoff):
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._sessions = weakref.WeakKeyDictionary()  # event loop -> ClientSession
+
+    def session(self):
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.pool_size, keepalive_timeout=60)
+            session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._sessions[loop] = session
+        return session
+
+    async def request_json(self, method, url, retries=None, idempotent=None, **kwargs):
+        """发送请求并返回 JSON 响应体，重试策略与 HttpClient 相同"""
+        retries = self.max_retries if retries is None else retries
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_status = RETRY_STATUS if idempotent else NON_IDEMPOTENT_RETRY_STATUS
+        for attempt in range(retries + 1):
+            try:
+                async with self.session().request(method, url, **kwargs) as response:
+                    if response.status in retry_status and attempt < retries:
+                        delay = backoff_delay(attempt, self.backoff, response.headers.get('Retry-After'))
+                        logging.warning(f"{method} {url} returned {response.status}, retry in {delay:.2f}s")
+                    else:
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= retries or not (idempotent or isinstance(e, aiohttp.ClientConnectorError)):
+                    raise
+                delay = backoff_delay(attempt, self.backoff)
+                logging.warning(f"{method} {url} failed: {e}, retry in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def post_json(self, url, **kwargs):
+        return await self.request_json('POST', url, **kwargs)
+
+    async def close(self):
+        """关闭当前事件循环的会话"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+
+http_client = HttpClient()
+async_http_client = AsyncHttpClient()
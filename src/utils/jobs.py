@@ -0,0 +1,258 @@
+"""
+抽取任务的持久化队列。
+任务及各抽取窗口的结果保存在本地 SQLite 中，多个 worker 进程以租约方式领取任务并定期续约；
+worker 崩溃后租约过期，任务由其他 worker 重新领取，已保存结果的窗口不再重复抽取。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+# 任务库路径、上传文档保存目录、租约时长(秒)、单个任务最多执行次数
+job_store_path = os.getenv('JOB_STORE_PATH', 'data/jobs/jobs.db')
+job_upload_dir = os.getenv('JOB_UPLOAD_DIR', 'data/jobs/uploads')
+job_lease = float(os.getenv('JOB_LEASE', 60))
+job_max_attempts = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+LLM_TYPES = ('azure', 'memect')
+
+
+class JobStore:
+    """
+    抽取任务存储，每个进程各自创建实例，进程内可多线程共用
+    Args:
+        path: SQLite 文件路径
+        lease: 领取任务后的租约时长(秒)，超时未续约视为 worker 已崩溃
+        max_attempts: 单个任务最多执行次数，失败或崩溃次数达到上限后标记为失败
+    """
+
+    def __init__(self, path=job_store_path, lease=job_lease, max_attempts=job_max_attempts):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # 手动管理事务，领取任务时用 BEGIN IMMEDIATE 加写锁，避免多个 worker 领到同一任务
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS job (
+                                id TEXT PRIMARY KEY,
+                                payload TEXT NOT NULL,
+                                status TEXT NOT NULL,
+                                attempts INTEGER NOT NULL DEFAULT 0,
+                                total_chunks INTEGER,
+                                done_chunks INTEGER NOT NULL DEFAULT 0,
+                                result TEXT,
+                                error TEXT,
+                                worker TEXT,
+                                lease_until REAL,
+                                created_at REAL NOT NULL,
+                                updated_at REAL NOT NULL)''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS job_status ON job (status, created_at)')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS job_chunk (
+                                job_id TEXT NOT NULL,
+                                chunk_id INTEGER NOT NULL,
+                                result TEXT NOT NULL,
+                                PRIMARY KEY (job_id, chunk_id))''')
+
+    def submit(self, payload):
+        """
+        提交任务
+        Args:
+            payload: 任务参数，见 make_payload
+
+        Returns: 任务 id
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute('INSERT INTO job (id, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+                               (job_id, json.dumps(payload, ensure_ascii=False), QUEUED, now, now))
+        return job_id
+
+    @staticmethod
+    def _as_dict(row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def get(self, job_id):
+        """查询任务，不存在时返回 None"""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM job WHERE id = ?', (job_id,)).fetchone()
+        return self._as_dict(row) if row else None
+
+    def claim(self, worker):
+        """
+        领取最早提交的待执行任务，或租约已过期的执行中任务
+        Args:
+            worker: worker 标识
+
+        Returns: 任务 dict，没有可执行的任务时返回 None
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                while True:
+                    now = time.time()
+                    row = self._conn.execute(
+                        'SELECT * FROM job WHERE status = ? OR (status = ? AND lease_until < ?) '
+                        'ORDER BY created_at LIMIT 1', (QUEUED, RUNNING, now)).fetchone()
+                    if row is None:
+                        self._conn.execute('COMMIT')
+                        return None
+                    if row['attempts'] >= self.max_attempts:  # 反复崩溃的任务不再重试
+                        self._conn.execute('UPDATE job SET status = ?, error = ?, worker = NULL, lease_until = NULL, '
+                                           'updated_at = ? WHERE id = ?',
+                                           (FAILED, row['error'] or 'worker lost', now, row['id']))
+                        continue
+                    self._conn.execute('UPDATE job SET status = ?, attempts = attempts + 1, worker = ?, '
+                                       'lease_until = ?, updated_at = ? WHERE id = ?',
+                                       (RUNNING, worker, now + self.lease, now, row['id']))
+                    job = self._as_dict(self._conn.execute('SELECT * FROM job WHERE id = ?', (row['id'],)).fetchone())
+                    self._conn.execute('COMMIT')
+                    return job
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _update_owned(self, job_id, worker, sql, params):
+        """仅当任务仍由该 worker 持有时更新，返回是否更新成功"""
+        with self._lock:
+            cursor = self._conn.execute(
+                f'UPDATE job SET {sql}, updated_at = ? WHERE id = ? AND worker = ? AND status = ?',
+                (*params, time.time(), job_id, worker, RUNNING))
+        return cursor.rowcount > 0
+
+    def renew(self, job_id, worker):
+        """续约，租约已被其他 worker 接管时返回 False"""
+        return self._update_owned(job_id, worker, 'lease_until = ?', (time.time() + self.lease,))
+
+    def set_total(self, job_id, total):
+        """记录任务的抽取窗口数"""
+        with self._lock:
+            self._conn.execute('UPDATE job SET total_chunks = ?, updated_at = ? WHERE id = ?',
+                               (total, time.time(), job_id))
+
+    def save_chunk(self, job_id, chunk_id, result):
+        """保存一个窗口的抽取结果并更新进度"""
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.execute('INSERT OR REPLACE INTO job_chunk (job_id, chunk_id, result) VALUES (?, ?, ?)',
+                               (job_id, chunk_id, json.dumps(result, ensure_ascii=False)))
+            self._conn.execute('UPDATE job SET done_chunks = (SELECT COUNT(*) FROM job_chunk WHERE job_id = ?), '
+                               'updated_at = ? WHERE id = ?', (job_id, time.time(), job_id))
+            self._conn.execute('COMMIT')
+
+    def chunk_results(self, job_id):
+        """已保存的窗口结果 {chunk_id: result}"""
+        with self._lock:
+            rows = self._conn.execute('SELECT chunk_id, result FROM job_chunk WHERE job_id = ?', (job_id,)).fetchall()
+        return {row['chunk_id']: json.loads(row['result']) for row in rows}
+
+    def complete(self, job_id, worker, result):
+        """保存最终结果并清理窗口结果，任务已被其他 worker 接管时返回 False"""
+        done = self._update_owned(job_id, worker, 'status = ?, result = ?, error = NULL, lease_until = NULL',
+                                  (DONE, json.dumps(result, ensure_ascii=False)))
+        if done:
+            with self._lock:
+                self._conn.execute('DELETE FROM job_chunk WHERE job_id = ?', (job_id,))
+        return done
+
+    def fail(self, job_id, worker, error):
+        """
+        记录任务失败，执行次数未达上限时重新排队，已保存的窗口结果保留供下次执行跳过
+        Returns: 任务的新状态，任务已被其他 worker 接管时返回 None
+        """
+        job = self.get(job_id)
+        status = QUEUED if job and job['attempts'] < self.max_attempts else FAILED
+        if self._update_owned(job_id, worker, 'status = ?, error = ?, lease_until = NULL', (status, error)):
+            return status
+        return None
+
+    def counts(self):
+        """各状态的任务数"""
+        with self._lock:
+            rows = self._conn.execute('SELECT status, COUNT(*) AS n FROM job GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def close(self):
+        self._conn.close()
+
+
+def make_payload(model_name, model_names, llm_type='azure', text=None, file=None):
+    """
+    构造任务参数并校验
+    Args:
+        model_name: schema 名称
+        model_names: 可用的 schema 名称
+        llm_type: azure 或 memect
+        text: 待抽取文本，与 file 二选一
+        file: 已保存的文档路径，见 save_upload
+
+    Returns: dict，参数不合法时抛出 ValueError
+    """
+    if bool(text) == bool(file):
+        raise ValueError('exactly one of text and file is required')
+    if model_name not in model_names:
+        raise ValueError(f'model_name must be one of {sorted(model_names)}')
+    if llm_type not in LLM_TYPES:
+        raise ValueError(f'llm_type must be one of {LLM_TYPES}')
+    payload = {"model_name": model_name, "llm_type": llm_type}
+    payload.update({"text": text} if text else {"file": file})
+    return payload
+
+
+def job_view(job):
+    """返回给调用方的任务状态，不含任务参数与 worker 信息"""
+    return {"job_id": job['id'], "status": job['status'], "model_name": job['payload']['model_name'],
+            "total_chunks": job['total_chunks'], "done_chunks": job['done_chunks'], "attempts": job['attempts'],
+            "result": job['result'], "error": job['error'],
+            "created_at": job['created_at'], "updated_at": job['updated_at']}
+
+
+def save_upload(filename, data, upload_dir=job_upload_dir):
+    """按内容 hash 保存上传的文档，返回保存路径"""
+    os.makedirs(upload_dir, exist_ok=True)
+    _, ext = os.path.splitext(filename or '')
+    path = os.path.join(upload_dir, hashlib.md5(data).hexdigest() + ext.lower())
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return path
+
+
+async def extract_chunks(store, job_id, docs, extract, concurrency=8):
+    """
+    并发抽取尚未保存结果的窗口，每个窗口完成后立即保存
+    Args:
+        store: JobStore
+        job_id: 任务 id
+        docs: List[Document]，metadata 含 chunk_id
+        extract: async f(text) -> 窗口抽取结果
+        concurrency: 并发数
+
+    Returns: {chunk_id: result}，包含此前已保存的结果；有窗口失败时在其余窗口完成后抛出第一个异常
+    """
+    done = store.chunk_results(job_id)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(doc):
+        async with semaphore:
+            result = await extract(doc.page_content)
+        store.save_chunk(job_id, doc.metadata['chunk_id'], result)
+
+    errors = [r for r in await asyncio.gather(*(run(doc) for doc in docs if doc.metadata['chunk_id'] not in done),
+                                              return_exceptions=True) if isinstance(r, BaseException)]
+    if errors:
+        raise errors[0]
+    return store.chunk_results(job_id)
@@ -0,0 +1,116 @@
+"""
+客户端动态微批处理。
+并发调用方提交的请求在一个短时间窗口内（或凑满 max_batch_size 条）合并为一次批量请求，结果按顺序回填到各自的 Future。
+窗口大小自适应：窗口内没有等到其他请求时缩短窗口以减少空等，等到了则适当放大以合并更多请求。
+多个批次可同时发送，发送当前批次的同时收集下一批；在途批次达到上限时暂停收集，排队的请求在下一批中直接凑满。
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """
+    微批处理器
+    Args:
+        send_batch: 批量处理函数 f(items) -> results，results 与 items 一一对应
+        max_batch_size: 每批最大条数
+        max_wait_ms: 窗口上限(毫秒)
+        min_wait_ms: 窗口下限(毫秒)
+        max_in_flight: 同时发送的最大批次数
+    """
+
+    def __init__(self, send_batch, max_batch_size=8, max_wait_ms=20, min_wait_ms=1, max_in_flight=4):
+        self.send_batch = send_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.min_wait = min_wait_ms / 1000
+        self.wait = self.max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='micro-batch-send')
+        self._thread = threading.Thread(target=self._run, name='micro-batch', daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """提交一条请求，返回 Future"""
+        if self._closed:
+            raise RuntimeError('MicroBatcher is closed')
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # 处理完当前批次后退出
+                break
+            batch.append(item)
+        self._adapt(len(batch))
+        return batch
+
+    def _adapt(self, size):
+        if size == 1:
+            self.wait = max(self.min_wait, self.wait / 2)
+        elif size < self.max_batch_size:
+            self.wait = min(self.max_wait, self.wait * 1.5)
+
+    def _send(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = self.send_batch(items)
+            if len(results) != len(items):
+                raise ValueError(f'expected {len(items)} results, got {len(results)}')
+        except Exception as e:
+            logging.warning(f"micro batch of {len(items)} failed: {e!r}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.batches += 1
+            self.items += len(items)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _run(self):
+        while True:
+            self._slots.acquire()  # 在途批次已满时等待，期间到达的请求留在队列中
+            batch = self._collect()
+            if batch is None:
+                self._slots.release()
+                return
+            self._executor.submit(self._send, batch)
+
+    def stats(self):
+        with self._lock:
+            batches, items = self.batches, self.items
+        return {"batches": batches, "items": items,
+                "avg_batch_size": items / batches if batches else 0.0,
+                "wait_ms": self.wait * 1000}
+
+    def close(self):
+        """处理完已提交的请求后停止后台线程"""
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,368 @@
+"""
+LLM 调用的全局限流与优先级调度。
+同一模型部署的所有调用共享每分钟请求数(RPM)与每分钟 token 数(TPM)两个令牌桶；
+等待中的调用按优先级（交互式高于批处理）先到先得地获取配额；
+遇到 429 时按 Retry-After（缺省时指数退避）暂停整个部署的调用后重试，避免批量任务持续触发限流拖慢交互式请求。
+配置 LLM_LIMITER_PATH 时，配额、暂停时间与各进程的排队情况保存在 SQLite 中，由 Gradio、API 服务与抽取 worker 等进程共享。
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import openai
+
+from .http_client import backoff_delay
+
+INTERACTIVE = 0
+BATCH = 1
+
+llm_rpm = int(os.getenv('LLM_RPM', 0))  # 0 表示不限制
+llm_tpm = int(os.getenv('LLM_TPM', 0))
+llm_max_retries = int(os.getenv('LLM_MAX_RETRIES', 5))
+# 多进程共享限流状态的 SQLite 路径(置空时各进程各自限流)、让行其他进程高优先级调用时的轮询间隔(秒)
+llm_limiter_path = os.getenv('LLM_LIMITER_PATH', 'data/cache/rate_limit.db')
+llm_limiter_poll = float(os.getenv('LLM_LIMITER_POLL', 0.05))
+
+# 与 langchain 默认重试一致的临时错误，重试前按指数退避等待，不暂停整个部署
+TRANSIENT_ERRORS = (openai.error.Timeout, openai.error.APIError, openai.error.APIConnectionError,
+                    openai.error.ServiceUnavailableError, openai.error.TryAgain)
+
+
+class TokenBucket:
+    """
+    令牌桶，容量为每分钟配额，按秒匀速补充
+    Args:
+        per_minute: 每分钟配额，0 表示不限制
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """获取 amount 个令牌还需等待的时间(秒)，超过容量的请求按容量计算"""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+
+def _retry_after(e):
+    """429 异常返回 Retry-After 秒数（无该响应头时为 0），其他异常返回 None"""
+    status = getattr(e, 'http_status', None) or getattr(e, 'status', None) or getattr(e, 'status_code', None)
+    if status != 429 and type(e).__name__ != 'RateLimitError':
+        return None
+    headers = getattr(e, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After') or headers.get('retry-after') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class LocalQuota:
+    """进程内的配额：请求数与 token 数两个令牌桶及 429 暂停时间，由 RateLimiter 加锁调用"""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+
+    def take(self, tokens, priority):
+        """配额足够时取走并返回 0，否则返回还需等待的时间(秒)"""
+        now = time.monotonic()
+        wait = max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+        if wait <= 0:
+            self.requests.take(1)
+            self.tokens.take(tokens)
+        return wait
+
+    def pause(self, delay):
+        """暂停整个部署的调用 delay 秒"""
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def publish(self, depth):
+        """同步本进程各优先级的排队数，进程内配额无需同步"""
+
+    def close(self):
+        pass
+
+
+class SharedQuota(LocalQuota):
+    """
+    多进程共享的配额，令牌桶、429 暂停时间及各进程各优先级的排队数保存在 SQLite 中，由 RateLimiter 加锁调用。
+    其他进程有更高优先级的调用在排队时本进程让行；进程间无法互相唤醒，等待中的队首调用至少每 heartbeat 秒重新检查一次，
+    并刷新本进程的排队记录，超过 stale 秒未刷新的进程视为已退出
+    Args:
+        path: SQLite 文件路径，共用同一模型部署的进程使用同一文件
+        rpm: 每分钟请求数上限
+        tpm: 每分钟 token 数上限
+        poll: 让行时的轮询间隔(秒)
+        heartbeat: 队首调用最长等待时间(秒)
+        stale: 排队记录的过期时间(秒)
+    """
+
+    def __init__(self, path, rpm, tpm, poll=llm_limiter_poll, heartbeat=1.0, stale=10.0):
+        super().__init__(rpm, tpm)
+        self.poll = poll
+        self.heartbeat = heartbeat
+        self.stale = stale
+        self.process = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value REAL NOT NULL)')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS waiting (
+                                process TEXT NOT NULL,
+                                priority INTEGER NOT NULL,
+                                count INTEGER NOT NULL,
+                                updated REAL NOT NULL,
+                                PRIMARY KEY (process, priority))''')
+        now = time.time()
+        self._conn.executemany('INSERT OR IGNORE INTO state (key, value) VALUES (?, ?)',
+                               [('requests_level', rpm), ('requests_updated', now), ('tokens_level', tpm),
+                                ('tokens_updated', now), ('paused_until', 0.0)])
+
+    def take(self, tokens, priority):
+        now = time.time()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            state = dict(self._conn.execute('SELECT key, value FROM state').fetchall())
+            self._conn.execute('UPDATE waiting SET updated = ? WHERE process = ?', (now, self.process))
+            yielding = self._conn.execute(
+                'SELECT 1 FROM waiting WHERE process != ? AND priority < ? AND count > 0 AND updated > ? LIMIT 1',
+                (self.process, priority, now - self.stale)).fetchone()
+            self.requests.level, self.requests.updated = state['requests_level'], state['requests_updated']
+            self.tokens.level, self.tokens.updated = state['tokens_level'], state['tokens_updated']
+            wait = max(state['paused_until'] - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if yielding:
+                wait = max(wait, self.poll)
+            if wait <= 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+            self._conn.executemany('UPDATE state SET value = ? WHERE key = ?',
+                                   [(self.requests.level, 'requests_level'), (self.requests.updated, 'requests_updated'),
+                                    (self.tokens.level, 'tokens_level'), (self.tokens.updated, 'tokens_updated')])
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        return min(wait, self.heartbeat)
+
+    def pause(self, delay):
+        self._conn.execute("UPDATE state SET value = MAX(value, ?) WHERE key = 'paused_until'", (time.time() + delay,))
+
+    def publish(self, depth):
+        now = time.time()
+        self._conn.executemany('INSERT OR REPLACE INTO waiting (process, priority, count, updated) VALUES (?, ?, ?, ?)',
+                               [(self.process, p, depth[p], now) for p in (INTERACTIVE, BATCH)])
+
+    def close(self):
+        self._conn.execute('DELETE FROM waiting WHERE process = ?', (self.process,))
+        self._conn.close()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimiter:
+    """
+    限流调度器，线程安全，同步调用与协程共用同一队列与配额
+    Args:
+        rpm: 每分钟请求数上限
+        tpm: 每分钟 token 数上限
+        max_retries: 429 及临时错误的最大重试次数
+        path: 多进程共享限流状态的 SQLite 路径，为空时只在进程内限流
+    """
+
+    def __init__(self, rpm=llm_rpm, tpm=llm_tpm, max_retries=llm_max_retries, path=None):
+        self.quota = SharedQuota(path, rpm, tpm) if path else LocalQuota(rpm, tpm)
+        self.max_retries = max_retries
+        self.throttled = 0
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._async_waiters = {}  # ticket -> (loop, future) of coroutines waiting in aacquire
+        self._waits = defaultdict(lambda: [0, 0.0, 0.0])  # priority -> [count, total, max]
+
+    def _notify_all(self):
+        """唤醒所有等待中的线程与协程，需持有 _cond"""
+        self._cond.notify_all()
+        for loop, future in self._async_waiters.values():
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:  # 事件循环已关闭
+                pass
+
+    def _depth(self):
+        depth = defaultdict(int)
+        for priority, _ in self._waiting:
+            depth[priority] += 1
+        return depth
+
+    def _enqueue(self, ticket):
+        heapq.heappush(self._waiting, ticket)
+        self.quota.publish(self._depth())
+
+    def _try_take(self, ticket, tokens):
+        """
+        队首调用尝试取走配额，成功返回 0，否则返回还需等待的时间(秒)；
+        未轮到时返回 None，由前面的调用取走配额或放弃时唤醒，需持有 _cond
+        """
+        if self._waiting[0] != ticket:
+            return None
+        return self.quota.take(tokens, ticket[0])
+
+    def _grant(self, priority, start):
+        """队首调用已取走配额，出队并记录等待时长，需持有 _cond"""
+        heapq.heappop(self._waiting)
+        self.quota.publish(self._depth())
+        waited = time.monotonic() - start
+        stats = self._waits[priority]
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+        self._notify_all()
+        return waited
+
+    def _drop(self, ticket):
+        """放弃等待（如请求已超时取消），移出队列以免继续占用配额，需持有 _cond"""
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            self.quota.publish(self._depth())
+            self._notify_all()
+
+    def acquire(self, tokens, priority=INTERACTIVE):
+        """阻塞直到按优先级轮到本次调用且配额足够，返回等待时长(秒)"""
+        start = time.monotonic()
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            self._enqueue(ticket)
+            try:
+                while True:
+                    wait = self._try_take(ticket, tokens)
+                    if wait is not None and wait <= 0:
+                        break
+                    self._cond.wait(timeout=wait)
+            except BaseException:
+                self._drop(ticket)
+                raise
+            return self._grant(priority, start)
+
+    async def aacquire(self, tokens, priority=INTERACTIVE):
+        """acquire 的异步版本，在事件循环中等待而不占用线程；协程被取消时放弃排队"""
+        start = time.monotonic()
+        ticket = (priority, next(self._seq))
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_take(ticket, tokens)
+                    if wait is not None and wait <= 0:
+                        return self._grant(priority, start)
+                    future = loop.create_future()
+                    self._async_waiters[ticket] = (loop, future)
+                try:
+                    await asyncio.wait({future}, timeout=wait)
+                finally:
+                    with self._cond:
+                        self._async_waiters.pop(ticket, None)
+        except BaseException:
+            with self._cond:
+                self._drop(ticket)
+            raise
+
+    def _retry_delay(self, e, attempt):
+        """
+        调用失败后的重试等待时间(秒)，不可重试时返回 None。
+        429 暂停整个部署的调用（由 acquire 等待），临时错误只在本次调用重试前退避
+        """
+        if attempt >= self.max_retries:
+            return None
+        retry_after = _retry_after(e)
+        if retry_after is not None:
+            delay = backoff_delay(attempt, retry_after=retry_after or None)
+            with self._cond:
+                self.throttled += 1
+                self.quota.pause(delay)
+                self._notify_all()
+            logging.warning(f"LLM rate limited, pause {delay:.2f}s and retry ({attempt + 1}/{self.max_retries})")
+            return 0.0
+        if isinstance(e, TRANSIENT_ERRORS):
+            delay = backoff_delay(attempt)
+            logging.warning(f"LLM call failed: {e!r}, retry in {delay:.2f}s ({attempt + 1}/{self.max_retries})")
+            return delay
+        return None
+
+    def call(self, fn, tokens=0, priority=INTERACTIVE):
+        """
+        在限流调度下调用 fn，429 时暂停后重试，超时、连接失败等临时错误退避后重试
+        Args:
+            fn: 无参函数
+            tokens: 本次调用预计消耗的 token 数（提示词加 max_tokens）
+            priority: INTERACTIVE 或 BATCH
+
+        Returns: fn 的返回值
+        """
+        for attempt in itertools.count():
+            self.acquire(tokens, priority)
+            try:
+                return fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def acall(self, fn, tokens=0, priority=INTERACTIVE):
+        """call 的异步版本，fn 为返回 awaitable 的无参函数，等待配额时不阻塞事件循环"""
+        for attempt in itertools.count():
+            await self.aacquire(tokens, priority)
+            try:
+                return await fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    def metrics(self):
+        """各优先级的排队数与等待时长"""
+        with self._cond:
+            depth = self._depth()
+            return {"queue_depth": {p: depth[p] for p in (INTERACTIVE, BATCH)},
+                    "wait": {p: {"count": c, "avg": total / c if c else 0.0, "max": longest}
+                             for p, (c, total, longest) in ((p, self._waits[p]) for p in (INTERACTIVE, BATCH))},
+                    "throttled": self.throttled}
+
+
+    def close(self):
+        with self._cond:
+            self.quota.close()
+
+
+rate_limiter = RateLimiter(path=llm_limiter_path or None)
@@ -0,0 +1,124 @@
+"""
+LLM 回复的精确匹配缓存。
+以规范化后的请求（后端、模型、消息、temperature、max_tokens）的哈希为键，内存 LRU 为一级缓存，可选 SQLite 为二级缓存，支持过期时间。
+temperature > 0 的请求结果带有随机性，默认不缓存，可通过 allow_sampling 开启。
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    LLM 回复缓存
+    Args:
+        max_items: 内存缓存条数上限
+        ttl: 过期时间(秒)，0 表示不过期
+        disk_path: SQLite 文件路径，为空时不启用磁盘缓存
+        allow_sampling: 是否缓存 temperature > 0 的请求
+    """
+
+    def __init__(self, max_items=1024, ttl=3600, disk_path=None, allow_sampling=False):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.allow_sampling = allow_sampling
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypass = 0
+        self._items = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._conn = None
+        if disk_path:
+            directory = os.path.dirname(disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(disk_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS response (
+                                    key TEXT PRIMARY KEY,
+                                    value TEXT NOT NULL,
+                                    expires_at REAL NOT NULL)''')
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(backend, model, messages, temperature, max_tokens):
+        """规范化请求并计算缓存键"""
+        request = {"backend": backend, "model": model, "messages": messages,
+                   "temperature": round(float(temperature), 4), "max_tokens": max_tokens}
+        canonical = json.dumps(request, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def cacheable(self, temperature):
+        """temperature > 0 的请求仅在 allow_sampling 时缓存"""
+        if temperature > 0 and not self.allow_sampling:
+            with self._lock:
+                self.bypass += 1
+            return False
+        return True
+
+    def _expires_at(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else float('inf')
+
+    def get(self, key):
+        """查询缓存，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item and item[0] > now:
+                self._items.move_to_end(key)
+                self.memory_hits += 1
+                return item[1]
+            if item:
+                del self._items[key]
+            if self._conn is not None:
+                row = self._conn.execute('SELECT value, expires_at FROM response WHERE key = ?', (key,)).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0])
+                    self._put_memory(key, row[1], value)  # 提升到内存缓存
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        """写入缓存，value 需可 JSON 序列化"""
+        expires_at = self._expires_at(ttl)
+        with self._lock:
+            self._put_memory(key, expires_at, value)
+            if self._conn is not None:
+                self._conn.execute('INSERT OR REPLACE INTO response VALUES (?, ?, ?)',
+                                   (key, json.dumps(value, ensure_ascii=False),
+                                    expires_at if expires_at != float('inf') else 1e18))
+                self._conn.execute('DELETE FROM response WHERE expires_at <= ?', (time.time(),))
+                self._conn.commit()
+
+    def _put_memory(self, key, expires_at, value):
+        self._items[key] = (expires_at, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "bypass": self.bypass, "hit_rate": hits / total if total else 0.0, "items": len(self._items)}
+
+    def log_stats(self):
+        """记录命中率等统计，Web 服务每轮对话后调用"""
+        logging.info(f"response cache: {self.stats()}")
+
+
+response_cache = ResponseCache(max_items=int(os.getenv('RESPONSE_CACHE_SIZE', 1024)),
+                               ttl=int(os.getenv('RESPONSE_CACHE_TTL', 3600)),
+                               disk_path=os.getenv('RESPONSE_CACHE_PATH') or None,
+                               allow_sampling=os.getenv('RESPONSE_CACHE_ALLOW_SAMPLING', 'false').lower()
+                               in ('true', '1', 't'))
@@ -0,0 +1,150 @@
+"""
+文档问答的语义缓存。
+按文档 hash 分区保存历史 (问题向量, 回答)，新问题与历史问题的余弦相似度达到阈值时直接返回缓存的回答，跳过检索与 LLM 调用。
+命中结果按采样比例重新计算并与缓存回答比对，用于统计误命中率以校准阈值。
+"""
+import logging
+import os
+import random
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+from .context import _jaccard, _shingles
+
+semantic_cache_threshold = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.95))
+semantic_cache_max_items = int(os.getenv('SEMANTIC_CACHE_MAX_ITEMS', 256))
+semantic_cache_max_docs = int(os.getenv('SEMANTIC_CACHE_MAX_DOCS', 64))
+semantic_cache_audit_rate = float(os.getenv('SEMANTIC_CACHE_AUDIT_RATE', 0.05))
+# 审计时缓存回答与重新生成回答的 bigram 相似度低于该值视为误命中
+semantic_cache_audit_agreement = float(os.getenv('SEMANTIC_CACHE_AUDIT_AGREEMENT', 0.5))
+
+
+class _Partition:
+    """单个分区：内积索引（向量已归一化即余弦相似度）及条目的最近使用顺序"""
+
+    def __init__(self, dim):
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.entries = OrderedDict()  # id -> (query, answer)
+        self.next_id = 0
+
+
+class SemanticCache:
+    """
+    语义缓存
+    Args:
+        threshold: 命中所需的最小余弦相似度
+        max_items: 每个分区的条目上限，超出后淘汰最久未使用的条目
+        max_docs: 分区数上限，超出后淘汰最久未使用的分区
+        audit_rate: 命中后抽样审计的比例
+        audit_agreement: 审计判定一致的最小相似度
+    """
+
+    def __init__(self, threshold=semantic_cache_threshold, max_items=semantic_cache_max_items,
+                 max_docs=semantic_cache_max_docs, audit_rate=semantic_cache_audit_rate,
+                 audit_agreement=semantic_cache_audit_agreement):
+        self.threshold = threshold
+        self.max_items = max_items
+        self.max_docs = max_docs
+        self.audit_rate = audit_rate
+        self.audit_agreement = audit_agreement
+        self.hits = 0
+        self.misses = 0
+        self.audits = 0
+        self.false_hits = 0
+        self._partitions = OrderedDict()  # (doc_hash, scope) -> _Partition
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vec):
+        vec = np.asarray(vec, dtype='float32').reshape(1, -1).copy()
+        faiss.normalize_L2(vec)
+        return vec
+
+    def lookup(self, doc_hash, vec, scope=''):
+        """
+        查找相似问题的缓存回答
+        Args:
+            doc_hash: 文档 hash
+            vec: 问题向量
+            scope: 分区内的细分标识，如模型与任务类型，不同 scope 的回答互不复用
+
+        Returns: (entry_id, answer, score)，未命中返回 None
+        """
+        key = (doc_hash, scope)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None or not partition.entries:
+                self.misses += 1
+                return None
+            scores, ids = partition.index.search(self._normalize(vec), 1)
+            score, entry_id = float(scores[0][0]), int(ids[0][0])
+            if entry_id < 0 or score < self.threshold:
+                self.misses += 1
+                return None
+            self._partitions.move_to_end(key)
+            partition.entries.move_to_end(entry_id)
+            self.hits += 1
+            return entry_id, partition.entries[entry_id][1], score
+
+    def add(self, doc_hash, vec, query, answer, scope=''):
+        """写入一条缓存，返回条目 id"""
+        key = (doc_hash, scope)
+        vec = self._normalize(vec)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None:
+                partition = self._partitions[key] = _Partition(vec.shape[1])
+            self._partitions.move_to_end(key)
+            entry_id = partition.next_id
+            partition.next_id += 1
+            partition.index.add_with_ids(vec, np.array([entry_id], dtype='int64'))
+            partition.entries[entry_id] = (query, answer)
+            while len(partition.entries) > self.max_items:
+                old_id, _ = partition.entries.popitem(last=False)
+                partition.index.remove_ids(np.array([old_id], dtype='int64'))
+            while len(self._partitions) > self.max_docs:
+                self._partitions.popitem(last=False)
+            return entry_id
+
+    def should_audit(self):
+        """按 audit_rate 抽样决定本次命中是否需要重新计算以审计"""
+        return self.audit_rate > 0 and random.random() < self.audit_rate
+
+    def audit(self, doc_hash, entry_id, answer, scope=''):
+        """
+        比对命中的缓存回答与重新生成的回答，误命中时以新回答替换缓存
+        Returns: bool 是否误命中
+        """
+        with self._lock:
+            partition = self._partitions.get((doc_hash, scope))
+            if partition is None or entry_id not in partition.entries:
+                return False
+            query, cached = partition.entries[entry_id]
+            self.audits += 1
+            agreement = _jaccard(_shingles(cached), _shingles(answer))
+            false_hit = agreement < self.audit_agreement
+            if false_hit:
+                self.false_hits += 1
+                partition.entries[entry_id] = (query, answer)
+                logging.warning(f"semantic cache false hit on {doc_hash}: query={query}, agreement={agreement:.2f}")
+            return false_hit
+
+    def invalidate(self, doc_hash):
+        """文档重新入库时清除该文档的所有缓存"""
+        with self._lock:
+            for key in [k for k in self._partitions if k[0] == doc_hash]:
+                del self._partitions[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                    "audits": self.audits, "false_hits": self.false_hits,
+                    "false_hit_rate": self.false_hits / self.audits if self.audits else 0.0,
+                    "docs": len(self._partitions)}
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,48 @@
+"""
+Token 计数工具。
+优先使用 tiktoken 按目标模型的分词器计数，未安装时按字符近似估算（中文按 1 字 1 token，其余约 4 字符 1 token）。
+"""
+import logging
+import math
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken 为可选依赖
+    tiktoken = None
+
+DEFAULT_ENCODING = 'cl100k_base'
+
+
+@lru_cache(maxsize=16)
+def _get_encoding(model):
+    """获取模型对应的分词器，词表无法加载（如离线环境）时返回 None"""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:  # 如 Azure 部署名 gpt-35-turbo
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logging.warning(f"Load tiktoken encoding for {model} failed, use approximate count: {e}")
+        return None
+
+
+def count_tokens(text, model='gpt-3.5-turbo'):
+    """
+    计算文本的 token 数量
+    Args:
+        text: 待计数文本
+        model: 目标模型名称，用于选择对应的分词器
+
+    Returns: int
+
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + math.ceil((len(text) - non_ascii) / 4)
@@ -0,0 +1,202 @@
+"""
+向量存储后端。
+VectorStore 定义文档向量的写入、检索和上下文窗口读取接口，默认使用本地 faiss 文件存储，
+也可通过 VECTOR_STORE=qdrant 切换到 Qdrant，使检索规模不受单进程内存限制。
+"""
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from .corpus import Hit, search_corpus
+from .data_store import INDEX_FILE, PICKLE_FILE, build_index, save_embedding, index_cache, search_index
+
+
+class VectorStore:
+    """向量存储接口，文档以哈希值区分，文本片段以在文档中的顺序号 chunk_id 区分"""
+
+    def exists(self, doc_hash):
+        """文档是否已入库"""
+        raise NotImplementedError
+
+    def add(self, doc_hash, texts, vectors, payloads=None):
+        """
+        写入文档向量
+        Args:
+            doc_hash: 文档哈希
+            texts: 文本片段列表
+            vectors: 与 texts 对应的向量
+            payloads: 与 texts 对应的附加信息，如页码、类型
+        """
+        raise NotImplementedError
+
+    def search(self, doc_hash, query_vector, k, filters=None):
+        """
+        检索相近的文本片段
+        Args:
+            doc_hash: 文档哈希，为 None 时检索全部文档
+            query_vector: 查询向量
+            k: 返回数量
+            filters: 附加信息的等值过滤条件 {key: value}
+
+        Returns: List[Hit] 按 score 从高到低排序
+        """
+        raise NotImplementedError
+
+    def window(self, doc_hash, chunk_id, size):
+        """读取 [chunk_id, chunk_id + size) 范围内的文本片段"""
+        raise NotImplementedError
+
+    def delete(self, doc_hash):
+        """删除文档向量"""
+        raise NotImplementedError
+
+
+class FaissVectorStore(VectorStore):
+    """基于本地 faiss 文件的向量存储，每个文档一个目录 data/store/<hash>"""
+
+    def __init__(self, store_base_dir='data/store'):
+        self.store_base_dir = store_base_dir
+
+    def _store_dir(self, doc_hash):
+        return os.path.join(self.store_base_dir, doc_hash)
+
+    def exists(self, doc_hash):
+        store_dir = self._store_dir(doc_hash)
+        return os.path.exists(os.path.join(store_dir, INDEX_FILE)) or os.path.exists(
+            os.path.join(store_dir, PICKLE_FILE))
+
+    def add(self, doc_hash, texts, vectors, payloads=None):
+        # payloads 中的页码和类型随文本落盘，本地存储仅支持文档级过滤
+        index, meta = build_index(np.array(vectors, dtype='float32'))
+        os.makedirs(self._store_dir(doc_hash), exist_ok=True)
+        save_embedding({"index": index, "embedding": list(texts), "meta": meta, "payloads": payloads},
+                       self._store_dir(doc_hash))
+
+    def search(self, doc_hash, query_vector, k, filters=None):
+        if doc_hash is None:
+            return search_corpus(query_vector, k, self.store_base_dir)
+        index, data, meta = index_cache.get(self._store_dir(doc_hash))
+        distances, ids = search_index(index, meta, [query_vector], k)
+        sign = 1 if meta.get('metric') == 'cosine' else -1
+        return [Hit(doc_hash, int(i), sign * float(d), data[int(i)]) for d, i in zip(distances[0], ids[0]) if i >= 0]
+
+    def window(self, doc_hash, chunk_id, size):
+        _, data, _ = index_cache.get(self._store_dir(doc_hash))
+        return data[chunk_id:chunk_id + size]
+
+    def delete(self, doc_hash):
+        store_dir = self._store_dir(doc_hash)
+        index_cache.invalidate(store_dir)
+        for name in os.listdir(store_dir) if os.path.isdir(store_dir) else []:
+            if name.startswith(('index.', 'texts.')) or name == PICKLE_FILE:
+                os.remove(os.path.join(store_dir, name))
+
+
+class QdrantVectorStore(VectorStore):
+    """
+    基于 Qdrant 的向量存储，所有文档写入同一集合，payload 中记录 doc_hash、chunk_id 和文本。
+    写入时按 batch_size 分批并行 upsert，检索时在服务端完成过滤和 top-k。
+    本地模式(:memory: 或本地路径)的客户端不是线程安全的，需使用 parallel=1。
+    """
+
+    def __init__(self, client, collection_name='doc_embedding', batch_size=256, parallel=4):
+        self.client = client
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.parallel = parallel
+
+    def _ensure_collection(self, dim):
+        names = [c.name for c in self.client.get_collections().collections]
+        if self.collection_name in names:
+            return
+        self.client.create_collection(collection_name=self.collection_name,
+                                      vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE))
+        for field, schema in (('doc_hash', models.PayloadSchemaType.KEYWORD),
+                              ('chunk_id', models.PayloadSchemaType.INTEGER)):
+            self.client.create_payload_index(self.collection_name, field, field_schema=schema)
+        logging.info(f"Create qdrant collection {self.collection_name}, dim={dim}")
+
+    @staticmethod
+    def _filter(doc_hash=None, filters=None, chunk_range=None):
+        must = [models.FieldCondition(key=key, match=models.MatchValue(value=value))
+                for key, value in (filters or {}).items()]
+        if doc_hash is not None:
+            must.append(models.FieldCondition(key='doc_hash', match=models.MatchValue(value=doc_hash)))
+        if chunk_range is not None:
+            must.append(models.FieldCondition(key='chunk_id', range=models.Range(gte=chunk_range[0],
+                                                                                lt=chunk_range[1])))
+        return models.Filter(must=must) if must else None
+
+    @staticmethod
+    def point_id(doc_hash, chunk_id):
+        return str(uuid.uuid5(uuid.NAMESPACE_OID, f'{doc_hash}/{chunk_id}'))
+
+    def exists(self, doc_hash):
+        names = [c.name for c in self.client.get_collections().collections]
+        if self.collection_name not in names:
+            return False
+        records, _ = self.client.scroll(self.collection_name, scroll_filter=self._filter(doc_hash), limit=1,
+                                        with_payload=False)
+        return len(records) > 0
+
+    def add(self, doc_hash, texts, vectors, payloads=None):
+        vectors = np.asarray(vectors, dtype='float32')
+        if not len(vectors):
+            return
+        self._ensure_collection(vectors.shape[1])
+        payloads = payloads or [{}] * len(texts)
+
+        def upsert(start):
+            end = min(start + self.batch_size, len(texts))
+            self.client.upsert(
+                collection_name=self.collection_name,
+                points=models.Batch(
+                    ids=[self.point_id(doc_hash, i) for i in range(start, end)],
+                    vectors=vectors[start:end].tolist(),
+                    payloads=[{**payloads[i], "doc_hash": doc_hash, "chunk_id": i, "text": texts[i]}
+                              for i in range(start, end)],
+                ),
+                wait=True,
+            )
+            return end - start
+
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            total = sum(executor.map(upsert, range(0, len(texts), self.batch_size)))
+        logging.info(f"Upsert {total} points of {doc_hash} into {self.collection_name}")
+
+    def search(self, doc_hash, query_vector, k, filters=None):
+        points = self.client.search(collection_name=self.collection_name,
+                                    query_vector=np.asarray(query_vector, dtype='float32').tolist(),
+                                    query_filter=self._filter(doc_hash, filters), limit=k, with_payload=True)
+        return [Hit(p.payload['doc_hash'], p.payload['chunk_id'], p.score, p.payload['text']) for p in points]
+
+    def window(self, doc_hash, chunk_id, size):
+        records, _ = self.client.scroll(collection_name=self.collection_name,
+                                        scroll_filter=self._filter(doc_hash, chunk_range=(chunk_id, chunk_id + size)),
+                                        limit=size, with_payload=True)
+        return [r.payload['text'] for r in sorted(records, key=lambda r: r.payload['chunk_id'])]
+
+    def delete(self, doc_hash):
+        self.client.delete(collection_name=self.collection_name,
+                           points_selector=models.FilterSelector(filter=self._filter(doc_hash)))
+
+
+def get_vector_store(store_base_dir='data/store'):
+    """根据环境变量 VECTOR_STORE 创建向量存储，faiss(默认) 或 qdrant"""
+    backend = os.getenv('VECTOR_STORE', 'faiss')
+    if backend == 'faiss':
+        return FaissVectorStore(store_base_dir)
+    if backend == 'qdrant':
+        location = os.getenv('QDRANT_LOCATION')  # 如 :memory: 或 http://localhost:6333
+        client = QdrantClient(location=location) if location else QdrantClient(
+            os.getenv('QDRANT_HOST', 'localhost'), port=int(os.getenv('QDRANT_PORT', 6333)))
+        local = location is not None and not location.startswith(('http://', 'https://'))
+        return QdrantVectorStore(client, os.getenv('QDRANT_COLLECTION', 'doc_embedding'),
+                                 batch_size=int(os.getenv('QDRANT_BATCH_SIZE', 256)),
+                                 parallel=1 if local else int(os.getenv('QDRANT_PARALLEL', 4)))
+    raise ValueError(f'Unknown vector store {backend}')
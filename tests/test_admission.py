@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from src.utils.admission import AdmissionController, Overloaded
+
+
+def test_limits_concurrency_and_sheds_when_queue_is_full():
+    controller = AdmissionController(max_concurrency=2, max_queue=2, timeout=5)
+    running, peak = [0], [0]
+
+    async def work():
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.05)
+        running[0] -= 1
+        return 'ok'
+
+    async def main():
+        return await asyncio.gather(*(controller.run(work) for _ in range(6)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert results.count('ok') == 4 and sum(isinstance(r, Overloaded) for r in results) == 2
+    assert peak[0] == 2
+    assert controller.metrics()['completed'] == 4 and controller.metrics()['rejected'] == 2
+
+
+def test_timeout_includes_queue_time():
+    controller = AdmissionController(max_concurrency=1, max_queue=10, timeout=0.1)
+
+    async def main():
+        slow = controller.run(lambda: asyncio.sleep(0.08))
+        queued = controller.run(lambda: asyncio.sleep(0.05))
+        return await asyncio.gather(slow, queued, return_exceptions=True)
+
+    slow, queued = asyncio.run(main())
+    assert slow is None and isinstance(queued, asyncio.TimeoutError)
+    assert controller.metrics()['timed_out'] == 1
+
+
+def test_draining_rejects_new_requests_and_finishes_in_flight():
+    controller = AdmissionController(max_concurrency=4, max_queue=4, timeout=5)
+
+    async def main():
+        in_flight = asyncio.ensure_future(controller.run(lambda: asyncio.sleep(0.1, 'done')))
+        await asyncio.sleep(0.01)
+        controller.draining = True
+        with pytest.raises(Overloaded, match='draining'):
+            await controller.run(lambda: asyncio.sleep(0))
+        return await in_flight
+
+    assert asyncio.run(main()) == 'done'
+    assert controller.metrics()['draining'] and controller.metrics()['in_flight'] == 0
@@ -0,0 +1,61 @@
+import os
+import sys
+
+from kor import Object, Text, create_extraction_chain
+from langchain.llms.fake import FakeListLLM
+
+from model.schema import person_schema
+from src.azure_llm import ScheduledAzureChatOpenAI
+from src.chain_cache import ChainCache, load_schemas, model_key
+
+
+def test_chain_is_cached_per_schema_and_model_and_renders_like_kor():
+    cache = ChainCache()
+    llm = FakeListLLM(responses=['<json>{"person": [{"name": "张三"}]}</json>'])
+    chain = cache.get(llm, person_schema)
+    assert cache.get(llm, person_schema) is chain and (cache.hits, cache.misses) == (1, 1)
+    assert chain.predict_and_parse(text='张三辞去董事长职务')['data'] == {'person': [{'name': '张三'}]}
+
+    expected = create_extraction_chain(llm, person_schema, encoder_or_encoder_class='json').prompt
+    text = '张三辞去董事长职务'
+    assert chain.prompt.format_prompt(text=text).to_string() == expected.format_prompt(text=text).to_string()
+    assert chain.prompt.format_prompt(text=text).to_messages() == expected.format_prompt(text=text).to_messages()
+
+
+def test_changed_schema_replaces_stale_chain():
+    cache = ChainCache()
+    llm = FakeListLLM(responses=['<json>{}</json>'])
+    old = Object(id='info', description='停牌信息', attributes=[Text(id='date', description='停牌日期')])
+    new = Object(id='info', description='停牌信息', attributes=[Text(id='date', description='停牌日期'),
+                                                              Text(id='day', description='停牌天数')])
+    first = cache.get(llm, old)
+    assert cache.get(llm, new) is not first and len(cache) == 1
+    cache.invalidate('info')
+    assert len(cache) == 0
+
+
+def test_load_schemas_reloads_changed_module(tmp_path, monkeypatch):
+    path = tmp_path / 'tmp_schemas.py'
+    path.write_text("from kor import Object, Text\n"
+                    "a_schema = Object(id='a', description='', attributes=[Text(id='x', description='')])\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    import tmp_schemas
+    assert list(load_schemas(tmp_schemas)) == ['a_schema']
+
+    path.write_text(path.read_text() + "b_schema = Object(id='b', description='', attributes=[Text(id='y', description='')])\n")
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    assert list(load_schemas(tmp_schemas)) == ['a_schema', 'b_schema']
+    sys.modules.pop('tmp_schemas')
+
+
+def test_models_differing_only_in_generation_params_get_separate_chains():
+    cache = ChainCache()
+    short = ScheduledAzureChatOpenAI(deployment_name='gpt-35-turbo', temperature=0, max_tokens=2000,
+                                     openai_api_key='x', openai_api_base='http://x', openai_api_version='v')
+    long = ScheduledAzureChatOpenAI(deployment_name='gpt-35-turbo', temperature=0, max_tokens=2048,
+                                    openai_api_key='x', openai_api_base='http://x', openai_api_version='v')
+    assert model_key(short) != model_key(long)
+    assert cache.get(short, person_schema).llm.max_tokens == 2000
+    assert cache.get(long, person_schema).llm.max_tokens == 2048
+    assert len(cache) == 2
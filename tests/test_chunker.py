@@ -0,0 +1,36 @@
+import json
+
+from src.utils.chunker import DocContent, iter_chunks, iter_doc_items
+from src.utils.tokens import count_tokens
+
+
+def _items():
+    return [
+        {"type": "title", "page_number": 1, "text": "第一节 重要提示"},
+        {"type": "text", "page_number": 1, "text": "本公司董事会保证公告内容真实。" * 3},
+        {"type": "text", "page_number": 2, "text": "风险提示。" * 30},
+        {"type": "table", "page_number": 3, "text": "项目|金额\n" + "\n".join(f"行{i}|{i}" for i in range(40))},
+        {"type": "section", "page_number": 4, "text": "第二节 公司简介"},
+        {"type": "text", "page_number": 4, "text": "最后一行"},
+    ]
+
+
+def test_iter_doc_items_reads_page_and_type(tmp_path):
+    path = tmp_path / 'doc.json'
+    path.write_text(json.dumps({"items": _items()}, ensure_ascii=False), encoding='utf-8')
+    contents = list(iter_doc_items(str(path)))
+    assert [(c.text_type, c.page) for c in contents][:2] == [('title', 1), ('text', 1)]
+
+
+def test_iter_chunks_follows_structure_and_budget():
+    contents = [DocContent(i['type'], i['page_number'], i['text']) for i in _items()]
+    chunks = list(iter_chunks(iter(contents), max_tokens=60, overlap_tokens=10))
+    assert all(count_tokens(c.text) <= 60 for c in chunks)
+    assert chunks[0].text.startswith('第一节 重要提示') and chunks[0].page == 1
+    tables = [c for c in chunks if c.text_type == 'table']
+    assert len(tables) > 1 and all(c.text.startswith('项目|金额') and c.page == 3 for c in tables)
+    # 不丢失最后一个元素，章节标题随正文进入同一块
+    assert chunks[-1].text == '第二节 公司简介\n最后一行' and chunks[-1].page == 4
+    # 同一章节内相邻块存在重叠
+    body = [c for c in chunks if c.text_type == 'text' and c.page in (1, 2)]
+    assert any(a.text.split('\n')[-1] in b.text for a, b in zip(body, body[1:]))
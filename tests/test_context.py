@@ -0,0 +1,37 @@
+from src.utils.context import build_context, merge_spans
+from src.utils.corpus import Hit
+from src.utils.tokens import count_tokens
+
+
+def _load(texts):
+    return lambda doc_hash, start, size: texts[doc_hash][start:start + size]
+
+
+def test_merge_spans_joins_overlapping_windows():
+    hits = [Hit('a', 10, 0.9, ''), Hit('a', 12, 0.5, ''), Hit('a', 30, 0.7, ''), Hit('b', 11, 0.8, '')]
+    spans = merge_spans(hits, window=6)
+    assert [(s.doc_hash, s.start, s.end, s.score) for s in spans] == [
+        ('a', 10, 18, 0.9), ('a', 30, 36, 0.7), ('b', 11, 17, 0.8)]
+
+
+def test_build_context_dedupes_and_respects_budget():
+    texts = {'a': [f'第{i}段内容。' for i in range(40)]}
+    texts['a'][31] = texts['a'][11]  # 重复文本只出现一次
+    hits = [Hit('a', 10, -0.1, ''), Hit('a', 11, -0.2, ''), Hit('a', 30, -0.5, '')]
+    text, tokens = build_context(hits, _load(texts), token_budget=10000, window=3)
+    lines = text.split('\n')
+    assert lines == ['第10段内容。', '第11段内容。', '第12段内容。', '第13段内容。', '第30段内容。', '第32段内容。']
+
+    text, tokens = build_context(hits, _load(texts), token_budget=30, window=3)
+    assert tokens <= 30 and count_tokens(text) <= 30
+    assert text.startswith('第10段内容。')
+
+
+def test_build_context_mmr_prefers_diverse_passages():
+    texts = {'a': ['董事会公告重复内容'] * 2 + ['x'] * 8 + ['董事会公告重复内容甲'] + ['x'] * 9 + ['营业收入增长百分之十']}
+    hits = [Hit('a', 0, 1.0, ''), Hit('a', 10, 0.95, ''), Hit('a', 20, 0.9, '')]
+    budget = 2 * (count_tokens('董事会公告重复内容甲') + 1)
+    text, _ = build_context(hits, _load(texts), token_budget=budget, window=1, mmr_lambda=0.3)
+    assert '营业收入' in text
+    text, _ = build_context(hits, _load(texts), token_budget=budget, window=1, mmr_lambda=1)
+    assert '营业收入' not in text
@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.utils.corpus import corpus_index_cache, list_shards, search_corpus
+from src.utils.data_store import build_index, index_cache, save_embedding
+
+
+def test_search_corpus_merges_top_k_across_shards(tmp_path):
+    rng = np.random.RandomState(0)
+    vectors = {}
+    for doc in ('doc_a', 'doc_b', 'doc_c'):
+        emb = rng.rand(20, 8).astype('float32')
+        index, meta = build_index(emb, index_type='flat', metric='l2')
+        (tmp_path / doc).mkdir()
+        save_embedding({"index": index, "embedding": [f'{doc}-{i}' for i in range(20)], "meta": meta},
+                       str(tmp_path / doc))
+        vectors[doc] = emb
+    (tmp_path / 'empty').mkdir()
+    assert len(list_shards(str(tmp_path))) == 3
+
+    query = vectors['doc_b'][3]
+    hits = search_corpus(query, k=5, store_base_dir=str(tmp_path))
+    assert len(hits) == 5
+    assert (hits[0].doc_hash, hits[0].chunk_id, hits[0].text) == ('doc_b', 3, 'doc_b-3')
+    assert [h.score for h in hits] == sorted((h.score for h in hits), reverse=True)
+
+    distances = np.concatenate([np.sum((emb - query) ** 2, axis=1) for emb in vectors.values()])
+    assert np.allclose([-h.score for h in hits], np.sort(distances)[:5], atol=1e-5)
+
+    only_a = search_corpus(query, k=3, store_base_dir=str(tmp_path), doc_hashes={'doc_a'})
+    assert {h.doc_hash for h in only_a} == {'doc_a'}
+
+    # 跨文档检索不占用文档问答的索引缓存
+    assert all(index_cache.lookup(shard) is None for shard in list_shards(str(tmp_path)))
+    assert all(corpus_index_cache.lookup(shard) is not None for shard in list_shards(str(tmp_path)))
@@ -0,0 +1,129 @@
+import os
+import pickle
+import threading
+import time
+
+import faiss
+import numpy as np
+
+from src.utils.data_store import save_embedding, load_embedding, TextStore, build_index, search_index, \
+    choose_index_type, MmapFlatIndex, VECTORS_FILE
+
+
+def _embedding_with_index(texts, d=4):
+    emb = np.random.RandomState(0).rand(len(texts), d).astype('float32')
+    index = faiss.IndexFlatL2(d)
+    index.add(emb)
+    return {"index": index, "embedding": texts}, emb
+
+
+def test_save_and_load_store(tmp_path):
+    texts = ['第一段', '', 'second 段落', '表格|1|2']
+    emb_with_index, emb = _embedding_with_index(texts)
+    save_embedding(emb_with_index, str(tmp_path))
+    index, data, meta = load_embedding(str(tmp_path))
+    assert index.ntotal == len(texts) and meta['index_type'] == 'flat'
+    assert list(data) == texts
+    assert data[1:3] == texts[1:3] and data[-1] == texts[-1] and data[-1:2] == texts[-1:2]
+    _, ids = index.search(emb[2:3], k=1)
+    assert data[int(ids[0][0])] == 'second 段落'
+    # flat 索引的向量以 mmap 方式读取，不载入进程内存
+    assert isinstance(index, MmapFlatIndex) and isinstance(index.vectors, np.memmap)
+
+
+def test_legacy_flat_store_gets_vector_file(tmp_path):
+    emb_with_index, emb = _embedding_with_index(['a', 'b', 'c'])
+    save_embedding(emb_with_index, str(tmp_path))
+    os.remove(tmp_path / VECTORS_FILE)
+    index, _, meta = load_embedding(str(tmp_path))
+    assert not isinstance(index, MmapFlatIndex) and (tmp_path / VECTORS_FILE).exists()
+    mmapped, _, _ = load_embedding(str(tmp_path))
+    assert isinstance(mmapped, MmapFlatIndex)
+    for loaded in (index, mmapped):
+        distances, ids = search_index(loaded, meta, emb[1], k=5)
+        assert ids[0][0] == 1 and distances[0][0] < 1e-6
+        assert sorted(ids[0][:3]) == [0, 1, 2] and list(ids[0][3:]) == [-1, -1]
+
+
+def test_migrate_pickle_store(tmp_path):
+    emb_with_index, _ = _embedding_with_index(['a', 'b'])
+    with open(tmp_path / 'embedding.pickle', 'wb') as f:
+        pickle.dump(emb_with_index, f)
+    index, data, _ = load_embedding(str(tmp_path))
+    assert index.ntotal == 2 and isinstance(data, TextStore) and data[:] == ['a', 'b']
+
+
+def test_index_cache_hits_invalidates_and_evicts(tmp_path):
+    from src.utils.data_store import IndexCache
+    dirs = []
+    for name in ('doc_a', 'doc_b', 'doc_c'):
+        (tmp_path / name).mkdir()
+        save_embedding(_embedding_with_index([name, 'x'])[0], str(tmp_path / name))
+        dirs.append(str(tmp_path / name))
+
+    cache = IndexCache(max_items=2)
+    first = cache.get(dirs[0])
+    assert cache.get(dirs[0]) is first
+    save_embedding(_embedding_with_index(['changed', 'x', 'y'])[0], dirs[0])
+    reloaded = cache.get(dirs[0])
+    assert reloaded is not first and reloaded[1][0] == 'changed'
+
+    cache.get(dirs[1])
+    cache.get(dirs[2])
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['items'], stats['evictions']) == (1, 4, 2, 1)
+
+
+def test_index_cache_loads_outside_the_global_lock(tmp_path, monkeypatch):
+    import src.utils.data_store as data_store
+    for name in ('doc_a', 'doc_b'):
+        (tmp_path / name).mkdir()
+        save_embedding(_embedding_with_index([name])[0], str(tmp_path / name))
+    cache = data_store.IndexCache()
+    cached = cache.get(str(tmp_path / 'doc_b'))
+    assert cache.lookup(str(tmp_path / 'doc_a')) is None
+
+    loading, release = threading.Event(), threading.Event()
+
+    def slow_load(store_dir):
+        loading.set()
+        release.wait(5)
+        return load_embedding(store_dir)
+
+    monkeypatch.setattr(data_store, 'load_embedding', slow_load)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(str(tmp_path / 'doc_a')))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    assert loading.wait(5)
+    start = time.perf_counter()
+    assert cache.get(str(tmp_path / 'doc_b')) is cached  # 其他文档的命中不等待加载
+    assert time.perf_counter() - start < 0.5
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results[0] is results[1] and cache.stats()['misses'] == 2  # 同一文档只加载一次
+
+
+def test_build_index_types_and_search_params(tmp_path):
+    emb = np.random.RandomState(1).rand(2000, 16).astype('float32')
+    for index_type, metric in (('flat', 'cosine'), ('ivf_flat', 'l2'), ('hnsw', 'l2'), ('ivf_pq', 'cosine')):
+        index, meta = build_index(emb, index_type=index_type, metric=metric)
+        assert index.ntotal == len(emb)
+        save_embedding({"index": index, "embedding": [str(i) for i in range(len(emb))], "meta": meta}, str(tmp_path))
+        loaded, _, loaded_meta = load_embedding(str(tmp_path))
+        assert loaded_meta == meta
+        _, ids = search_index(loaded, loaded_meta, emb[7], k=5, nprobe=loaded_meta.get('nlist'), ef_search=128)
+        assert 7 in ids[0]
+    # 样本不足以训练 PQ 时退化为 ivf_flat
+    assert meta['index_type'] == 'ivf_flat'
+    assert [choose_index_type(n) for n in (100, 50000, 500000)] == ['flat', 'ivf_flat', 'ivf_pq']
+
+
+def test_payloads_are_persisted(tmp_path):
+    emb_with_index, _ = _embedding_with_index(['a', 'b', 'c'])
+    emb_with_index['payloads'] = [{"page_number": 0, "type": "title"}, {"page_number": 3, "type": "table"},
+                                  {"page_number": None, "type": "text"}]
+    save_embedding(emb_with_index, str(tmp_path))
+    _, data, _ = load_embedding(str(tmp_path))
+    assert [data.payload(i) for i in range(3)] == emb_with_index['payloads']
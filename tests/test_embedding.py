@@ -0,0 +1,53 @@
+from src.utils import embedding
+
+
+def test_split_batches_keeps_order_and_limits():
+    texts = [f'句子{i}' for i in range(10)]
+    batches = embedding.split_batches(texts, batch_size=4, max_tokens=10000)
+    assert [len(b) for b in batches] == [4, 4, 2]
+    assert sum(batches, []) == texts
+
+    batches = embedding.split_batches(['a' * 40, 'b' * 40, 'c' * 40], batch_size=16, max_tokens=15)
+    assert batches == [['a' * 40], ['b' * 40], ['c' * 40]]
+
+
+def test_batch_embedding_returns_pairs_in_input_order(monkeypatch):
+    monkeypatch.setattr(embedding, 'texts_to_embedding',
+                        lambda texts: ([[float(t)] for t in texts], len(texts)))
+    texts = [str(i) for i in range(8)]
+    result, tokens = embedding.batch_embedding(texts, concurrency=3)
+    assert result == [(t, [float(t)]) for t in texts]
+    assert tokens == 8
+
+
+def test_registry_loads_each_model_once(monkeypatch):
+    import threading
+    loads = []
+    monkeypatch.setattr(embedding, 'HuggingFaceEmbeddings', lambda model_name: loads.append(model_name) or object())
+    registry = embedding.EmbeddingRegistry(embedding.embedding_model_dict, min_free_mb=0)
+    threads = [threading.Thread(target=registry.get, args=('text2vec',)) for _ in range(8)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert loads == [embedding.embedding_model_dict['text2vec']]
+
+    assert registry.release_idle(idle_seconds=0) == ['text2vec']
+    assert registry.loaded() == []
+
+
+def test_remote_embedding_passes_its_own_credentials(monkeypatch):
+    import openai
+    from loadtest.stubs import LatencyProfile, OpenAIStub
+    from src.gpt import ModelClient
+
+    server = OpenAIStub(profile=LatencyProfile(0.01)).start()
+    try:
+        monkeypatch.setattr(openai, 'api_key', None)
+        monkeypatch.setattr(openai, 'api_type', 'open_ai')
+        monkeypatch.setattr(embedding, 'embedding_client',
+                            ModelClient('stub', 'azure', server.url, '2023-03-15-preview'))
+        monkeypatch.setattr(embedding, 'embedding_cache', None)
+        monkeypatch.setenv('is_local', 'false')
+        result, tokens = embedding.get_embedding(['a', 'b'])
+        assert [text for text, _ in result] == ['a', 'b'] and len(result[0][1]) == 1536 and tokens
+    finally:
+        server.stop()
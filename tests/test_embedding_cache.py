@@ -0,0 +1,38 @@
+from src.utils import embedding
+from src.utils.embedding_cache import EmbeddingCache
+
+
+def test_cache_roundtrip_and_counters(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'emb.db'))
+    cache.put_many('m', [('董事会声明', [0.5, 1.0]), ('风险提示', [0.25, 2.0])])
+    # 归一化后相同的文本命中同一条记录
+    assert cache.get_many('m', [' 董事会声明 ', '其他', '风险提示']) == [[0.5, 1.0], None, [0.25, 2.0]]
+    assert cache.get_many('other-model', ['董事会声明']) == [None]
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 2, 2)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'emb.db'), max_bytes=3 * 4 * 4)
+    for i in range(3):
+        cache.put_many('m', [(f't{i}', [float(i)] * 4)])
+    cache.get_many('m', ['t0'])
+    cache.put_many('m', [('t3', [3.0] * 4)])
+    assert cache.get_many('m', ['t0', 't1', 't3']) == [[0.0] * 4, None, [3.0] * 4]
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+
+def test_get_embedding_only_computes_misses(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_compute(texts):
+        calls.append(list(texts))
+        return [(t, [float(len(t))]) for t in texts], len(texts)
+
+    monkeypatch.setattr(embedding, 'embedding_cache', EmbeddingCache(str(tmp_path / 'emb.db')))
+    monkeypatch.setattr(embedding, 'compute_embedding', fake_compute)
+    monkeypatch.setenv('is_local', 'false')
+    embedding.get_embedding(['a', 'bb'])
+    result, _ = embedding.get_embedding(['bb', 'ccc', 'a', 'ccc'])
+    assert calls == [['a', 'bb'], ['ccc']]
+    assert result == [('bb', [2.0]), ('ccc', [3.0]), ('a', [1.0]), ('ccc', [3.0])]
@@ -0,0 +1,43 @@
+from kor import Object, Text
+
+from model.schema import info_schema, person_schema
+from src.utils.chunker import DocContent
+from src.utils.extraction import merge_extractions, split_documents
+
+
+def test_split_documents_into_context_windows():
+    contents = [DocContent('text', i // 10, f'第{i}段，公司董事会收到董事长的书面辞职报告。') for i in range(100)]
+    docs = split_documents(iter(contents), max_tokens=200, overlap_tokens=0)
+    assert len(docs) > 5
+    assert [d.metadata['chunk_id'] for d in docs] == list(range(len(docs)))
+    assert docs[0].page_content.startswith('第0段') and docs[-1].metadata['page'] == 9
+
+
+def test_merge_single_record_keeps_first_value_and_unions_many_attributes():
+    results = [
+        {'info': {'company_name': ['文因互联'], 'date': [], 'day': ''}},
+        {'info': [{'company_name': ['文因互联', '文因科技'], 'date': ['2023年4月27日'], 'day': ['1天']}]},
+        {},
+        None,
+        {'info': {'company_name': [], 'date': ['2023年4月27日'], 'day': ['2天']}},
+    ]
+    assert merge_extractions(info_schema, results) == {'info': {
+        'company_name': ['文因互联', '文因科技'], 'date': ['2023年4月27日'], 'day': ['1天', '2天']}}
+
+
+def test_merge_many_records_dedupes_across_overlapping_chunks():
+    zhang = {'name': '张三', 'date': '2023年3月', 'position': '董事长', 'reason': '', 'after_position': '',
+             'share': '', 'sex': '男'}
+    li = dict(zhang, name='李四', position='董事')
+    results = [{'person': [zhang]}, {'person': [zhang, li]}, {'person': [{'name': '', 'sex': ''}]}]
+    assert merge_extractions(person_schema, results) == {'person': [zhang, li]}
+
+
+def test_merge_nested_objects():
+    schema = Object(id='report', description='', many=False, attributes=[
+        Text(id='title', description=''),
+        Object(id='holder', description='', many=True, attributes=[Text(id='name', description='')]),
+    ])
+    results = [{'report': {'title': '', 'holder': [{'name': 'A'}]}},
+               {'report': {'title': '年报', 'holder': [{'name': 'A'}, {'name': 'B'}]}}]
+    assert merge_extractions(schema, results) == {'report': {'title': '年报', 'holder': [{'name': 'A'}, {'name': 'B'}]}}
@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from src.utils.fanout import LatencyTracker, fan_out, hedged_call, imap_unordered
+
+
+def _sleep(seconds, value):
+    def call():
+        time.sleep(seconds)
+        return value
+    return call
+
+
+def _fail():
+    raise ValueError('boom')
+
+
+def test_fan_out_runs_concurrently_and_returns_partial_results():
+    start = time.perf_counter()
+    results = fan_out({'slow': _sleep(2, 'late'), 'fast': _sleep(0.2, 'a'), 'fast2': _sleep(0.2, 'b'),
+                       'broken': _fail},
+                      deadlines={'slow': 0.5}, tracker=LatencyTracker())
+    assert time.perf_counter() - start < 1
+    assert list(results) == ['slow', 'fast', 'fast2', 'broken']
+    assert results['fast'].value == 'a' and results['fast2'].value == 'b'
+    assert isinstance(results['slow'].error, TimeoutError)
+    assert isinstance(results['broken'].error, ValueError)
+
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(min_samples=3)
+    assert tracker.percentile('gpt', default=7) == 7
+    for seconds in (1, 2, 3, 4):
+        tracker.record('gpt', seconds)
+    assert tracker.percentile('gpt', q=50) == pytest.approx(2.5)
+
+
+def test_hedged_call_skips_secondary_when_primary_is_fast():
+    calls = []
+    result = hedged_call(('a', _sleep(0.05, 'A')), ('b', lambda: calls.append('b')), delay=0.5,
+                         tracker=LatencyTracker())
+    assert result.value == 'A' and not calls
+
+
+def test_hedged_call_uses_secondary_when_primary_is_slow():
+    start = time.perf_counter()
+    result = hedged_call(('a', _sleep(2, 'A')), ('b', _sleep(0.1, 'B')), delay=0.2, tracker=LatencyTracker())
+    assert result.name == 'b' and result.value == 'B'
+    assert time.perf_counter() - start < 1
+
+
+def test_hedged_call_falls_back_when_secondary_fails():
+    result = hedged_call(('a', _sleep(0.4, 'A')), ('b', _fail), delay=0.1, tracker=LatencyTracker())
+    assert result.name == 'a' and result.value == 'A'
+
+
+def test_hedged_call_starts_secondary_when_primary_fails_fast():
+    start = time.perf_counter()
+    result = hedged_call(('a', _fail), ('b', _sleep(0.1, 'B')), delay=1, tracker=LatencyTracker())
+    assert result.name == 'b' and result.value == 'B'
+    assert time.perf_counter() - start < 0.5
+
+    result = hedged_call(('a', _fail), ('b', _fail), delay=1, tracker=LatencyTracker())
+    assert isinstance(result.error, ValueError)
+
+
+def test_imap_unordered_bounds_concurrency_and_isolates_errors():
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work(i):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02 * (i % 3))
+        with lock:
+            running[0] -= 1
+        if i == 5:
+            raise ValueError(i)
+        return i * i
+
+    results = list(imap_unordered(work, (i for i in range(12)), workers=3))
+    assert sorted(r.name for r in results) == list(range(12)) and peak[0] <= 3
+    assert all(r.value == r.name ** 2 for r in results if r.name != 5)
+    assert isinstance(next(r for r in results if r.name == 5).error, ValueError)
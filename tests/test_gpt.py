@@ -0,0 +1,121 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openai
+
+from src.gpt import GPT, Example, ExampleSelector, ModelClient
+from src.utils.response_cache import ResponseCache
+
+
+def test_stream_top_reply_yields_partials_then_tokens(monkeypatch):
+    chunks = [{'choices': [{'delta': {'role': 'assistant'}}]}] + [
+        {'choices': [{'delta': {'content': piece}}]} for piece in ('文因', '互联', '。')]
+
+    class Chunk(dict):
+        __getattr__ = dict.get
+
+    def fake_create(stream=False, **kwargs):
+        assert stream and kwargs['engine'] == 'gpt-35-turbo'
+        return iter(Chunk(c) for c in chunks)
+
+    monkeypatch.setattr(openai.ChatCompletion, 'create', fake_create)
+    gpt = GPT(engine='gpt-35-turbo')
+    replies = list(gpt.stream_top_reply('文因互联是做什么的?', '问答', model_type='azure'))
+    assert [r for r, _ in replies] == ['文因', '文因互联', '文因互联。', '文因互联。']
+    assert all(t is None for _, t in replies[:-1]) and replies[-1][1] > 0
+
+
+def _embed(texts):
+    # 按关键词生成的二维向量：营收相关 -> x，人物相关 -> y
+    return np.array([[float('营收' in t), float('董事' in t)] for t in texts], dtype='float32')
+
+
+def test_prime_text_uses_relevant_examples_within_budget():
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return _embed(texts)
+
+    gpt = GPT(engine='gpt-35-turbo')
+    gpt.selector = ExampleSelector(gpt.format_example, k=2, token_budget=1000, model='gpt-35-turbo', embed=embed)
+    revenue = [gpt.add_example(Example(f'2022年营收{i}', f'{i}亿')) for i in range(3)]
+    director = gpt.add_example(Example('董事长是谁', '张三'))
+
+    prime = gpt.get_prime_text('董事长的简历')
+    assert director.get_input() in prime and prime.count('营收') == 1
+    assert gpt.get_prime_text('董事长的简历') is prime  # 同一示例集合复用缓存的文本
+    assert len(calls[0]) == 4 and all(len(c) == 1 for c in calls[1:])  # 示例只计算一次 embedding
+    assert gpt.get_prime_text() == ''.join(gpt.format_example(ex) for ex in revenue + [director])
+
+    gpt.delete_example(director.get_id())
+    assert '董事' not in gpt.get_prime_text('董事长的简历')
+
+    gpt.selector.token_budget = 1
+    assert gpt.get_prime_text('营收') == ''
+
+
+def test_clients_are_passed_per_request(monkeypatch):
+    seen = []
+
+    class Response(dict):
+        __getattr__ = dict.get
+
+    def fake_create(**kwargs):
+        seen.append(kwargs)
+        return Response(choices=[{'message': {'content': kwargs['api_type']}}], usage={'total_tokens': 1})
+
+    monkeypatch.setattr(openai.ChatCompletion, 'create', fake_create)
+    monkeypatch.setattr(openai, 'api_key', None)
+    azure = GPT(engine='gpt-35-turbo', temperature=0, cache=ResponseCache(),
+                client=ModelClient('azure-key', 'azure', 'https://example.openai.azure.com', '2023-03-15-preview'))
+    office = GPT(engine='gpt-3.5-turbo', temperature=0, cache=ResponseCache(), client=ModelClient('office-key'))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        replies = list(pool.map(lambda g: g.get_top_reply('你好', '问答')[0], [azure, office] * 8))
+    assert replies == ['azure', 'open_ai'] * 8
+    for kwargs in seen:
+        assert (kwargs['api_key'], kwargs['engine'], kwargs['model']) in [
+            ('azure-key', 'gpt-35-turbo', None), ('office-key', None, 'gpt-3.5-turbo')]
+    assert openai.api_key is None
+
+
+def test_prime_text_is_safe_while_examples_change():
+    def slow_embed(texts):
+        time.sleep(0.001)  # 放大计算 embedding 期间示例被增删的窗口
+        return _embed(texts)
+
+    gpt = GPT(engine='gpt-35-turbo')
+    gpt.selector = ExampleSelector(gpt.format_example, k=2, token_budget=1000, model='gpt-35-turbo',
+                                   embed=slow_embed)
+
+    def edit(i):
+        ex = gpt.add_example(Example(f'{i}年营收', f'{i}亿'))
+        time.sleep(0.001)
+        gpt.delete_example(ex.get_id())
+
+    def select(i):
+        return gpt.get_prime_text('营收')
+
+    for i in range(3):
+        gpt.add_example(Example(f'董事{i}', f'张{i}'))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(edit if i % 2 else select, i) for i in range(600)]
+        primes = [f.result() for f in futures[::2]]
+        [f.result() for f in futures[1::2]]
+    assert all(p.count(gpt.input_prefix) <= 2 for p in primes)
+    assert len(gpt.examples) == 3
+
+
+def test_prime_text_falls_back_to_latest_examples_when_embedding_fails():
+    def embed(texts):
+        raise openai.error.APIConnectionError('embedding service down')
+
+    gpt = GPT(engine='gpt-35-turbo')
+    gpt.selector = ExampleSelector(gpt.format_example, k=2, token_budget=1000, model='gpt-35-turbo', embed=embed)
+    for i in range(4):
+        gpt.add_example(Example(f'问题{i}', f'回答{i}'))
+    prime = gpt.get_prime_text('问题0')
+    assert '问题2' in prime and '问题3' in prime and '问题0' not in prime
+    assert prime.index('问题2') < prime.index('问题3')
+    assert gpt.craft_query('问题0').endswith('问题0\n')
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from src.utils.http_client import AsyncHttpClient, HttpClient
+
+
+@pytest.fixture()
+def flaky_server():
+    """前两次请求返回 503，之后返回 JSON"""
+    state = {'count': 0, 'ports': set()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            state['count'] += 1
+            state['ports'].add(self.client_address[1])
+            status, body = (503, b'{}') if state['count'] % 3 else (200, json.dumps({'response': 'ok'}).encode())
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/chat', state
+    server.shutdown()
+
+
+def test_retries_and_reuses_connection(flaky_server):
+    url, state = flaky_server
+    client = HttpClient(max_retries=3, backoff=0.01)
+    response = client.post(url, json={'prompt': 'hi'})
+    assert response.status_code == 200 and response.json() == {'response': 'ok'}
+    assert state['count'] == 3 and len(state['ports']) == 1  # keep-alive 复用同一连接
+
+    response = HttpClient(max_retries=0).post(url, json={})
+    assert response.status_code == 503
+
+
+def test_async_client_retries(flaky_server):
+    url, state = flaky_server
+    client = AsyncHttpClient(max_retries=3, backoff=0.01)
+
+    async def run():
+        try:
+            return await client.post_json(url, json={'prompt': 'hi'})
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == {'response': 'ok'}
+    assert state['count'] == 3
+
+
+@pytest.fixture()
+def slow_server():
+    """每次请求都超过客户端的读取超时，500 路径直接返回 500"""
+    state = {'count': 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            state['count'] += 1
+            if self.path == '/error':
+                self.send_response(500)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            time.sleep(0.3)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}', state
+    server.shutdown()
+
+
+def test_post_is_not_retried_once_the_server_may_be_processing(slow_server):
+    url, state = slow_server
+    client = HttpClient(read_timeout=0.1, max_retries=2, backoff=0.01)
+    with pytest.raises(requests.Timeout):
+        client.post(url + '/generate', json={})
+    assert state['count'] == 1
+    assert client.post(url + '/error', json={}).status_code == 500 and state['count'] == 2
+
+    with pytest.raises(requests.Timeout):
+        client.post(url + '/generate', json={}, idempotent=True)
+    assert state['count'] == 5
+
+
+def test_post_is_retried_when_connection_fails():
+    with socket.socket() as sock:  # 取一个未监听的端口
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    client = HttpClient(max_retries=2, backoff=0.01)
+    attempts = []
+    original = client.session(f'http://127.0.0.1:{port}').request
+
+    def counting(*args, **kwargs):
+        attempts.append(1)
+        return original(*args, **kwargs)
+
+    client.session(f'http://127.0.0.1:{port}').request = counting
+    with pytest.raises(requests.ConnectionError):
+        client.post(f'http://127.0.0.1:{port}/generate', json={})
+    assert len(attempts) == 3
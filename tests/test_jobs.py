@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+from langchain.schema import Document
+
+from src.utils.jobs import DONE, FAILED, QUEUED, RUNNING, JobStore, extract_chunks, job_view, make_payload, save_upload
+
+
+def test_claim_runs_each_job_once_in_submission_order(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'))
+    other = JobStore(str(tmp_path / 'jobs.db'))  # 另一个 worker 进程
+    first = store.submit(make_payload('person_schema', {'person_schema'}, text='张三'))
+    second = store.submit(make_payload('person_schema', {'person_schema'}, text='李四'))
+
+    assert store.claim('w1')['id'] == first
+    job = other.claim('w2')
+    assert job['id'] == second and job['status'] == RUNNING and job['attempts'] == 1
+    assert store.claim('w1') is None
+
+    assert not store.complete(second, 'w1', {})  # 不是自己持有的任务
+    assert other.complete(second, 'w2', {'person': []})
+    view = job_view(store.get(second))
+    assert view['status'] == DONE and view['result'] == {'person': []} and view['model_name'] == 'person_schema'
+    assert store.counts() == {RUNNING: 1, DONE: 1}
+
+
+def test_expired_lease_resumes_from_saved_chunks(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'), lease=0.05, max_attempts=2)
+    job_id = store.submit({'model_name': 'person_schema', 'llm_type': 'azure', 'text': '...'})
+    docs = [Document(page_content=f'chunk {i}', metadata={'chunk_id': i}) for i in range(4)]
+    calls = []
+
+    async def flaky(text):
+        calls.append(text)
+        if text == 'chunk 2':
+            raise RuntimeError('boom')
+        return text.upper()
+
+    store.claim('w1')
+    with pytest.raises(RuntimeError):
+        asyncio.run(extract_chunks(store, job_id, docs, flaky))
+    assert store.get(job_id)['done_chunks'] == 3
+
+    # w1 崩溃未续约，租约过期后由 w2 接管，只重新抽取失败的窗口
+    time.sleep(0.1)
+    assert store.claim('w2')['attempts'] == 2
+    assert not store.renew(job_id, 'w1')
+
+    async def ok(text):
+        calls.append(text)
+        return text.upper()
+
+    results = asyncio.run(extract_chunks(store, job_id, docs, ok))
+    assert results == {i: f'CHUNK {i}' for i in range(4)}
+    assert calls.count('chunk 0') == 1 and calls.count('chunk 2') == 2
+
+    # 执行次数达到上限后失败不再重新排队
+    assert store.fail(job_id, 'w2', 'boom') == FAILED
+    assert store.get(job_id)['error'] == 'boom'
+
+
+def test_failed_job_is_requeued_until_max_attempts(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.db'), max_attempts=2)
+    job_id = store.submit({'model_name': 'person_schema', 'llm_type': 'azure', 'text': '...'})
+    store.claim('w1')
+    assert store.fail(job_id, 'w1', 'timeout') == QUEUED
+    store.claim('w1')
+    assert store.fail(job_id, 'w1', 'timeout') == FAILED
+    assert store.claim('w1') is None
+
+
+def test_make_payload_validates_input_and_save_upload_dedupes(tmp_path):
+    names = {'person_schema'}
+    with pytest.raises(ValueError):
+        make_payload('person_schema', names)
+    with pytest.raises(ValueError):
+        make_payload('unknown_schema', names, text='张三')
+    with pytest.raises(ValueError):
+        make_payload('person_schema', names, llm_type='gpt4', text='张三')
+    path = save_upload('报告.PDF', b'%PDF-1.4', str(tmp_path))
+    assert path.endswith('.pdf') and save_upload('other.pdf', b'%PDF-1.4', str(tmp_path)) == path
+    assert make_payload('person_schema', names, 'memect', file=path) == {
+        'model_name': 'person_schema', 'llm_type': 'memect', 'file': path}
@@ -0,0 +1,68 @@
+import io
+import zipfile
+
+import openai
+import pytest
+import requests
+
+from loadtest.driver import Sample, parse_mix, run, summarize, synthetic_requests
+from loadtest.stubs import LatencyProfile, OpenAIStub, ParserStub
+
+
+@pytest.fixture()
+def openai_stub():
+    server = OpenAIStub(profile=LatencyProfile(0.01, 0.05)).start()
+    yield server
+    server.stop()
+
+
+def test_openai_stub_serves_azure_chat_stream_and_embeddings(openai_stub):
+    azure = dict(api_key='stub', api_base=openai_stub.url, api_type='azure', api_version='2023-03-15-preview')
+    response = openai.ChatCompletion.create(engine='gpt-35-turbo', messages=[{'role': 'user', 'content': '你好'}],
+                                            **azure)
+    assert response.choices[0]['message']['content'].startswith('模拟回答') and response['usage']['total_tokens']
+    chunks = list(openai.ChatCompletion.create(engine='gpt-35-turbo', stream=True,
+                                               messages=[{'role': 'user', 'content': '你好'}], **azure))
+    assert ''.join(c.choices[0]['delta'].get('content', '') for c in chunks) == response.choices[0]['message']['content']
+    embedding = openai.Embedding.create(input=['a', 'b'], engine='text-embedding-ada-002', **azure)
+    assert len(embedding['data']) == 2 and len(embedding['data'][0]['embedding']) == 1536
+    stats = requests.get(f'{openai_stub.url}/stats').json()
+    assert stats['chat']['count'] == 2 and stats['embeddings']['count'] == 1
+
+
+def test_stub_error_rate_and_parser_zip():
+    failing = OpenAIStub(profile=LatencyProfile(error_rate=1.0)).start()
+    response = requests.post(f'{failing.url}/v1/chat/completions', json={'messages': []})
+    assert response.status_code == 429 and response.headers['Retry-After']
+    failing.stop()
+
+    parser = ParserStub(paragraphs=3).start()
+    response = requests.post(f'{parser.url}/pdf2doc', data=b'%PDF')
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        assert len(zf.read('table.txt').decode().splitlines()) == 3
+    parser.stop()
+
+
+def test_latency_profile_percentiles():
+    profile = LatencyProfile(0.5, 2.0)
+    samples = sorted(profile.sample() for _ in range(4000))
+    assert samples[2000] == pytest.approx(0.5, rel=0.1) and samples[3800] == pytest.approx(2.0, rel=0.2)
+    assert LatencyProfile.parse('0.2').sample() == 0.2
+
+
+def test_run_and_summarize_per_stage():
+    def ok(target, delay=0):
+        return 0.001
+
+    def broken(target):
+        raise RuntimeError('boom')
+
+    items = synthetic_requests(parse_mix('chat=3,extraction=1'), 40)
+    assert {item['kind'] for item in items} == {'chat', 'extraction'}
+    samples, elapsed = run(None, items, concurrency=4, scenarios={'chat': ok, 'extraction': broken})
+    report = summarize(samples, elapsed)
+    assert report['chat']['errors'] == 0 and report['chat']['ttft_p50'] == 0.001
+    assert report['extraction']['errors'] == report['extraction']['count'] and report['extraction']['p50'] is None
+
+    report = summarize([Sample('chat', latency, None, True, None) for latency in range(1, 101)], 10)
+    assert report['chat']['throughput'] == 10 and report['chat']['p95'] == pytest.approx(95.05)
@@ -0,0 +1,76 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from loadtest.stubs import LatencyProfile, MemectStub
+from src.memect_llm import MemectLLM, batch_memect, get_memect_batcher
+from src.utils.micro_batch import MicroBatcher
+
+
+@pytest.fixture()
+def stub():
+    server = MemectStub(profile=LatencyProfile(0.05)).start()
+    yield server
+    server.stop()
+
+
+def test_batches_concurrent_items_and_routes_results():
+    sizes = []
+
+    def send(items):
+        sizes.append(len(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(send, max_batch_size=4, max_wait_ms=50)
+    futures = [batcher.submit(i) for i in range(10)]
+    assert [f.result(timeout=5) for f in futures] == [i * 2 for i in range(10)]
+    assert max(sizes) == 4 and sum(sizes) == 10
+    batcher.close()
+
+
+def test_batches_are_sent_concurrently():
+    def send(items):
+        time.sleep(0.2)
+        return items
+
+    batcher = MicroBatcher(send, max_batch_size=4, max_wait_ms=5, max_in_flight=8)
+    start = time.perf_counter()
+    futures = [batcher.submit(i) for i in range(32)]
+    assert [f.result(timeout=5) for f in futures] == list(range(32))
+    assert time.perf_counter() - start < 0.6  # 8 批依次发送需要 1.6 秒
+    assert batcher.stats()['batches'] == 8
+    batcher.close()
+
+
+def test_errors_propagate_to_every_caller():
+    batcher = MicroBatcher(lambda items: [], max_wait_ms=50)
+    futures = [batcher.submit(i) for i in range(2)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+    batcher.close()
+
+
+def test_window_shrinks_when_idle():
+    batcher = MicroBatcher(lambda items: items, max_wait_ms=20, min_wait_ms=1)
+    for i in range(6):
+        batcher.submit(i).result(timeout=5)
+    assert batcher.stats()['wait_ms'] < 2
+    start = time.perf_counter()
+    batcher.submit(0).result(timeout=5)
+    assert time.perf_counter() - start < 0.02
+    batcher.close()
+
+
+def test_batched_memect_calls_against_stub(stub, monkeypatch):
+    assert batch_memect(stub.url, ['a', 'b']) == ['模拟回答：a', '模拟回答：b']
+
+    monkeypatch.setattr('src.memect_llm.memect_batch', True)
+    monkeypatch.setattr('src.memect_llm._batchers', {})
+    llm = MemectLLM(endpoint_url=stub.url)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        replies = list(pool.map(llm._call, [f'q{i}' for i in range(16)]))
+    assert replies == [f'模拟回答：q{i}' for i in range(16)]
+    assert len(stub.batch_sizes) < 17 and max(stub.batch_sizes) > 1
+    get_memect_batcher(stub.url).close()
@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+
+import openai
+import pytest
+
+from src.utils.rate_limit import BATCH, INTERACTIVE, RateLimiter, TokenBucket
+
+
+class RateLimitError(Exception):
+    http_status = 429
+
+    def __init__(self, retry_after):
+        super().__init__('rate limited')
+        self.headers = {'Retry-After': str(retry_after)}
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(600)  # 每秒补充 10 个
+    now = time.monotonic()
+    assert bucket.wait_time(600, now) == 0
+    bucket.take(600)
+    assert bucket.wait_time(5, now) == pytest.approx(0.5, abs=0.01)
+    assert TokenBucket(0).wait_time(10 ** 6, now) == 0
+
+
+def test_interactive_calls_jump_ahead_of_batch():
+    limiter = RateLimiter(tpm=600)
+    limiter.acquire(600)
+    order = []
+
+    def run(priority, name):
+        limiter.acquire(2, priority)
+        order.append(name)
+
+    batch = threading.Thread(target=run, args=(BATCH, 'batch'))
+    batch.start()
+    time.sleep(0.05)
+    assert limiter.metrics()['queue_depth'][BATCH] == 1
+    interactive = threading.Thread(target=run, args=(INTERACTIVE, 'interactive'))
+    interactive.start()
+    batch.join(2)
+    interactive.join(2)
+    assert order == ['interactive', 'batch']
+    metrics = limiter.metrics()
+    assert metrics['queue_depth'] == {INTERACTIVE: 0, BATCH: 0}
+    assert metrics['wait'][BATCH]['max'] > metrics['wait'][INTERACTIVE]['max'] > 0.1
+
+
+def test_retries_after_429_honouring_retry_after():
+    limiter = RateLimiter(max_retries=2)
+    attempts = []
+
+    def call():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimitError(0.2)
+        return 'ok'
+
+    assert limiter.call(call, tokens=10) == 'ok'
+    assert attempts[1] - attempts[0] >= 0.2 and limiter.metrics()['throttled'] == 1
+
+    with pytest.raises(ValueError):
+        limiter.call(lambda: (_ for _ in ()).throw(ValueError('bad request')))
+    with pytest.raises(RateLimitError):
+        limiter.call(lambda: (_ for _ in ()).throw(RateLimitError(0)))
+
+
+def test_async_waiters_use_no_threads_and_leave_the_queue_when_cancelled():
+    limiter = RateLimiter(tpm=6000)  # 每秒补充 100 个
+    limiter.acquire(6000)
+    order = []
+
+    def run_batch():
+        limiter.acquire(10, BATCH)
+        order.append('batch')
+
+    async def main():
+        threads = threading.active_count()
+        waiters = [asyncio.create_task(limiter.aacquire(6000)) for _ in range(50)]
+        await asyncio.sleep(0.05)
+        assert threading.active_count() == threads
+        assert limiter.metrics()['queue_depth'][INTERACTIVE] == 50
+
+        batch = threading.Thread(target=run_batch)
+        batch.start()
+        await asyncio.sleep(0.05)
+        assert order == []  # 排在交互式请求之后
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.get_running_loop().run_in_executor(None, batch.join, 2)
+
+    asyncio.run(main())
+    assert order == ['batch']
+    assert limiter.metrics()['queue_depth'] == {INTERACTIVE: 0, BATCH: 0}
+
+
+def test_acall_waits_for_quota_and_retries_after_429():
+    limiter = RateLimiter(tpm=600, max_retries=2)
+    limiter.acquire(600)
+    attempts = []
+
+    async def call():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RateLimitError(0.1)
+        return 'ok'
+
+    start = time.monotonic()
+    assert asyncio.run(limiter.acall(call, tokens=2)) == 'ok'
+    assert attempts[0] - start >= 0.15 and attempts[1] - attempts[0] >= 0.1
+    assert limiter.metrics()['wait'][INTERACTIVE]['max'] >= 0.15
+
+
+def test_retries_transient_errors_with_backoff_but_not_bad_requests():
+    limiter = RateLimiter(max_retries=2)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise openai.error.Timeout('read timeout')
+        if len(attempts) == 2:
+            raise openai.error.ServiceUnavailableError('overloaded')
+        return 'ok'
+
+    assert limiter.call(flaky) == 'ok' and len(attempts) == 3
+    assert limiter.metrics()['throttled'] == 0  # 临时错误不暂停整个部署
+
+    attempts.clear()
+
+    async def down():
+        attempts.append(1)
+        raise openai.error.APIConnectionError('connection reset')
+
+    with pytest.raises(openai.error.APIConnectionError):
+        asyncio.run(limiter.acall(down))
+    assert len(attempts) == 3
+
+    attempts.clear()
+    with pytest.raises(openai.error.InvalidRequestError):
+        limiter.call(lambda: attempts.append(1) or (_ for _ in ()).throw(openai.error.InvalidRequestError('bad', None)))
+    assert len(attempts) == 1
+
+
+def test_processes_share_quota_pause_and_priority(tmp_path):
+    path = str(tmp_path / 'rate_limit.db')
+    chat = RateLimiter(tpm=6000, path=path)  # 如 Gradio 进程
+    worker = RateLimiter(tpm=6000, path=path)  # 如抽取 worker 进程，每秒补充 100 个
+    chat.acquire(6000)
+    assert worker.acquire(20, BATCH) >= 0.15  # 配额已被另一进程用完
+
+    chat._retry_delay(RateLimitError(0.3), 0)
+    assert worker.acquire(0, BATCH) >= 0.25  # 另一进程遇到 429 后整个部署暂停
+
+    chat.acquire(60)
+    order = []
+
+    def run(limiter, priority, name):
+        limiter.acquire(50, priority)
+        order.append(name)
+
+    batch = threading.Thread(target=run, args=(worker, BATCH, 'batch'))
+    batch.start()
+    time.sleep(0.1)
+    interactive = threading.Thread(target=run, args=(chat, INTERACTIVE, 'interactive'))
+    interactive.start()
+    batch.join(5)
+    interactive.join(5)
+    assert order == ['interactive', 'batch']
+
+    # 已退出未清理的进程的排队记录过期后不再阻塞其他进程
+    ghost = RateLimiter(path=path)
+    ghost.quota.publish({INTERACTIVE: 1, BATCH: 0})
+    worker.quota.stale = 0.2
+    assert worker.acquire(0, BATCH) >= 0.15
+    for limiter in (chat, worker):
+        limiter.close()
@@ -0,0 +1,65 @@
+import time
+
+import openai
+
+from src.gpt import GPT
+from src.utils.response_cache import ResponseCache
+
+
+def test_key_is_canonical():
+    a = ResponseCache.make_key('azure', 'gpt-35-turbo', [{"role": "user", "content": "你好"}], 0, 100)
+    b = ResponseCache.make_key('azure', 'gpt-35-turbo', [{"content": "你好", "role": "user"}], 0.0, 100)
+    c = ResponseCache.make_key('azure', 'gpt-35-turbo', [{"role": "user", "content": "你好"}], 0, 200)
+    assert a == b and a != c
+
+
+def test_lru_ttl_and_stats():
+    cache = ResponseCache(max_items=2, ttl=0)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    assert cache.get('a') == '1'
+    cache.set('c', '3')  # 淘汰最久未使用的 b
+    assert cache.get('b') is None and cache.get('c') == '3'
+    cache.set('d', '4', ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('d') is None
+    stats = cache.stats()
+    assert stats['memory_hits'] == 2 and stats['misses'] == 2 and stats['hit_rate'] == 0.5
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / 'response.db')
+    ResponseCache(disk_path=path).set('k', {'reply': '文因'})
+    cache = ResponseCache(disk_path=path)
+    assert cache.get('k') == {'reply': '文因'}
+    assert cache.get('k') == {'reply': '文因'}
+    assert cache.stats()['disk_hits'] == 1 and cache.stats()['memory_hits'] == 1
+
+
+def test_sampling_requests_bypass_unless_allowed():
+    assert not ResponseCache().cacheable(0.6)
+    assert ResponseCache().cacheable(0)
+    assert ResponseCache(allow_sampling=True).cacheable(0.6)
+
+
+def test_gpt_reply_is_served_from_cache(monkeypatch):
+    calls = []
+
+    class Response(dict):
+        __getattr__ = dict.get
+
+    def fake_create(**kwargs):
+        calls.append(kwargs)
+        return Response(choices=[{'message': {'content': '文因互联。'}}], usage={'total_tokens': 42})
+
+    monkeypatch.setattr(openai.ChatCompletion, 'create', fake_create)
+    gpt = GPT(engine='gpt-35-turbo', temperature=0, cache=ResponseCache())
+    assert gpt.get_top_reply('文因互联是做什么的?', '问答', model_type='azure') == ('文因互联。', 42)
+    assert gpt.get_top_reply('文因互联是做什么的?', '问答', model_type='azure') == ('文因互联。', 0)
+    assert list(gpt.stream_top_reply('文因互联是做什么的?', '问答', model_type='azure')) == [('文因互联。', 0)]
+    assert len(calls) == 1
+
+    sampling = GPT(engine='gpt-35-turbo', temperature=0.6, cache=ResponseCache())
+    sampling.get_top_reply('文因互联是做什么的?', '问答', model_type='azure')
+    sampling.get_top_reply('文因互联是做什么的?', '问答', model_type='azure')
+    assert len(calls) == 3 and sampling.cache.stats()['bypass'] == 2
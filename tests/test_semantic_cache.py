@@ -0,0 +1,45 @@
+import numpy as np
+
+from src.utils.semantic_cache import SemanticCache
+
+
+def _vec(*values):
+    return np.array(values, dtype='float32')
+
+
+def test_lookup_hits_within_threshold_and_is_scoped():
+    cache = SemanticCache(threshold=0.9, audit_rate=0)
+    cache.add('doc1', _vec(1, 0, 0), '公司营收多少?', '10亿', scope='azure:问答')
+    entry_id, answer, score = cache.lookup('doc1', _vec(0.95, 0.1, 0), scope='azure:问答')
+    assert answer == '10亿' and score > 0.9
+    assert cache.lookup('doc1', _vec(0, 1, 0), scope='azure:问答') is None
+    assert cache.lookup('doc2', _vec(1, 0, 0), scope='azure:问答') is None
+    assert cache.lookup('doc1', _vec(1, 0, 0), scope='memect:问答') is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+
+def test_eviction_and_invalidation():
+    cache = SemanticCache(threshold=0.99, max_items=2, max_docs=2)
+    cache.add('doc1', _vec(1, 0, 0), 'a', 'A')
+    cache.add('doc1', _vec(0, 1, 0), 'b', 'B')
+    cache.lookup('doc1', _vec(1, 0, 0))  # a 最近使用
+    cache.add('doc1', _vec(0, 0, 1), 'c', 'C')
+    assert cache.lookup('doc1', _vec(0, 1, 0)) is None
+    assert cache.lookup('doc1', _vec(1, 0, 0))[1] == 'A'
+
+    cache.add('doc2', _vec(1, 0, 0), 'a', 'A2')
+    cache.add('doc3', _vec(1, 0, 0), 'a', 'A3')  # 淘汰最久未使用的 doc1
+    assert cache.lookup('doc1', _vec(1, 0, 0)) is None
+    cache.invalidate('doc2')
+    assert cache.lookup('doc2', _vec(1, 0, 0)) is None
+    assert cache.lookup('doc3', _vec(1, 0, 0))[1] == 'A3'
+
+
+def test_audit_counts_false_hits_and_replaces_answer():
+    cache = SemanticCache(threshold=0.9, audit_rate=1.0)
+    entry_id = cache.add('doc1', _vec(1, 0), '营收多少?', '公司营收为10亿元')
+    assert cache.should_audit()
+    assert not cache.audit('doc1', entry_id, '公司营收为10亿元。')
+    assert cache.audit('doc1', entry_id, '净利润下降')
+    assert cache.lookup('doc1', _vec(1, 0))[1] == '净利润下降'
+    assert cache.stats()['audits'] == 2 and cache.stats()['false_hit_rate'] == 0.5
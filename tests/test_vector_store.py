@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+
+from src.utils.vector_store import FaissVectorStore, QdrantVectorStore
+
+
+def _doc(n=30, d=8, seed=0):
+    vectors = np.random.RandomState(seed).rand(n, d).astype('float32')
+    return [f'chunk-{i}' for i in range(n)], vectors
+
+
+@pytest.fixture(params=['faiss', 'qdrant'])
+def store(request, tmp_path):
+    if request.param == 'faiss':
+        return FaissVectorStore(str(tmp_path))
+    return QdrantVectorStore(QdrantClient(location=':memory:'), 'test_doc_embedding', batch_size=7, parallel=1)
+
+
+def test_add_search_and_window(store):
+    texts, vectors = _doc()
+    assert not store.exists('doc_a')
+    store.add('doc_a', texts, vectors, payloads=[{"page_number": i // 10} for i in range(len(texts))])
+    store.add('doc_b', *_doc(seed=1))
+    assert store.exists('doc_a')
+
+    hits = store.search('doc_a', vectors[12], k=4)
+    assert len(hits) == 4 and (hits[0].doc_hash, hits[0].chunk_id, hits[0].text) == ('doc_a', 12, 'chunk-12')
+    assert store.window('doc_a', 28, 6) == ['chunk-28', 'chunk-29']
+    assert {h.doc_hash for h in store.search(None, vectors[12], k=10)} <= {'doc_a', 'doc_b'}
+
+    store.delete('doc_a')
+    assert not store.exists('doc_a') and store.exists('doc_b')
+
+
+def test_qdrant_payload_filter():
+    store = QdrantVectorStore(QdrantClient(location=':memory:'), 'test_doc_embedding')
+    texts, vectors = _doc()
+    store.add('doc_a', texts, vectors, payloads=[{"page_number": i // 10} for i in range(len(texts))])
+    hits = store.search('doc_a', vectors[12], k=5, filters={"page_number": 2})
+    assert hits and all(20 <= h.chunk_id < 30 for h in hits)
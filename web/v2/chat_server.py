@@ -5,55 +5,57 @@ https://github.com/gradio-app/gradio/issues/3729
 import logging
 import os
 import pathlib
-import pickle
 import shutil
 import sys
+from concurrent.futures import TimeoutError
 
 import gradio as gr
-import openai
 
 curPath = os.path.abspath(os.path.dirname(__file__))
 rootPath = os.path.split(curPath)[0]
 sys.path.insert(0, os.path.split(rootPath)[0])
 
-from src.utils.embedding import get_embedding
+from src.utils.embedding import get_embedding, warm_up_embedding
 from web import host, port, office_model_name, office_openai_key, api_version, api_base, api_type, azure_model_name, \
     azure_openai_key
 from data import example, prompt_text
-from src.gpt import set_openai_key, GPT, Example
-from src.utils.data_store import doc2embedding, save_embedding
+from src.gpt import GPT, Example, ModelClient
+from src.utils.data_store import doc2vectors
+from src.utils.vector_store import get_vector_store
+from src.utils.context import build_context
+from src.utils.semantic_cache import semantic_cache
+from src.utils.response_cache import response_cache
+from src.utils.fanout import fan_out, hedged_call
 from src.utils.doc import parser_doc, hashcode_with_file, get_file_ext_size
-from src.extract import parser_pdf, extract_doc, chat_mem_fin_llm
+from src.extract import parser_pdf, extract_doc, chat_mem_fin_llm, stream_mem_fin_llm
 
 model_type = 'openai'
 
 data_store_base_path = 'data/store'  # 生成文件父级目录
-store_origin_file_dir = None
-gpt: GPT = None
+vector_store = get_vector_store(data_store_base_path)
 mem_api_base = os.getenv('MEM_FIN_OPENAI_API')
+# 多模型并发调用时各后端的截止时间(秒)
+backend_deadlines = {'MemectFinLLM': float(os.getenv('MEMECT_DEADLINE', 60)),
+                     'gpt': float(os.getenv('GPT_DEADLINE', 60))}
+
+
+# 每个模型实例携带各自的接口凭据，请求之间不共享 openai 全局配置，可并发处理
+models = {
+    'azure': GPT(engine=azure_model_name, temperature=0.6, max_tokens=1024,
+                 client=ModelClient(azure_openai_key, api_type, api_base, api_version)),
+    'open_ai': GPT(engine=office_model_name, temperature=0.6, max_tokens=1024,
+                   client=ModelClient(office_openai_key)),
+}
 
 
 def load_model(model_type):
     """
-    根据模型类型加载不同参数
+    根据模型类型获取模型实例
     """
-    global gpt
-
-    # 使用同一实例，可以考虑单例模式进行优化
-    if gpt is not None and openai.api_type == model_type:
-        logging.info(f'reload {openai.api_type}')
-        return gpt
-    elif model_type == 'azure':
-        set_openai_key(azure_openai_key, api_version, api_base, api_type)
-        gpt = GPT(engine=azure_model_name, temperature=0.6, max_tokens=1024)
-        return gpt
-
-    elif model_type == 'open_ai':
-        set_openai_key(office_openai_key)
-        gpt = GPT(engine=office_model_name, temperature=0.6, max_tokens=1024)
-        return gpt
-    else:
+    gpt = models.get(model_type)
+    if gpt is None:
         logging.info(model_type)
+    return gpt
 
 
 def init_store_dir(store_dir):
@@ -75,10 +77,9 @@ def process_upload_file(file_tmp_path: list):
     Args:
         file_tmp_path:
 
-    Returns:str  file_name
+    Returns:(str, str)  处理结果提示, 文档 hash(保存在会话状态中，各用户互不影响)
 
     """
-    global store_origin_file_dir
     file_name_path = file_tmp_path.name
     doc_name_with_ext = file_name_path.split('/')[-1]  # 上传文件的名称
     ext, file_size = get_file_ext_size(file_name_path)
@@ -90,76 +91,102 @@ def process_upload_file(file_tmp_path: list):
     store_origin_file_dir = f'{data_store_base_path}/{file_hashcode}'
     logging.info(store_origin_file_dir)
 
-    if pathlib.Path(store_origin_file_dir).exists():  # 存在表示文件已经已经上传过，不在继续后续逻辑
+    # 存在表示文件已经已经上传过，不在继续后续逻辑
+    if pathlib.Path(store_origin_file_dir).exists() and vector_store.exists(file_hashcode):
         logging.info("upload file exists.")
     else:
         pathlib.Path(store_origin_file_dir).mkdir(parents=True, exist_ok=True)
         copy_upload_file = f'{store_origin_file_dir}/{doc_name_with_ext}'
         shutil.copyfile(file_name_path, copy_upload_file)
         output_text_file = parser_doc(copy_upload_file, store_origin_file_dir)  # 统一解析输出为.txt
-        embedding_with_index: dict = doc2embedding(output_text_file)  # 根据openai或其他embedding服务将句子转化为词向量
-        save_embedding(embedding_with_index, f'{store_origin_file_dir}/embedding.pickle')  # 存储至本地
+        texts, vectors, payloads = doc2vectors(output_text_file)  # 根据openai或其他embedding服务将文本块转化为词向量
+        vector_store.add(file_hashcode, texts, vectors, payloads)  # 写入向量存储
+        semantic_cache.invalidate(file_hashcode)  # 文档内容重新入库，历史回答失效
 
-    return f'{doc_name_with_ext}预处理完成。'
+    return f'{doc_name_with_ext}预处理完成。', file_hashcode
 
 
-def chat_doc(query, model_type, task_type='问答'):
-    import numpy as np
+def chat_doc(query, model_type, doc_hash, task_type='问答', gpt=None):
+    """
+    文档问答，流式返回累计生成的回答
+    doc_hash 为当前会话上传文档的 hash，gpt 为空时按 model_type 使用对应的模型实例
+    """
     # Load knowledge from store
     try:
-        if not store_origin_file_dir:
+        if not doc_hash:
             logging.warning("Not found doc vector file.")
-            return "无doc信息，考虑上传一份文档后再提问。"
-        file = open(f'{store_origin_file_dir}/embedding.pickle', 'rb')
-        emb_data = pickle.load(file)
-        index, data = emb_data['index'], emb_data['embedding']
-        logging.info("Success load doc vector file. Start query embedding……")
+            yield "无doc信息，考虑上传一份文档后再提问。"
+            return
+        logging.info("Start query embedding……")
 
         emb, query_token_num = get_embedding(query)  # compute query embedding
         logging.info(f"query token num:{query_token_num}")
-        _, text_index = index.search(np.array([emb[0][1]]), k=15)  # 根据索引从上传文档中搜索相近的内容
-        context = []
-        for i in list(text_index[0]):
-            context.extend(data[i:i + 6])
-        lens = [len(text) for text in context]
-        logging.debug(f"匹配到的文本长度大小：{lens}")
-        maximum = 3000
-        for index, l in enumerate(lens):
-            maximum -= l
-            if maximum < 0:
-                context = context[:index + 1]
-                logging.warning("超过最大长度，截断到前", index + 1, "个片段")
-                break
-
-        text = "".join(text for _, text in enumerate(context))
+        # 同一文档下相似问题直接返回缓存的回答，抽样命中仍重新生成以审计误命中
+        cache_scope = f'{model_type}:{task_type}'
+        cached = semantic_cache.lookup(doc_hash, emb[0][1], cache_scope)
+        audit = cached is not None and semantic_cache.should_audit()
+        if cached is not None and not audit:
+            entry_id, answer, score = cached
+            logging.info(f"semantic cache hit, score:{score:.3f}, {semantic_cache.stats()}")
+            yield answer
+            return
+        hits = vector_store.search(doc_hash, emb[0][1], k=15)  # 根据索引从上传文档中搜索相近的内容
+        # 合并相邻窗口、去重后按目标模型的 token 预算组装上下文
+        model_name = {'azure': azure_model_name, 'open_ai': office_model_name}.get(model_type, 'gpt-3.5-turbo')
+        text, context_tokens = build_context(hits, vector_store.window, model=model_name)
+        logging.info(f"召回片段数：{len(hits)}，上下文tokens：{context_tokens}")
+
         logging.info(f'Load model {model_type}')
+        answer = ''
         if model_type in ['azure', 'open_ai']:
-            gpt = load_model(model_type)
-            ret, tokens_num = gpt.get_top_reply(query, task_type, text, model_type)  # 请求LLM
+            gpt = gpt or load_model(model_type)
+            ret = ''
+            for ret, tokens_num in gpt.stream_top_reply(query, task_type, text, model_type):  # 请求LLM
+                answer = f'{model_type}\n{ret}'
+                yield answer
             logging.info(f'Context:{text}\nOutput:{ret}')
             logging.info(f"本轮对话消耗tokens:{tokens_num}")
-            return f'{model_type}\n{ret}'
         else:
-            ret = chat_mem_fin_llm(mem_api_base, text, task_type)
+            ret = ''
+            for ret in stream_mem_fin_llm(mem_api_base, text, task_type):
+                answer = f'【{model_type}】\n{ret}'
+                yield answer
             logging.debug(f'Context:{text}\nOutput:{ret}')
-            return f'【{model_type}】\n{ret}'
+        response_cache.log_stats()
+        if audit:
+            semantic_cache.audit(doc_hash, cached[0], answer, cache_scope)
+        elif answer:
+            semantic_cache.add(doc_hash, emb[0][1], query, answer, cache_scope)
     except Exception as e:
         logging.error(e)
 
 
 def add_examples(issue, reply):
     """Generate QA example"""
-    return gpt.add_example(Example(issue, reply))
+    example = Example(issue, reply)
+    for gpt in models.values():
+        gpt.add_example(example)
+    return example
 
 
 def del_all_examples():
-    [gpt.delete_example(ex_id) for ex_id, _ in gpt.get_all_examples().items()]
-    return gpt.get_all_examples()
+    for gpt in models.values():
+        [gpt.delete_example(ex_id) for ex_id in list(gpt.get_all_examples())]
+    return models['azure'].get_all_examples()
+
+
+def format_result(result):
+    """多模型调用结果的展示文本"""
+    if result.error is None:
+        return result.value
+    if isinstance(result.error, TimeoutError):
+        return f'{result.elapsed:.0f}秒内未返回。'
+    return f'请求失败：{result.error}'
 
 
 def task_with_chat(input_txt, task, model_type):
     """
-    对话式任务
+    对话式任务，流式返回累计生成的回答
     Returns: response
 
     """
@@ -168,21 +195,29 @@ def task_with_chat(input_txt, task, model_type):
         logging.info(f'Query:{input_txt}')
         if model_type in ['open_ai', 'azure']:
             gpt = load_model(model_type)
-            response, token_num = gpt.get_top_reply(input_txt, task, context='', model_type=model_type)
+            response = ''
+            for response, token_num in gpt.stream_top_reply(input_txt, task, context='', model_type=model_type):
+                yield response
             logging.info(f"text len:{len(input_txt)}. Consumer token num:{token_num}. Response:{response}")
-            return response
-        elif model_type == 'all':
+        elif model_type in ['all', 'hedge']:
             gpt = load_model("azure")
-            mem_response = chat_mem_fin_llm(mem_api_base, input_txt, task)
-            gpt_response, token_num = gpt.get_top_reply(input_txt, task, context='', model_type='azure')
-            return f'【MemectFinLLM】\n{mem_response} \n\n【gpt】\n{gpt_response}'
+            backends = {'MemectFinLLM': lambda: chat_mem_fin_llm(mem_api_base, input_txt, task),
+                        'gpt': lambda: gpt.get_top_reply(input_txt, task, context='', model_type='azure')[0]}
+            if model_type == 'all':  # 同时请求所有模型，超过截止时间的模型不等待
+                results = fan_out(backends, backend_deadlines).values()
+            else:  # 先请求 MemectFinLLM，超过其 p95 延迟仍未返回或提前失败时再请求 gpt，取先返回的
+                results = [hedged_call(*backends.items(), timeout=max(backend_deadlines.values()))]
+            yield ' \n\n'.join(f'【{r.name}】\n{format_result(r)}' for r in results)
+            logging.info(', '.join(f'{r.name}:{r.elapsed:.2f}s' for r in results))
 
         else:
-            response = chat_mem_fin_llm(mem_api_base, input_txt, task)
+            response = ''
+            for response in stream_mem_fin_llm(mem_api_base, input_txt, task):
+                yield response
             logging.info(response)
-            return response
+        response_cache.log_stats()
     except Exception as e:
-        gr.Error(e)
+        raise gr.Error(str(e))
 
 
 def extract_chain(file_path, schema, model_type):
@@ -199,33 +234,36 @@ with gr.Blocks(css="footer {visibility: hidden}", title='ChatLLM is all you need
         with gr.Row():
             with gr.Column():
                 input_text = gr.Textbox(label="我要提问", placeholder="向大模型提问……")
-                model_type = gr.Dropdown(choices=["memect", "openai", "azure", "all"], value='memect',
+                model_type = gr.Dropdown(choices=["memect", "openai", "azure", "all", "hedge"], value='memect',
                                          label='选择模型类型')
                 task_type = gr.Radio(choices=list(prompt_text.keys()),
                                      label="场景类型", value='问答')
                 submit = gr.Button("问一下")
             with gr.Column():
                 output_ret = gr.Text(label='输出', lines=8)
-        submit.click(fn=task_with_chat, inputs=[input_text, task_type, model_type], outputs=output_ret)
+        submit.click(fn=task_with_chat, inputs=[input_text, task_type, model_type], outputs=output_ret,
+                     api_name='task_with_chat')
         gr.Examples(example, [input_text, task_type])
 
     with gr.Tab("MemChatDoc（文档问答）"):  # 根据文档进行提问
         def add_file(history, doc):
-            history = history + [(process_upload_file(doc), None)]
-            return history
+            message, doc_hash = process_upload_file(doc)
+            history = history + [(message, None)]
+            return history, doc_hash
 
         def add_text(history, inp):
             history = history + [(inp, None)]
             return history, ""
 
-        def bot(history, model_type):
-            history[-1][1] = chat_doc(query=history[-1][0], model_type=model_type)
-            return history
+        def bot(history, model_type, doc_hash):
+            for partial in chat_doc(query=history[-1][0], model_type=model_type, doc_hash=doc_hash):
+                history[-1][1] = partial
+                yield history
 
         chatbot = gr.Chatbot([("Welcome MemChatDoc. Please upload doc.", None)], show_label=False,
                              elem_id='chatbot').style(height="100%")
         model_type = gr.Dropdown(choices=["memect", "openai", "azure"], value='memect', label='选择模型类型')
-        state = gr.State([])
+        doc_state = gr.State(None)  # 当前会话上传文档的 hash
         with gr.Row():
             with gr.Column(scale=0.85):
                 txt = gr.Textbox(
@@ -236,10 +274,10 @@ with gr.Blocks(css="footer {visibility: hidden}", title='ChatLLM is all you need
             with gr.Column(scale=0.15, min_width=0):
                 btn = gr.UploadButton(label="📁上传文档", file_types=['file'])
 
-        txt.submit(add_text, inputs=[chatbot, txt], outputs=[chatbot, txt], queue=False).then(bot,
-                                                                                              [chatbot, model_type],
-                                                                                              chatbot)
-        btn.upload(add_file, inputs=[chatbot, btn], outputs=[chatbot]).then(bot, [chatbot, model_type], chatbot)
+        txt.submit(add_text, inputs=[chatbot, txt], outputs=[chatbot, txt], queue=False).then(
+            bot, [chatbot, model_type, doc_state], chatbot, api_name='doc_chat')
+        btn.upload(add_file, inputs=[chatbot, btn], outputs=[chatbot, doc_state], api_name='upload').then(
+            bot, [chatbot, model_type, doc_state], chatbot)
 
         clear = gr.Button("Clear")
         clear.click(lambda: None, None, chatbot, queue=False)
@@ -256,4 +294,6 @@ with gr.Blocks(css="footer {visibility: hidden}", title='ChatLLM is all you need
         clean_example.click(del_all_examples, inputs=[], outputs=result)
 
 init_store_dir(data_store_base_path)
+warm_up_embedding()
+demo.queue(concurrency_count=int(os.getenv('GRADIO_CONCURRENCY', 8)))  # 流式输出需要开启队列
 demo.launch(server_name=host, server_port=int(port), share=False)
\ No newline at end of file